@@ -1,31 +1,26 @@
 import streamlit as st
 import os
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
 import json
-import re
 from media_search import MediaSearch
+from script_analysis import analyze_script
 import uuid
 import time
 from dotenv import load_dotenv
 from video_generator import VideoGenerator
+from segment_library import SegmentLibrary
+from render_config import RenderConfig
+from encoder_profiles import ENCODER_PROFILES
+from project_file import project_to_bytes, load_project, PROJECT_EXTENSION
+from storage_manager import default_storage_manager
+from file_streaming import FileServer
+from media_fetcher import MediaFetcher
+from distributed_render import DistributedRenderQueue
+from media_ranking import auto_select_media, image_download, media_key
 import glob
 
 # 環境変数の読み込み
 load_dotenv()
 
-# NLTKのデータをダウンロード
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords')
-
 # アプリケーションの設定
 st.set_page_config(
     page_title="TikTok動画生成ツール",
@@ -115,11 +110,16 @@ st.markdown("""
 MEDIA_DIR = os.path.join(os.path.dirname(__file__), "media")
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
 AUDIO_DIR = os.path.join(os.path.dirname(__file__), "audio")
+SEGMENT_DIR = os.path.join(os.path.dirname(__file__), "segments")
+CHECKPOINT_DIR = os.path.join(os.path.dirname(__file__), "checkpoints")
+SESSION_REFERENCE_TTL = 24 * 60 * 60
 os.makedirs(MEDIA_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
 # セッション状態の初期化
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 if 'script' not in st.session_state:
     st.session_state.script = ""
 if 'scenes' not in st.session_state:
@@ -132,6 +132,8 @@ if 'selected_media' not in st.session_state:
     st.session_state.selected_media = {}
 if 'media_search_results' not in st.session_state:
     st.session_state.media_search_results = {}
+if 'used_media_keys' not in st.session_state:
+    st.session_state.used_media_keys = set()
 if 'generated_video' not in st.session_state:
     st.session_state.generated_video = None
 if 'video_options' not in st.session_state:
@@ -139,85 +141,93 @@ if 'video_options' not in st.session_state:
         'duration_per_scene': 5,
         'add_title': True,
         'add_ending': True,
-        'selected_bgm': None
+        'selected_bgm': None,
+        'encoder_profile': 'standard'
     }
 
 # メディア検索クライアントの初期化
 media_search = MediaSearch()
 
 # 動画生成クライアントの初期化
-video_generator = VideoGenerator(output_dir=OUTPUT_DIR)
+# TIKTOK_RENDER_SHARED_DIRを設定すると、シーンのレンダリングを共有キューのワーカーに任せる
+# （ワーカーのホストからもmediaディレクトリが同じパスで見える必要がある）
+RENDER_SHARED_DIR = os.getenv("TIKTOK_RENDER_SHARED_DIR")
+video_generator = VideoGenerator(
+    output_dir=OUTPUT_DIR,
+    segment_library=SegmentLibrary(SEGMENT_DIR),
+    checkpoint_dir=CHECKPOINT_DIR,
+    task_queue=DistributedRenderQueue(RENDER_SHARED_DIR) if RENDER_SHARED_DIR else None
+)
 
-# キーワード抽出関数
-def extract_keywords(text, num_keywords=5):
-    # テキストをトークン化
-    tokens = word_tokenize(text.lower())
-    
-    # ストップワードを取得（日本語と英語）
-    stop_words = set(stopwords.words('english'))
-    try:
-        stop_words.update(stopwords.words('japanese'))
-    except:
-        pass  # 日本語のストップワードがない場合は無視
-    
-    # 記号や数字を除去
-    tokens = [token for token in tokens if token.isalpha()]
-    
-    # ストップワードを除去
-    tokens = [token for token in tokens if token not in stop_words]
-    
-    # 単語の頻度をカウント
-    word_freq = {}
-    for token in tokens:
-        if token in word_freq:
-            word_freq[token] += 1
-        else:
-            word_freq[token] = 1
-    
-    # 頻度順にソート
-    sorted_words = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)
+# ストレージ管理（プロセスごとに1つ作成し、バックグラウンドで古いファイルを削除する）
+@st.cache_resource
+def get_storage_manager():
+    manager = default_storage_manager(os.path.dirname(os.path.abspath(__file__)))
+    manager.start_background()
+    return manager
+
+storage_manager = get_storage_manager()
+
+# メディアのダウンロード（全セッションで共有し、ホストごとの同時接続数を制限する）
+@st.cache_resource
+def get_media_fetcher():
+    return MediaFetcher()
+
+media_fetcher = get_media_fetcher()
+
+# 出力動画の配信サーバー（Streamlitを経由せず、ブラウザがRangeリクエストで直接取得する）
+# ブラウザから届くURLが分からない場合は起動せず、Streamlit経由で表示・ダウンロードする
+@st.cache_resource
+def get_file_server():
+    public_url = os.getenv("TIKTOK_FILE_SERVER_URL")
+    if not public_url:
+        return None
+    return FileServer(
+        OUTPUT_DIR,
+        host=os.getenv("TIKTOK_FILE_SERVER_HOST", "0.0.0.0"),
+        port=int(os.getenv("TIKTOK_FILE_SERVER_PORT", "8502")),
+        public_url=public_url
+    ).start()
+
+file_server = get_file_server()
+
+# セッションが使用中のファイル（選択済みメディア・生成した動画）を登録する
+def update_session_references():
+    paths = [
+        item['local_path']
+        for items in st.session_state.selected_media.values()
+        for item in items
+    ]
+    if st.session_state.generated_video:
+        paths.append(st.session_state.generated_video)
     
-    # 上位のキーワードを返す
-    return [word for word, freq in sorted_words[:num_keywords]]
-
-# シーン分割関数
-def split_into_scenes(script):
-    # シーンの区切りを検出（空行や特定のマーカーで区切られていると仮定）
-    scenes = re.split(r'\n\s*\n', script)
-    # 空のシーンを除去
-    scenes = [scene.strip() for scene in scenes if scene.strip()]
-    return scenes
-
-# 台本解析関数
-def analyze_script(script):
-    scenes = split_into_scenes(script)
-    scene_keywords = {}
+    # 変更があったときだけ書き込む（参照は1日で期限切れ）
+    if st.session_state.get('registered_paths') != sorted(paths):
+        storage_manager.set_references(
+            f"session:{st.session_state.session_id}", paths, ttl_seconds=SESSION_REFERENCE_TTL
+        )
+        st.session_state.registered_paths = sorted(paths)
+
+# メディア検索関数（提供元ごとの結果を届いた順に返す）
+def stream_media_for_scene(scene_id, keyword, media_type='image'):
+    cache_key = f"{scene_id}_{keyword}" if media_type == 'image' else f"{scene_id}_{media_type}_{keyword}"
     
-    for i, scene in enumerate(scenes):
-        keywords = extract_keywords(scene)
-        scene_keywords[f"シーン{i+1}"] = {
-            "text": scene,
-            "keywords": keywords
-        }
+    # 提供元ごとの結果を届いた順にキャッシュする（途中で再実行されても選択ボタンの番号を一致させる）
+    batches = st.session_state.media_search_results.setdefault(cache_key, [])
     
-    return scenes, scene_keywords
-
-# メディア検索関数
-def search_media_for_scene(scene_id, keyword):
-    # 検索結果をキャッシュするためのキー
-    cache_key = f"{scene_id}_{keyword}"
+    # キャッシュ済みの結果を先に返し、まだ応答していない提供元だけを検索する
+    for source, batch in list(batches):
+        yield source, batch
     
-    # キャッシュに結果があれば使用
-    if cache_key in st.session_state.media_search_results:
-        return st.session_state.media_search_results[cache_key]
+    answered = {source for source, _ in batches}
+    if media_type == 'video':
+        pending = media_search.iter_search_videos(keyword, per_page=3, skip=answered)
+    else:
+        pending = media_search.iter_search_images(keyword, per_page=6, skip=answered)
     
-    # 検索実行
-    with st.spinner(f"「{keyword}」の画像を検索中..."):
-        results = media_search.search_images(keyword, per_page=6)
-        
-    # 結果をキャッシュ
-    st.session_state.media_search_results[cache_key] = results
-    return results
+    for source, batch in pending:
+        batches.append((source, batch))
+        yield source, batch
 
 # メディア選択関数
 def select_media_for_scene(scene_id, media_item):
@@ -229,17 +239,106 @@ def select_media_for_scene(scene_id, media_item):
         if item['id'] == media_item['id'] and item['source'] == media_item['source']:
             return  # 既に選択済み
     
-    # メディアをダウンロード
-    file_ext = os.path.splitext(media_item['medium_url'])[-1] or '.jpg'
-    filename = f"{uuid.uuid4()}{file_ext}"
-    save_path = os.path.join(MEDIA_DIR, filename)
+    # 選択を記録し、ダウンロードはバックグラウンドで行う
+    media_item['local_path'] = request_media_download(media_item)
+    st.session_state.selected_media[scene_id].append(media_item)
+    return True
+
+# メディアのダウンロードを予約し、保存先のパスを返す
+def request_media_download(media_item):
+    if media_item.get('media_type') == 'video':
+        # 動画はシーン内の表示時間と画面サイズに合った最小のレンディションを取得
+        rendition = media_search.choose_rendition(
+            media_item,
+            target_width=video_generator.width,
+            target_height=video_generator.height,
+            duration=st.session_state.video_options['duration_per_scene']
+        )
+        url = rendition['url']
+        save_path = os.path.join(MEDIA_DIR, f"{uuid.uuid4()}.mp4")
+    else:
+        url, file_ext = image_download(media_item)
+        save_path = os.path.join(MEDIA_DIR, f"{uuid.uuid4()}{file_ext}")
+    return media_fetcher.submit(url, save_path)
+
+# ダウンロード中の選択済みメディアの保存先
+def pending_media_paths():
+    paths = []
+    for items in st.session_state.selected_media.values():
+        for item in items:
+            status = media_fetcher.status(item['local_path'])
+            if status and status['status'] in ('pending', 'running'):
+                paths.append(item['local_path'])
+    return paths
+
+# ダウンロードに失敗した（またはファイルが削除された）メディアを選択から外し、外した数を返す
+def remove_failed_media():
+    failed = []
+    finished = []
+    for scene_id, items in st.session_state.selected_media.items():
+        for item in list(items):
+            status = media_fetcher.status(item['local_path'])
+            if status and status['status'] == 'done':
+                finished.append(item['local_path'])
+            if os.path.exists(item['local_path']) or (status and status['status'] in ('pending', 'running')):
+                continue
+            items.remove(item)
+            failed.append(item['local_path'])
+    # 終了したダウンロードの記録は不要なため削除する（残すとプロセスの実行中に増え続ける）
+    media_fetcher.forget(finished + failed)
+    return len(failed)
+
+# 全ての予約済みダウンロードの進捗を1つのバーで表示し、完了したら画面を更新する
+def show_download_progress():
+    pending = pending_media_paths()
+    if not pending:
+        return
     
-    if media_search.download_media(media_item['medium_url'], save_path):
-        # ダウンロードしたファイルパスを追加
-        media_item['local_path'] = save_path
-        st.session_state.selected_media[scene_id].append(media_item)
-        return True
-    return False
+    progress_bar = st.progress(0.0, text="メディアをダウンロード中...")
+    while True:
+        progress = media_fetcher.progress(pending)
+        if progress['finished'] == progress['count']:
+            break
+        if progress['total_bytes']:
+            ratio = progress['bytes'] / progress['total_bytes']
+        else:
+            ratio = progress['finished'] / max(1, progress['count'])
+        progress_bar.progress(
+            min(ratio, 1.0),
+            text=f"メディアをダウンロード中...（残り{progress['count'] - progress['finished']}件）"
+        )
+        time.sleep(0.2)
+    
+    # 選択済みメディアの表示とステップ3への移動を有効にするため一度だけ再実行する
+    st.experimental_rerun()
+
+# 選択済みメディアのサムネイル表示（動画はプレビュー画像を表示）
+def show_media_thumbnail(item, caption, width=None):
+    if item.get('media_type') == 'video':
+        st.image(item['preview_url'], caption=f"{caption}（動画）", width=width)
+    elif not os.path.exists(item['local_path']):
+        st.image(item['preview_url'], caption=f"{caption}（ダウンロード中）", width=width)
+    else:
+        st.image(item['local_path'], caption=caption, width=width)
+
+# メディア自動選択関数
+def auto_select_media_for_scenes(per_scene):
+    selections = auto_select_media(
+        st.session_state.keywords,
+        lambda keyword: media_search.search_images(keyword, per_page=6),
+        per_scene=per_scene,
+        target_width=video_generator.width,
+        target_height=video_generator.height,
+        used_keys=st.session_state.used_media_keys,
+        existing=st.session_state.selected_media
+    )
+    # ダウンロードの完了を待たずに選択に追加する
+    for items in selections.values():
+        for item in items:
+            if not item.get('local_path'):
+                item['local_path'] = request_media_download(item)
+    st.session_state.selected_media.update(selections)
+    return selections
 
 # 利用可能なBGMを取得
 def get_available_bgm():
@@ -250,25 +349,31 @@ def get_available_bgm():
 def generate_video():
     try:
         with st.spinner("動画を生成中..."):
-            output_filename = f"tiktok_video_{int(time.time())}.mp4"
-            
-            # 動画オプションを設定
-            video_generator.scene_duration = st.session_state.video_options['duration_per_scene']
-            video_generator.add_title = st.session_state.video_options['add_title']
-            video_generator.add_ending = st.session_state.video_options['add_ending']
+            # 同時に生成しても衝突しないファイル名
+            output_filename = f"tiktok_video_{int(time.time())}_{uuid.uuid4().hex[:8]}.mp4"
             
             # BGMの設定
             bgm_path = None
             if st.session_state.video_options['selected_bgm']:
                 bgm_path = os.path.join(AUDIO_DIR, st.session_state.video_options['selected_bgm'])
             
+            # ジョブごとの不変な設定を作成（共有の生成クライアントは変更しない）
+            config = RenderConfig.from_options(
+                st.session_state.video_options,
+                output_filename,
+                bgm_path=bgm_path
+            )
+            
             output_path = video_generator.generate_video(
                 st.session_state.keywords,
                 st.session_state.selected_media,
-                output_filename=output_filename,
-                bgm_path=bgm_path
+                config=config
             )
             st.session_state.generated_video = output_path
+            
+            # 次の動画の自動選択で同じ画像を避けるために使用履歴を記録
+            for items in st.session_state.selected_media.values():
+                st.session_state.used_media_keys.update(media_key(item) for item in items)
             return output_path
     except Exception as e:
         st.error(f"動画生成中にエラーが発生しました: {str(e)}")
@@ -297,6 +402,43 @@ def main():
         else:
             st.sidebar.write(step)
     
+    # プロジェクトの保存と読み込み
+    with st.sidebar.expander("プロジェクト"):
+        # ファイルの作成はメディアのハッシュ計算を伴うため、ボタンを押したときだけ行う
+        if st.session_state.selected_media and not pending_media_paths() \
+                and st.button("保存用ファイルを作成", use_container_width=True):
+            st.session_state.project_bytes = project_to_bytes(
+                st.session_state.script,
+                st.session_state.scenes,
+                st.session_state.keywords,
+                st.session_state.selected_media,
+                st.session_state.video_options,
+                audio_dir=AUDIO_DIR
+            )
+        if st.session_state.get('project_bytes'):
+            st.download_button(
+                label="プロジェクトを保存",
+                data=st.session_state.project_bytes,
+                file_name=f"tiktok_project_{int(time.time())}{PROJECT_EXTENSION}",
+                mime="application/zip",
+                use_container_width=True
+            )
+        
+        project_upload = st.file_uploader("プロジェクトを開く", type=[PROJECT_EXTENSION.lstrip('.')])
+        if project_upload and st.button("読み込む", use_container_width=True):
+            try:
+                project = load_project(project_upload, MEDIA_DIR, audio_dir=AUDIO_DIR)
+                st.session_state.script = project['script']
+                st.session_state.scenes = project['scenes']
+                st.session_state.keywords = project['keywords']
+                st.session_state.selected_media = project['selected_media']
+                st.session_state.video_options.update(project['video_options'])
+                st.session_state.generated_video = None
+                st.session_state.current_step = 3
+                st.experimental_rerun()
+            except Exception as e:
+                st.error(f"プロジェクトの読み込みに失敗しました: {str(e)}")
+    
     # ヘルプ情報
     with st.sidebar.expander("ヘルプ"):
         st.write("""
@@ -411,6 +553,15 @@ def main():
                 </div>
                 """, unsafe_allow_html=True)
             
+            # メディアの自動選択（選択済みのシーンはそのまま）
+            col1, col2 = st.columns([1, 1])
+            with col1:
+                auto_per_scene = st.number_input("シーンごとの自動選択枚数", min_value=1, max_value=3, value=1)
+            with col2:
+                if st.button("未選択のシーンに画像を自動選択", use_container_width=True):
+                    with st.spinner("画像を検索・選択中..."):
+                        auto_select_media_for_scenes(auto_per_scene)
+            
             st.write("台本から抽出されたシーンとキーワード:")
             
             for scene_id, scene_data in st.session_state.keywords.items():
@@ -428,39 +579,54 @@ def main():
                     
                     if search_custom:
                         if custom_keyword:
-                            results = search_media_for_scene(scene_id, custom_keyword)
                             st.session_state[f"active_keyword_{scene_id}"] = custom_keyword
                     
                     # 抽出キーワードボタン
                     st.markdown('<div style="margin-top: 10px;">', unsafe_allow_html=True)
                     for i, keyword in enumerate(scene_data['keywords']):
                         if st.button(keyword, key=f"keyword_{scene_id}_{i}"):
-                            results = search_media_for_scene(scene_id, keyword)
                             st.session_state[f"active_keyword_{scene_id}"] = keyword
                     st.markdown('</div>', unsafe_allow_html=True)
                     
+                    # 検索するメディアの種類
+                    media_type_label = st.radio(
+                        "メディアの種類",
+                        ["画像", "動画"],
+                        key=f"media_type_{scene_id}",
+                        horizontal=True
+                    )
+                    media_type = 'video' if media_type_label == "動画" else 'image'
+                    
                     # アクティブなキーワードがあれば検索結果を表示
                     active_keyword = st.session_state.get(f"active_keyword_{scene_id}", None)
                     if active_keyword:
                         st.markdown(f"**「{active_keyword}」の検索結果:**")
-                        results = search_media_for_scene(scene_id, active_keyword)
+                        status = st.empty()
+                        shown = 0
                         
-                        if not results:
-                            st.warning("検索結果がありません。別のキーワードを試してください。")
-                        else:
-                            # 検索結果の表示
+                        # 提供元の応答が届くたびに検索結果を追加表示する
+                        for source, batch in stream_media_for_scene(scene_id, active_keyword, media_type):
+                            if source:
+                                status.info(f"「{active_keyword}」の{media_type_label}を検索中...（{source}の結果を受信）")
+                            if not batch:
+                                continue
                             cols = st.columns(3)
-                            for i, item in enumerate(results):
-                                col = cols[i % 3]
+                            for j, item in enumerate(batch):
+                                i = shown + j
+                                col = cols[j % 3]
                                 with col:
                                     st.markdown(f'<div class="media-card">', unsafe_allow_html=True)
                                     st.image(item['preview_url'], caption=f"出典: {item['source']}")
                                     if st.button("選択", key=f"select_{scene_id}_{i}"):
                                         if select_media_for_scene(scene_id, item):
                                             st.success("メディアを選択しました")
-                                            time.sleep(0.5)
-                                            st.experimental_rerun()
                                     st.markdown('</div>', unsafe_allow_html=True)
+                            shown += len(batch)
+                        
+                        if shown == 0:
+                            status.warning("検索結果がありません。別のキーワードを試してください。")
+                        else:
+                            status.empty()
                     
                     # 選択済みメディアの表示
                     if scene_id in st.session_state.selected_media and st.session_state.selected_media[scene_id]:
@@ -470,12 +636,19 @@ def main():
                         for i, item in enumerate(st.session_state.selected_media[scene_id]):
                             with selected_cols[i]:
                                 st.markdown(f'<div class="media-card">', unsafe_allow_html=True)
-                                st.image(item['local_path'], caption=f"選択済み {i+1}")
+                                show_media_thumbnail(item, f"選択済み {i+1}")
                                 if st.button("削除", key=f"remove_{scene_id}_{i}"):
-                                    st.session_state.selected_media[scene_id].pop(i)
+                                    removed = st.session_state.selected_media[scene_id].pop(i)
+                                    # ダウンロード中の場合は終了時に記録を削除する
+                                    media_fetcher.forget([removed['local_path']])
                                     st.experimental_rerun()
                                 st.markdown('</div>', unsafe_allow_html=True)
             
+            failed_count = remove_failed_media()
+            if failed_count:
+                st.warning(f"{failed_count}件のメディアをダウンロードできなかったため、選択から外しました")
+            downloads_pending = bool(pending_media_paths())
+            
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("台本入力に戻る", use_container_width=True):
@@ -487,12 +660,16 @@ def main():
                                           len(st.session_state.selected_media[scene_id]) > 0 
                                           for scene_id in st.session_state.keywords)
                 
-                if st.button("次へ進む（動画生成）", disabled=not all_scenes_have_media, use_container_width=True):
+                if st.button("次へ進む（動画生成）", disabled=not all_scenes_have_media or downloads_pending,
+                             use_container_width=True):
                     st.session_state.current_step = 3
                     st.experimental_rerun()
                 
                 if not all_scenes_have_media:
                     st.warning("全てのシーンに少なくとも1つのメディアを選択してください")
+            
+            # 選択したメディアのダウンロードが全て終わるまで進捗を表示する
+            show_download_progress()
     
     # ステップ3: 動画生成
     elif st.session_state.current_step == 3:
@@ -509,7 +686,7 @@ def main():
                     media_cols = st.columns(min(3, len(st.session_state.selected_media[scene_id])))
                     for i, item in enumerate(st.session_state.selected_media[scene_id]):
                         with media_cols[i % 3]:
-                            st.image(item['local_path'], caption=f"メディア {i+1}", width=150)
+                            show_media_thumbnail(item, f"メディア {i+1}", width=150)
                 st.markdown("---")
         
         # 動画生成オプション
@@ -534,6 +711,14 @@ def main():
                 "エンディングスライドを追加", 
                 value=st.session_state.video_options['add_ending']
             )
+            
+            # エンコード品質（draft: 確認用の高速出力、archive: 保存用の高画質出力）
+            encoder_options = list(ENCODER_PROFILES.keys())
+            st.session_state.video_options['encoder_profile'] = st.selectbox(
+                "エンコード品質",
+                options=encoder_options,
+                index=encoder_options.index(st.session_state.video_options.get('encoder_profile', 'standard'))
+            )
         
         with col2:
             # BGM選択（サンプルBGMがある場合）
@@ -563,6 +748,24 @@ def main():
             else:
                 st.info("BGMファイルが見つかりません。audioディレクトリにMP3ファイルを追加してください。")
         
+        # レンダリング計画と所要時間・メモリの推定
+        try:
+            estimate_config = RenderConfig.from_options(st.session_state.video_options, "estimate.mp4")
+            plan = video_generator.plan_render(
+                st.session_state.keywords,
+                st.session_state.selected_media,
+                estimate_config
+            )
+            estimate = video_generator.estimate_render(plan)
+            st.markdown("### 生成時間の目安")
+            est_cols = st.columns(4)
+            est_cols[0].metric("動画の長さ", f"{estimate['duration']:.0f} 秒")
+            est_cols[1].metric("フレーム数", f"{estimate['frames']:,}")
+            est_cols[2].metric("推定生成時間", f"{estimate['wall_seconds'] / 60:.1f} 分")
+            est_cols[3].metric("推定メモリ", f"{estimate['peak_memory_mb']:.0f} MB")
+        except Exception as e:
+            st.warning(f"生成時間を推定できませんでした: {str(e)}")
+        
         # 動画生成ボタン
         col1, col2, col3 = st.columns([1, 2, 1])
         with col2:
@@ -594,20 +797,33 @@ def main():
             st.write(f"ファイル名: {os.path.basename(st.session_state.generated_video)}")
             st.write(f"ファイルサイズ: {video_size:.2f} MB")
             
-            # 動画プレビュー
-            st.video(st.session_state.generated_video)
-            
-            # ダウンロードボタン
-            col1, col2, col3 = st.columns([1, 2, 1])
-            with col2:
-                with open(st.session_state.generated_video, "rb") as file:
-                    st.download_button(
-                        label="動画をダウンロード",
-                        data=file,
-                        file_name=os.path.basename(st.session_state.generated_video),
-                        mime="video/mp4",
+            if file_server is not None:
+                # 動画プレビュー（ファイルを読み込まずにURLで渡し、ブラウザが必要な範囲だけ取得する）
+                st.video(file_server.url_for(st.session_state.generated_video))
+                
+                # ダウンロードボタン
+                col1, col2, col3 = st.columns([1, 2, 1])
+                with col2:
+                    st.link_button(
+                        "動画をダウンロード",
+                        file_server.url_for(st.session_state.generated_video, download=True),
                         use_container_width=True
                     )
+            else:
+                # 動画プレビュー
+                st.video(st.session_state.generated_video)
+                
+                # ダウンロードボタン
+                col1, col2, col3 = st.columns([1, 2, 1])
+                with col2:
+                    with open(st.session_state.generated_video, "rb") as file:
+                        st.download_button(
+                            label="動画をダウンロード",
+                            data=file,
+                            file_name=os.path.basename(st.session_state.generated_video),
+                            mime="video/mp4",
+                            use_container_width=True
+                        )
             
             st.markdown("""
             ### 次のステップ
@@ -652,6 +868,8 @@ def main():
                 st.session_state.current_step = 1
                 st.experimental_rerun()
     
+    update_session_references()
+    
     # フッター
     st.markdown('<div class="footer">TikTok動画生成ツール © 2025</div>', unsafe_allow_html=True)
 
@@ -0,0 +1,259 @@
+import sys
+import time
+import argparse
+import itertools
+import numpy as np
+
+# フェード係数の固定小数点の1.0（8ビットシフトで割り算を置き換える）
+FADE_ONE = 256
+# シーン・背景メディアのフェードイン・アウトの長さ（秒）
+FADE_DURATION = 0.5
+
+_layout_tokens = itertools.count()
+
+
+def fade_level(t, duration, fade_in=FADE_DURATION, fade_out=FADE_DURATION):
+    """時刻tのフェード係数を0〜FADE_ONEの整数で返す（moviepyのfadein/fadeoutと同じ直線）"""
+    level = 1.0
+    if fade_in > 0 and t < fade_in:
+        level = t / fade_in
+    if fade_out > 0 and t > duration - fade_out:
+        level = min(level, (duration - t) / fade_out)
+    return int(round(max(0.0, min(1.0, level)) * FADE_ONE))
+
+
+class CaptionLayer:
+    """背景ボックス付きキャプションを乗算済みアルファで保持するレイヤー
+    
+    テキストのRGBAと半透明のボックスをシーンごとに一度だけ1枚にまとめ、
+    フレームごとの合成は「背景 × 逆アルファ + 乗算済みの色」の整数演算だけで行う。
+    合成用のバッファもここで確保し、フレームごとには確保しない。
+    """
+    
+    def __init__(self, rgba, x, y, padding=20, box_color=(0, 0, 0), box_alpha=128):
+        text_h, text_w = rgba.shape[:2]
+        self.x = x
+        self.y = y
+        self.h = text_h + padding * 2
+        self.w = text_w + padding * 2
+        
+        text_alpha = rgba[..., 3].astype(np.uint16)
+        box = np.asarray(box_color, dtype=np.uint16)
+        
+        # ボックスの上にテキストを重ねた合成アルファ（0〜255）
+        alpha = np.full((self.h, self.w), box_alpha, dtype=np.uint16)
+        inner = (slice(padding, padding + text_h), slice(padding, padding + text_w))
+        box_part = (box_alpha * (255 - text_alpha) + 127) // 255
+        alpha[inner] = text_alpha + box_part
+        
+        # 乗算済みの色（テキストの色×テキストのアルファ + ボックスの色×残りのアルファ）
+        color = np.empty((self.h, self.w, 3), dtype=np.uint16)
+        color[:] = (box * box_alpha + 127) // 255
+        color[inner] = (rgba[..., :3].astype(np.uint16) * text_alpha[..., None]
+                        + box * box_part[..., None] + 127) // 255
+        self.color = color
+        
+        # 逆アルファは0〜256に広げ、255での割り算を8ビットシフトにする
+        inverse = 255 - alpha
+        self.inverse = (inverse + (inverse >> 7))[..., None].astype(np.uint16)
+        
+        self._work = np.empty((self.h, self.w, 3), dtype=np.uint16)
+        self._faded = np.empty((self.h, self.w, 3), dtype=np.uint16)
+    
+    def region(self, frame):
+        """フレーム内でキャプションが重なる部分のビュー"""
+        return frame[self.y:self.y + self.h, self.x:self.x + self.w]
+    
+    def blend(self, frame, level=FADE_ONE):
+        """フレームにキャプションをその場で重ねる（levelはキャプションの色のフェード係数）"""
+        region = self.region(frame)
+        work = self._work
+        np.multiply(region, self.inverse, out=work, dtype=np.uint16)
+        np.right_shift(work, 8, out=work)
+        if level >= FADE_ONE:
+            np.add(work, self.color, out=work)
+        else:
+            np.multiply(self.color, level, out=self._faded, dtype=np.uint16)
+            np.right_shift(self._faded, 8, out=self._faded)
+            np.add(work, self._faded, out=work)
+        np.minimum(work, 255, out=work)
+        np.copyto(region, work, casting='unsafe')
+
+
+class FrameCompositor:
+    """固定レイアウト（背景メディア・キャプション・フェード）のフレーム合成
+    
+    出力フレームと作業用のバッファを事前に確保して使い回すため、返すフレームは
+    次にcomposeを呼ぶまでの間だけ有効。レンダリングするスレッドごとに1つ使う。
+    """
+    
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._frame = np.zeros((height, width, 3), dtype=np.uint8)
+        self._work = np.empty((height, width, 3), dtype=np.uint16)
+        # 時間で変化しない区間の合成結果（直前の1区間分のみ保持する）
+        self._static = None
+        self._static_key = None
+    
+    def _place(self, source):
+        """背景をフレームにコピーする（サイズが異なる場合は黒地の中央に配置）"""
+        frame = self._frame
+        if source.shape == frame.shape:
+            np.copyto(frame, source, casting='unsafe')
+            return
+        frame.fill(0)
+        src_h, src_w = source.shape[:2]
+        h, w = min(src_h, self.height), min(src_w, self.width)
+        dst_y, dst_x = (self.height - h) // 2, (self.width - w) // 2
+        src_y, src_x = (src_h - h) // 2, (src_w - w) // 2
+        frame[dst_y:dst_y + h, dst_x:dst_x + w] = source[src_y:src_y + h, src_x:src_x + w, :3]
+    
+    def fade(self, level, source=None):
+        """sourceのフレーム（省略時は出力フレーム）にフェード係数を掛けて出力フレームに書き込む"""
+        if source is None:
+            source = self._frame
+        if level >= FADE_ONE:
+            if source is not self._frame:
+                np.copyto(self._frame, source)
+            return
+        if level <= 0:
+            self._frame.fill(0)
+            return
+        np.multiply(source, level, out=self._work, dtype=np.uint16)
+        np.right_shift(self._work, 8, out=self._work)
+        np.copyto(self._frame, self._work, casting='unsafe')
+    
+    def compose(self, background, caption=None, background_level=FADE_ONE, caption_level=FADE_ONE):
+        """背景にフェードを掛け、キャプションを重ねたフレームを返す"""
+        self._place(background)
+        self.fade(background_level)
+        if caption is not None:
+            caption.blend(self._frame, caption_level)
+        return self._frame
+    
+    def compose_static(self, key, background, caption=None, level=FADE_ONE):
+        """背景とキャプションが変化しない区間のフレームを返す
+        
+        合成は区間の最初のフレームで一度だけ行い、以降は保持した結果をそのまま返す。
+        フェード中は背景とキャプションを同じ係数で暗くするため、保持した結果に
+        係数を掛けるだけでよい。keyは区間を識別する値で、変わると合成し直す。
+        """
+        if self._static_key != key:
+            self._place(background)
+            if caption is not None:
+                caption.blend(self._frame, FADE_ONE)
+            if self._static is None:
+                self._static = np.empty_like(self._frame)
+            np.copyto(self._static, self._frame)
+            self._static_key = key
+        if level >= FADE_ONE:
+            return self._static
+        self.fade(level, source=self._static)
+        return self._frame
+
+
+class SceneLayout:
+    """シーンの背景メディアの並びとキャプションから、時刻ごとのフレームを合成する
+    
+    layersは(開始時刻, 長さ, 背景の取得関数, フェードの有無, 静止画かどうか)のリスト。
+    背景の取得関数はレイヤー内の時刻を受け取り、RGBのuint8配列を返す。静止画のレイヤーは
+    同じ配列を返し続ける（ズームの前半・後半のように配列が切り替わってもよい）。
+    """
+    
+    def __init__(self, compositor, layers, caption, duration, fade_duration=FADE_DURATION):
+        self.compositor = compositor
+        self.layers = layers
+        self.caption = caption
+        self.duration = duration
+        self.fade_duration = fade_duration
+        self.token = next(_layout_tokens)
+    
+    def layer_at(self, t):
+        for index, layer in enumerate(self.layers):
+            start, length = layer[0], layer[1]
+            if t < start + length:
+                return index, layer
+        return len(self.layers) - 1, self.layers[-1]
+    
+    def make_frame(self, t):
+        index, (start, length, get_background, fades, static) = self.layer_at(t)
+        local_t = min(max(t - start, 0), length)
+        background_level = FADE_ONE
+        if fades:
+            background_level = fade_level(local_t, length, self.fade_duration, self.fade_duration)
+        caption_level = fade_level(t, self.duration, self.fade_duration, self.fade_duration)
+        background = get_background(local_t)
+        
+        # 静止画で背景とキャプションのフェードが揃っている間は、合成済みのフレームを使い回す
+        if static and background_level == caption_level:
+            key = (self.token, index, id(background))
+            return self.compositor.compose_static(key, background, self.caption, caption_level)
+        return self.compositor.compose(background, self.caption, background_level, caption_level)
+
+
+def _moviepy_scene(background, caption_rgba, duration, width, height):
+    """比較用: これまでのmoviepyのエフェクトの連鎖で同じシーンを作成する"""
+    from moviepy.editor import ImageClip, ColorClip, CompositeVideoClip
+    from moviepy.video.fx.fadein import fadein
+    from moviepy.video.fx.fadeout import fadeout
+    
+    img_clip = ImageClip(background).set_duration(duration).fx(fadein, FADE_DURATION).fx(fadeout, FADE_DURATION)
+    txt_clip = ImageClip(caption_rgba[..., :3])
+    txt_clip = txt_clip.set_mask(ImageClip(caption_rgba[..., 3] / 255.0, ismask=True))
+    bg = ColorClip(size=(txt_clip.w + 40, txt_clip.h + 40), color=(0, 0, 0)).set_duration(duration)
+    txt_clip = CompositeVideoClip([bg, txt_clip.set_position('center')])
+    txt_clip = txt_clip.set_position(('center', height - txt_clip.h - 100)).set_duration(duration)
+    txt_clip = txt_clip.fx(fadein, FADE_DURATION).fx(fadeout, FADE_DURATION)
+    return CompositeVideoClip([img_clip, txt_clip])
+
+
+def benchmark(duration=2, width=1080, height=1920, fps=30):
+    """合成画像でmoviepyのエフェクト連鎖とこのモジュールの合成のフレームレートを比較する"""
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    caption_rgba = rng.integers(0, 256, size=(240, width - 100, 4), dtype=np.uint8)
+    times = [i / fps for i in range(int(duration * fps))]
+    
+    compositor = FrameCompositor(width, height)
+    caption = CaptionLayer(caption_rgba, 30, height - (240 + 40) - 100)
+    results = {}
+    for name, static in [('compositor', False), ('static', True)]:
+        layout = SceneLayout(compositor, [(0, duration, lambda t: background, True, static)], caption, duration)
+        start = time.perf_counter()
+        for t in times:
+            layout.make_frame(t)
+        results[name] = len(times) / (time.perf_counter() - start)
+    
+    try:
+        clip = _moviepy_scene(background, caption_rgba, duration, width, height)
+    except ImportError:
+        return results
+    start = time.perf_counter()
+    for t in times:
+        clip.get_frame(t)
+    results['moviepy'] = len(times) / (time.perf_counter() - start)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="シーン合成のベンチマーク")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    bench_parser = subparsers.add_parser('bench', help="合成のフレームレートを計測する")
+    bench_parser.add_argument('--seconds', type=float, default=2, help="計測に使うシーンの長さ（秒）")
+    bench_parser.add_argument('--width', type=int, default=1080)
+    bench_parser.add_argument('--height', type=int, default=1920)
+    
+    args = parser.parse_args(argv)
+    if args.command == 'bench':
+        results = benchmark(args.seconds, args.width, args.height)
+        for name, frames_per_second in results.items():
+            print(f"{name:>10}: {frames_per_second:.1f} fps")
+        if 'moviepy' in results:
+            for name in ('compositor', 'static'):
+                print(f"高速化（{name}）: {results[name] / results['moviepy']:.1f} 倍")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,473 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+from render_config import estimate_scratch_bytes, scratch_workspace, get_scratch_root
+from encoder_profiles import encoder_job
+
+# ワーカーが応答しなくなったとみなすまでの時間（この間隔より短い周期で延長する）
+DEFAULT_LEASE_SECONDS = 60
+# 同じタスクを取り出せる回数（毎回ワーカーを落とすタスクで止まらないようにする）
+MAX_ATTEMPTS = 3
+# タスクを取り出すワーカーがいないとみなすまでの時間（この間どのタスクも進まなければ待つのをやめる）
+DEFAULT_IDLE_TIMEOUT = 300
+
+
+class DistributedRenderQueue:
+    def __init__(self, shared_dir, db_path=None):
+        """複数のホストで共有するシーン単位のレンダリングタスクのキュー
+        
+        shared_dirは全てのワーカーとコーディネーターから同じパスで見える共有ストレージ。
+        キュー（SQLite）とワーカーが書き出したセグメントはここに置く。
+        SQLiteのロックはNFSなどでは保証されないため、db_pathでロックが正しく動く
+        ファイルシステム上の場所を指定することもできる。
+        """
+        self.shared_dir = shared_dir
+        self.db_path = db_path or os.path.join(shared_dir, "render_queue.db")
+        os.makedirs(shared_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS render_jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    task_count INTEGER NOT NULL,
+                    coordinators INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS render_tasks (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    outputs TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, idx)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS render_tasks_status ON render_tasks (status, lease_expires)")
+            # 以前の形式のキューには、ジョブを待っているコーディネーターの数の列がない
+            columns = [row['name'] for row in conn.execute("PRAGMA table_info(render_jobs)")]
+            if 'coordinators' not in columns:
+                conn.execute("ALTER TABLE render_jobs ADD COLUMN coordinators INTEGER NOT NULL DEFAULT 0")
+        finally:
+            conn.close()
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def _row_to_task(self, row):
+        task = dict(row)
+        task.update(json.loads(task.pop('payload')))
+        task['outputs'] = json.loads(task['outputs']) if task['outputs'] else None
+        return task
+    
+    def job_dir(self, job_id):
+        return os.path.join(self.shared_dir, "segments", job_id)
+    
+    def submit_job(self, job_id, plan, encoder):
+        """計画のタイムライン要素ごとにタスクを登録する
+        
+        同じjob_idのジョブが既にある場合は完了済みのタスクを残し、失敗したタスクだけを
+        待機中に戻す（コーディネーターが再起動しても完了済みのシーンは再レンダリングしない）。
+        登録したコーディネーターは、結果を使い終わったらfinish_jobを呼ぶ。
+        """
+        now = time.time()
+        # スレッド数はワーカーのホストごとに決めるため含めない
+        encoder = {key: value for key, value in encoder.items() if key != 'threads'}
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR IGNORE INTO render_jobs (id, status, task_count, created_at, updated_at) "
+                "VALUES (?, 'running', ?, ?, ?)",
+                (job_id, len(plan['entries']), now, now)
+            )
+            # 同じジョブを待っているコーディネーターの数（全員が終わるまでセグメントを削除しない）
+            conn.execute(
+                "UPDATE render_jobs SET status = 'running', coordinators = coordinators + 1, updated_at = ? "
+                "WHERE id = ?",
+                (now, job_id)
+            )
+            for index, entry in enumerate(plan['entries']):
+                payload = {
+                    'index': index,
+                    'entry': entry,
+                    'profiles': plan['profiles'],
+                    'encoder': encoder,
+                    'size': [plan['width'], plan['height']],
+                    'fps': plan['fps']
+                }
+                conn.execute(
+                    "INSERT OR IGNORE INTO render_tasks (job_id, idx, status, payload, updated_at) "
+                    "VALUES (?, ?, 'queued', ?, ?)",
+                    (job_id, index, json.dumps(payload, ensure_ascii=False), now)
+                )
+            conn.execute(
+                "UPDATE render_tasks SET status = 'queued', attempts = 0, error = NULL, updated_at = ? "
+                "WHERE job_id = ? AND status = 'failed'",
+                (now, job_id)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return job_id
+    
+    def claim(self, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """待機中のタスク、またはリースが切れたタスクを取り出してリースする"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._expire_leases(conn, now)
+            row = conn.execute(
+                "SELECT * FROM render_tasks WHERE status = 'queued' ORDER BY updated_at, job_id, idx LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE render_tasks SET status = 'leased', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE job_id = ? AND idx = ?",
+                (worker, now + lease_seconds, now, row['job_id'], row['idx'])
+            )
+            conn.execute("COMMIT")
+            task = self._row_to_task(row)
+            task.update(status='leased', worker=worker, attempts=row['attempts'] + 1)
+            return task
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+    
+    def _expire_leases(self, conn, now):
+        """リースが切れたタスクを待機中に戻し、戻した数を返す
+
+        取り出し回数が上限に達したタスクは、毎回ワーカーを停止させている可能性があるため失敗にする。
+        """
+        conn.execute(
+            "UPDATE render_tasks SET status = 'failed', error = COALESCE(error, ?), updated_at = ? "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+            ("ワーカーが応答しなくなりました", now, now, MAX_ATTEMPTS)
+        )
+        cursor = conn.execute(
+            "UPDATE render_tasks SET status = 'queued', worker = NULL, updated_at = ? "
+            "WHERE status = 'leased' AND lease_expires < ?",
+            (now, now)
+        )
+        return cursor.rowcount
+    
+    def _update_owned(self, task, worker, sql, params):
+        """リースを持っているワーカーの場合のみタスクを更新し、更新できたかを返す"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"UPDATE render_tasks SET {sql}, updated_at = ? "
+                "WHERE job_id = ? AND idx = ? AND worker = ? AND status = 'leased'",
+                list(params) + [time.time(), task['job_id'], task['idx'], worker]
+            )
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+    
+    def heartbeat(self, task, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """リースを延長する（他のワーカーに取り直されていた場合はFalse）"""
+        return self._update_owned(task, worker, "lease_expires = ?", [time.time() + lease_seconds])
+    
+    def complete(self, task, worker, outputs):
+        return self._update_owned(task, worker, "status = 'done', outputs = ?", [json.dumps(outputs)])
+    
+    def fail(self, task, worker, error):
+        """失敗を記録し、取り出し回数が上限未満なら待機中に戻す"""
+        status = 'failed' if task['attempts'] >= MAX_ATTEMPTS else 'queued'
+        return self._update_owned(task, worker, "status = ?, error = ?", [status, error])
+    
+    def requeue_expired(self):
+        """リースが切れたタスクを待機中に戻し、戻した数を返す（ワーカーがいない間もコーディネーターが呼ぶ）"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            count = self._expire_leases(conn, time.time())
+            conn.execute("COMMIT")
+            return count
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+    
+    def tasks(self, job_id):
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT * FROM render_tasks WHERE job_id = ? ORDER BY idx", (job_id,)).fetchall()
+            return [self._row_to_task(row) for row in rows]
+        finally:
+            conn.close()
+    
+    def finish_job(self, job_id, status='done'):
+        """コーディネーターがジョブの結果を使い終わったことを記録する
+        
+        同じジョブを待っている他のコーディネーターがいなくなった時点でジョブを終了し、
+        完了した場合は共有ストレージのセグメントを削除する。削除した場合はTrueを返す。
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE render_jobs SET coordinators = MAX(coordinators - 1, 0), updated_at = ? WHERE id = ?",
+                (time.time(), job_id)
+            )
+            row = conn.execute("SELECT coordinators FROM render_jobs WHERE id = ?", (job_id,)).fetchone()
+            last = row is None or row['coordinators'] == 0
+            if last:
+                conn.execute("UPDATE render_jobs SET status = ? WHERE id = ?", (status, job_id))
+                if status == 'done':
+                    conn.execute("DELETE FROM render_tasks WHERE job_id = ?", (job_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        if last and status == 'done':
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+            return True
+        return False
+    
+    def summary(self):
+        """状態ごとのタスク数"""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) FROM render_tasks GROUP BY status").fetchall()
+            return {row[0]: row[1] for row in rows}
+        finally:
+            conn.close()
+    
+    def store_segment(self, task, profile, path, worker):
+        """ワーカーが書き出したセグメントを共有ストレージへ原子的にコピーする"""
+        job_dir = self.job_dir(task['job_id'])
+        os.makedirs(job_dir, exist_ok=True)
+        target = os.path.join(job_dir, f"{task['index']:03d}_{profile['name']}.mp4")
+        temp_path = os.path.join(job_dir, f".{os.path.basename(target)}.{worker.replace(':', '_')}.part")
+        shutil.copyfile(path, temp_path)
+        os.replace(temp_path, target)
+        return target
+    
+    def wait_for_job(self, job_id, progress_callback=None, poll_interval=1.0, timeout=None,
+                     idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        """全てのタスクの完了を待ち、要素ごとのセグメントのパス（プロファイル順）を返す
+        
+        どのタスクもidle_timeout秒以上進まず、リース中のタスクもない場合は、ワーカーが
+        起動していないとみなしてTimeoutErrorを送出する。成功・失敗のどちらの場合も、
+        呼び出し側は結果を使い終わったらfinish_jobを呼ぶ。
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        last_change = None
+        last_activity = time.time()
+        while True:
+            self.requeue_expired()
+            tasks = self.tasks(job_id)
+            if not tasks:
+                # submit_jobの後にタスクがない場合は、他のコーディネーターが削除している
+                raise RuntimeError(f"分散レンダリングのジョブ {job_id} のタスクがありません")
+            
+            failed = [task for task in tasks if task['status'] == 'failed']
+            if failed:
+                errors = '; '.join(f"#{task['index']}: {task['error']}" for task in failed)
+                raise RuntimeError(f"シーンのレンダリングに失敗しました: {errors}")
+            
+            done = [task for task in tasks if task['status'] == 'done']
+            if progress_callback:
+                progress_callback(len(done) / len(tasks))
+            if len(done) == len(tasks):
+                return [task['outputs'] for task in tasks]
+            
+            now = time.time()
+            # リースの延長や完了があればタスクの更新時刻が変わる
+            change = max(task['updated_at'] for task in tasks)
+            if change != last_change or any(task['status'] == 'leased' for task in tasks):
+                last_change = change
+                last_activity = now
+            if idle_timeout is not None and now - last_activity >= idle_timeout:
+                raise TimeoutError(
+                    f"{idle_timeout}秒間どのタスクも処理されませんでした（ワーカーが起動しているか確認してください）"
+                )
+            if deadline is not None and now >= deadline:
+                raise TimeoutError(f"分散レンダリングが{timeout}秒以内に完了しませんでした")
+            time.sleep(poll_interval)
+
+
+class RenderWorker:
+    def __init__(self, queue, generator, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS, concurrent_jobs=None):
+        """キューからシーンのタスクを取り出し、セグメントを共有ストレージに書き出すワーカー
+        
+        concurrent_jobsには同じホストで同時に実行するワーカーの数を指定する（コアをその数で分ける）。
+        """
+        self.queue = queue
+        self.generator = generator
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.concurrent_jobs = concurrent_jobs
+    
+    def _keep_lease(self, task, stop_event):
+        """レンダリング中はリースを定期的に延長する"""
+        while not stop_event.wait(self.lease_seconds / 3):
+            if not self.queue.heartbeat(task, self.worker_id, self.lease_seconds):
+                print(f"[{self.worker_id}] タスク {task['job_id']}#{task['index']} のリースを失いました")
+                return
+    
+    def render_task(self, task):
+        """タスクのタイムライン要素を全プロファイルのセグメントとして書き出す"""
+        generator = self.generator
+        if task['size'] != [generator.width, generator.height] or task['fps'] != generator.fps:
+            raise ValueError("ワーカーの解像度・フレームレートがジョブと一致しません")
+        
+        entry = dict(task['entry'], clip=None)
+        scratch_bytes = estimate_scratch_bytes([entry], task['profiles'])
+        with encoder_job(self.concurrent_jobs) as threads, scratch_workspace(scratch_bytes) as workspace, \
+                generator._frame_lease():
+            encoder = dict(task['encoder'], threads=threads)
+            paths = generator.export_entry(task['index'], entry, task['profiles'], encoder, workspace)
+            return [
+                self.queue.store_segment(task, profile, path, self.worker_id)
+                for profile, path in zip(task['profiles'], paths)
+            ]
+    
+    def run_once(self):
+        """タスクを1つ処理する（待機中のタスクがない場合はFalse）"""
+        task = self.queue.claim(self.worker_id, self.lease_seconds)
+        if task is None:
+            return False
+        
+        stop_event = threading.Event()
+        heartbeat = threading.Thread(target=self._keep_lease, args=(task, stop_event), daemon=True)
+        heartbeat.start()
+        try:
+            outputs = self.render_task(task)
+            if not self.queue.complete(task, self.worker_id, outputs):
+                print(f"[{self.worker_id}] タスク {task['job_id']}#{task['index']} は他のワーカーが担当しています")
+        except Exception as e:
+            print(f"[{self.worker_id}] タスク {task['job_id']}#{task['index']} のエラー: {e}")
+            self.queue.fail(task, self.worker_id, str(e))
+        finally:
+            stop_event.set()
+            heartbeat.join()
+        return True
+    
+    def run(self, stop_event=None, idle_interval=1.0, exit_when_idle=False):
+        """タスクを処理し続ける（exit_when_idleの場合は待機中のタスクがなくなったら終了）"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            if self.run_once():
+                continue
+            if exit_when_idle and not self.queue.summary().get('leased'):
+                return
+            stop_event.wait(idle_interval)
+
+
+def default_frame_store_dir():
+    """同じホストのワーカープロセスで共有するフレームストアの索引の場所"""
+    return os.path.join(get_scratch_root(), "tiktok_frame_store")
+
+
+def run_worker(shared_dir, db_path=None, lease_seconds=DEFAULT_LEASE_SECONDS, segment_dir=None,
+               exit_when_idle=False, frame_store_dir=None, concurrent_jobs=None):
+    """ワーカーを1つ実行する（ワーカープロセスのエントリーポイント）
+    
+    frame_store_dirを指定すると、デコード済みの画像とキャプションを同じホストの
+    他のワーカープロセスと共有メモリで共有する。concurrent_jobsは同じホストの
+    ワーカープロセスの数で、エンコードのスレッド数はコア数をこの数で割って決める。
+    """
+    from video_generator import VideoGenerator
+    from segment_library import SegmentLibrary
+    from frame_store import SharedFrameStore
+    
+    queue = DistributedRenderQueue(shared_dir, db_path=db_path)
+    generator = VideoGenerator(
+        output_dir=os.path.join(shared_dir, "worker_output"),
+        segment_library=SegmentLibrary(segment_dir) if segment_dir else None,
+        frame_store=SharedFrameStore(frame_store_dir) if frame_store_dir else None
+    )
+    worker = RenderWorker(queue, generator, lease_seconds=lease_seconds, concurrent_jobs=concurrent_jobs)
+    print(f"[{worker.worker_id}] ワーカーを起動しました（キュー: {queue.db_path}）")
+    try:
+        worker.run(exit_when_idle=exit_when_idle)
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="シーン単位の分散レンダリング")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    worker_parser = subparsers.add_parser('worker', help="タスクを処理するワーカーを起動する")
+    worker_parser.add_argument('--shared-dir', required=True, help="全てのホストから見える共有ディレクトリ")
+    worker_parser.add_argument('--db-path', help="キューのSQLiteファイル（既定: 共有ディレクトリ内）")
+    worker_parser.add_argument('--processes', type=int, default=1, help="このホストで起動するワーカー数")
+    worker_parser.add_argument('--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS)
+    worker_parser.add_argument('--segment-dir', help="テキストスライドのセグメントライブラリ")
+    worker_parser.add_argument('--exit-when-idle', action='store_true',
+                               help="待機中のタスクがなくなったら終了する")
+    worker_parser.add_argument('--frame-store-dir',
+                               help="ワーカープロセス間でデコード済みフレームを共有する索引の場所"
+                                    "（既定: --processesが2以上の場合はスクラッチ領域）")
+    
+    status_parser = subparsers.add_parser('status', help="タスクの状態ごとの数を表示する")
+    status_parser.add_argument('--shared-dir', required=True)
+    status_parser.add_argument('--db-path')
+    
+    args = parser.parse_args(argv)
+    if args.command == 'status':
+        queue = DistributedRenderQueue(args.shared_dir, db_path=args.db_path)
+        requeued = queue.requeue_expired()
+        if requeued:
+            print(f"リースが切れたタスクを{requeued}件待機中に戻しました")
+        for status, count in sorted(queue.summary().items()):
+            print(f"{status:>8}: {count}")
+        return
+    
+    frame_store_dir = args.frame_store_dir
+    # 共有メモリのフレームストアは終了したプロセスの参照を検出できるPOSIXのみで使う
+    if frame_store_dir is None and args.processes > 1 and os.name == 'posix':
+        frame_store_dir = default_frame_store_dir()
+    worker_args = (args.shared_dir, args.db_path, args.lease_seconds, args.segment_dir, args.exit_when_idle,
+                   frame_store_dir, args.processes if args.processes > 1 else None)
+    if args.processes <= 1:
+        run_worker(*worker_args)
+        return
+    
+    processes = [
+        multiprocessing.Process(target=run_worker, args=worker_args, name=f"render-worker-{i}")
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+
+# 名前付きエンコーダープロファイル
+ENCODER_PROFILES = {
+    'draft': {
+        'name': 'draft',
+        'codec': 'libx264',
+        'preset': 'ultrafast',
+        'crf': 30,
+        'tune': 'fastdecode',
+        'gop': 60,
+        'pix_fmt': 'yuv420p',
+        'faststart': True
+    },
+    'standard': {
+        'name': 'standard',
+        'codec': 'libx264',
+        'preset': 'medium',
+        'crf': 23,
+        'tune': None,
+        'gop': 60,
+        'pix_fmt': 'yuv420p',
+        'faststart': True
+    },
+    'archive': {
+        'name': 'archive',
+        'codec': 'libx264',
+        'preset': 'slow',
+        'crf': 18,
+        'tune': 'film',
+        'gop': 120,
+        'pix_fmt': 'yuv420p',
+        'faststart': True
+    },
+}
+
+# キャリブレーション結果の保存先
+CALIBRATION_FILE = os.getenv(
+    'TIKTOK_ENCODER_CALIBRATION',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'encoder_calibration.json')
+)
+
+# キャリブレーションで試すプリセット（速い順）
+CALIBRATION_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium']
+
+# 実行中のレンダリングジョブ数
+_active_jobs = 0
+_active_jobs_lock = threading.Lock()
+
+
+def load_calibration():
+    """キャリブレーション結果を読み込む（ない場合はNone）"""
+    if not os.path.exists(CALIBRATION_FILE):
+        return None
+    try:
+        with open(CALIBRATION_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"キャリブレーション読み込みエラー: {e}")
+        return None
+
+
+def get_encoder_profile(name='standard'):
+    """エンコーダープロファイルを取得する（standardはキャリブレーション結果のプリセットを使用）"""
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"不明なエンコーダープロファイル: {name}")
+    profile = dict(ENCODER_PROFILES[name])
+    
+    calibration = load_calibration()
+    if name == 'standard' and calibration and calibration.get('preset'):
+        profile['preset'] = calibration['preset']
+    return profile
+
+
+def encoder_ffmpeg_params(profile):
+    """プロファイルからffmpegの出力パラメータを作成する（プリセットはwriterに渡す）"""
+    params = [
+        '-crf', str(profile['crf']),
+        '-g', str(profile['gop']),
+        '-pix_fmt', profile['pix_fmt']
+    ]
+    if profile.get('tune'):
+        params += ['-tune', profile['tune']]
+    if profile.get('faststart'):
+        params += ['-movflags', '+faststart']
+    return params
+
+
+def available_cores():
+    """このプロセスが使用できるCPUコア数を取得する"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def allocate_threads(concurrent_jobs=None):
+    """使用可能なコア数を同時実行ジョブ数で割ってスレッド数を決める"""
+    if concurrent_jobs is None:
+        concurrent_jobs = int(os.getenv('TIKTOK_CONCURRENT_JOBS', '0')) or max(1, _active_jobs)
+    threads = max(1, available_cores() // max(1, concurrent_jobs))
+    
+    # キャリブレーションで効果が頭打ちになったスレッド数を上限とする
+    calibration = load_calibration()
+    if calibration and calibration.get('threads'):
+        threads = min(threads, calibration['threads'])
+    return threads
+
+
+def active_job_count():
+    """このプロセスで実行中のレンダリングジョブ数"""
+    return _active_jobs
+
+
+@contextmanager
+def encoder_job(concurrent_jobs=None):
+    """レンダリングジョブを登録し、このジョブに割り当てるスレッド数を返す
+
+    concurrent_jobsを指定すると、このプロセスの実行中のジョブ数の代わりにその数でコアを分ける
+    （同じホストで複数のワーカープロセスを実行する場合など）。
+    """
+    global _active_jobs
+    with _active_jobs_lock:
+        _active_jobs += 1
+    try:
+        yield allocate_threads(concurrent_jobs)
+    finally:
+        with _active_jobs_lock:
+            _active_jobs -= 1
+
+
+def _benchmark(preset, threads, duration, width, height, fps):
+    """合成映像をエンコードしてかかった時間を計測する"""
+    import tempfile
+    import numpy as np
+    from moviepy.editor import VideoClip
+    
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    
+    def make_frame(t):
+        # 毎フレーム少しずつ動く映像にして、静止画よりも実際の負荷に近づける
+        return np.roll(base, int(t * 40), axis=1)
+    
+    clip = VideoClip(make_frame, duration=duration)
+    profile = dict(ENCODER_PROFILES['standard'], preset=preset)
+    with tempfile.TemporaryDirectory() as work_dir:
+        start = time.time()
+        clip.write_videofile(
+            os.path.join(work_dir, 'calibration.mp4'),
+            fps=fps,
+            codec=profile['codec'],
+            preset=preset,
+            threads=threads,
+            audio=False,
+            ffmpeg_params=encoder_ffmpeg_params(profile),
+            logger=None
+        )
+        return time.time() - start
+
+
+def calibrate(latency_target, video_seconds=60, sample_seconds=3, width=1080, height=1920, fps=30):
+    """ホストでエンコード速度を計測し、目標時間内に収まるプリセットとスレッド数を記録する
+
+    latency_targetはvideo_seconds秒の動画のエンコードにかけてよい秒数。
+    """
+    cores = available_cores()
+    thread_options = sorted({1, 2, 4, 8, 16, 32, cores})
+    thread_options = [t for t in thread_options if t <= cores]
+    
+    results = []
+    for preset in CALIBRATION_PRESETS:
+        for threads in thread_options:
+            elapsed = _benchmark(preset, threads, sample_seconds, width, height, fps)
+            estimated = elapsed * video_seconds / sample_seconds
+            results.append({'preset': preset, 'threads': threads, 'estimated_seconds': estimated})
+            print(f"{preset:>10} threads={threads:<3} 推定 {estimated:.1f} 秒")
+    
+    # スレッドを増やしても10%以上速くならない地点をスレッド数の上限とする
+    best_threads = thread_options[0]
+    medium_results = [r for r in results if r['preset'] == 'medium']
+    for previous, current in zip(medium_results, medium_results[1:]):
+        if current['estimated_seconds'] < previous['estimated_seconds'] * 0.9:
+            best_threads = current['threads']
+    
+    # 目標時間内に収まる最も高品質（遅い）プリセットを選ぶ
+    best_preset = CALIBRATION_PRESETS[0]
+    for preset in CALIBRATION_PRESETS:
+        for result in results:
+            if (result['preset'] == preset and result['threads'] == best_threads
+                    and result['estimated_seconds'] <= latency_target):
+                best_preset = preset
+    
+    calibration = {
+        'cores': cores,
+        'latency_target': latency_target,
+        'video_seconds': video_seconds,
+        'preset': best_preset,
+        'threads': best_threads,
+        'calibrated_at': int(time.time()),
+        'results': results
+    }
+    with open(CALIBRATION_FILE, 'w', encoding='utf-8') as f:
+        json.dump(calibration, f, ensure_ascii=False, indent=2)
+    return calibration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="エンコーダーのキャリブレーション")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    calibrate_parser = subparsers.add_parser('calibrate', help="ホストのエンコード速度を計測する")
+    calibrate_parser.add_argument('--latency-target', type=float, default=60,
+                                  help="動画1本のエンコードにかけてよい秒数")
+    calibrate_parser.add_argument('--video-seconds', type=float, default=60,
+                                  help="想定する動画の長さ（秒）")
+    calibrate_parser.add_argument('--sample-seconds', type=float, default=3,
+                                  help="計測に使う合成映像の長さ（秒）")
+    
+    args = parser.parse_args(argv)
+    if args.command == 'calibrate':
+        calibration = calibrate(args.latency_target, args.video_seconds, args.sample_seconds)
+        print(f"推奨設定: preset={calibration['preset']} threads={calibration['threads']}")
+        print(f"保存先: {CALIBRATION_FILE}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+import os
+import subprocess
+
+
+def get_ffmpeg_binary():
+    """moviepyが使用しているffmpegのパスを取得する"""
+    # ffmpegを実行しないモジュール（file_streamingのファイル配信など）はmoviepyなしで使えるよう遅延して読み込む
+    from moviepy.config import get_setting
+    return get_setting("FFMPEG_BINARY")
+
+
+def run_ffmpeg(args):
+    """ffmpegを実行する（失敗時は標準エラー出力を含めて例外を送出）"""
+    cmd = [get_ffmpeg_binary(), '-y', '-loglevel', 'error'] + list(args)
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpegの実行に失敗しました: {result.stderr.decode('utf-8', 'replace')}")
+
+
+def concat_segments(segment_paths, output_path, audiofile=None, work_dir=None, faststart=True):
+    """エンコード済みセグメントを再エンコードせずに連結する
+
+    セグメントは同じコーデック・解像度・フレームレート・ピクセルフォーマットで
+    エンコードされている必要がある。audiofileを指定した場合は音声をコピーで多重化する。
+    """
+    list_path = os.path.join(work_dir or os.path.dirname(output_path),
+                             os.path.basename(output_path) + '.concat.txt')
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    
+    args = ['-f', 'concat', '-safe', '0', '-i', list_path]
+    if audiofile:
+        args += ['-i', audiofile, '-map', '0:v', '-map', '1:a', '-c:a', 'copy', '-shortest']
+    args += ['-c:v', 'copy']
+    if faststart:
+        args += ['-movflags', '+faststart']
+    args.append(output_path)
+    
+    try:
+        run_ffmpeg(args)
+    finally:
+        os.remove(list_path)
+    return output_path
@@ -0,0 +1,56 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windowsにはfcntlがないため、msvcrtのバイト範囲ロックを使う
+    fcntl = None
+    import msvcrt
+
+
+def _lock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    lock_file.seek(0)
+    while True:
+        try:
+            # LK_LOCKは約10秒で諦めてOSErrorを送出するため、取得できるまで繰り返す
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return
+    lock_file.seek(0)
+    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def exclusive_lock(lock_path):
+    """ロックファイルを使ってプロセス間で排他制御する（POSIXとWindowsの両方で動作する）"""
+    with open(lock_path, 'a+') as lock_file:
+        _lock(lock_file)
+        try:
+            yield lock_file
+        finally:
+            _unlock(lock_file)
+
+
+def pid_alive(pid):
+    """同じホストのプロセスが実行中かどうか"""
+    if os.name == 'nt':
+        # Windowsのos.killはシグナル0でもプロセスを終了させるため、実行中とみなす
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
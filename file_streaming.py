@@ -0,0 +1,200 @@
+import os
+import re
+import struct
+import threading
+import mimetypes
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, quote, unquote
+from ffmpeg_tools import run_ffmpeg
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# 例: "bytes=0-1023", "bytes=1024-", "bytes=-500"
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, file_size):
+    """Rangeヘッダーを解析して(開始, 終了)を返す（終了は含む）
+    
+    ヘッダーがない・解釈できない場合はNone、範囲外の場合はValueErrorを送出する。
+    複数範囲の指定はブラウザの再生では使われないため、ファイル全体として扱う。
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    
+    start, end = match.groups()
+    if start == '' and end == '':
+        return None
+    if start == '':
+        # 末尾からのバイト数
+        length = int(end)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(file_size - length, 0), file_size - 1
+    
+    start = int(start)
+    end = int(end) if end else file_size - 1
+    if start >= file_size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, min(end, file_size - 1)
+
+
+def send_file(handler, path, content_type=None, download_name=None, head_only=False):
+    """ファイルをRangeリクエストに対応してチャンクごとに送信する
+    
+    ファイル全体をメモリに読み込まないため、動画のサイズや同時にダウンロードする
+    クライアントの数に関係なく、サーバーのメモリ使用量は一定に保たれる。
+    """
+    file_size = os.path.getsize(path)
+    content_type = content_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    
+    try:
+        byte_range = parse_range(handler.headers.get('Range'), file_size)
+    except ValueError:
+        handler.send_response(416)
+        handler.send_header('Content-Range', f'bytes */{file_size}')
+        handler.send_header('Content-Length', '0')
+        handler.end_headers()
+        return
+    
+    if byte_range is None:
+        start, end = 0, file_size - 1
+        handler.send_response(200)
+    else:
+        start, end = byte_range
+        handler.send_response(206)
+        handler.send_header('Content-Range', f'bytes {start}-{end}/{file_size}')
+    
+    handler.send_header('Content-Type', content_type)
+    handler.send_header('Content-Length', str(end - start + 1))
+    handler.send_header('Accept-Ranges', 'bytes')
+    if download_name:
+        handler.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{quote(download_name)}")
+    handler.end_headers()
+    if head_only or file_size == 0:
+        return
+    
+    remaining = end - start + 1
+    try:
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while remaining > 0:
+                chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                handler.wfile.write(chunk)
+                remaining -= len(chunk)
+    except (BrokenPipeError, ConnectionResetError):
+        # シーク時にブラウザが接続を切るのは通常の動作
+        pass
+
+
+def iter_top_level_atoms(path):
+    """MP4のトップレベルのatomの種類を先頭から順に返す"""
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return
+            size, kind = struct.unpack('>I4s', header)
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+                header_size = 16
+            else:
+                header_size = 8
+            yield kind.decode('latin-1')
+            if size == 0:
+                return
+            f.seek(size - header_size, os.SEEK_CUR)
+
+
+def is_faststart(path):
+    """moov atomがmdat atomより前にある（ダウンロード完了前に再生を開始できる）か判定する"""
+    for kind in iter_top_level_atoms(path):
+        if kind == 'moov':
+            return True
+        if kind == 'mdat':
+            return False
+    return False
+
+
+def ensure_faststart(path):
+    """moov atomが末尾にあるMP4を、再エンコードせずに先頭へ移動して書き直す"""
+    if is_faststart(path):
+        return path
+    
+    root, ext = os.path.splitext(path)
+    temp_path = f"{root}.faststart{ext}"
+    try:
+        run_ffmpeg(['-i', path, '-map', '0', '-c', 'copy', '-movflags', '+faststart', temp_path])
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return path
+
+
+def make_file_handler(root_dir):
+    """root_dir以下のファイルを配信するリクエストハンドラーを作成する"""
+    root_dir = os.path.realpath(root_dir)
+    
+    class FileRequestHandler(BaseHTTPRequestHandler):
+        def _resolve(self):
+            relative = unquote(urlparse(self.path).path).lstrip('/')
+            path = os.path.realpath(os.path.join(root_dir, relative))
+            # root_dirの外のファイルは配信しない
+            if os.path.commonpath([root_dir, path]) != root_dir or not os.path.isfile(path):
+                return None
+            return path
+        
+        def _serve(self, head_only):
+            path = self._resolve()
+            if path is None:
+                self.send_error(404)
+                return
+            download_name = os.path.basename(path) if 'download' in urlparse(self.path).query else None
+            send_file(self, path, download_name=download_name, head_only=head_only)
+        
+        def do_GET(self):
+            self._serve(head_only=False)
+        
+        def do_HEAD(self):
+            self._serve(head_only=True)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    return FileRequestHandler
+
+
+class FileServer:
+    """ディレクトリ内のファイルをバックグラウンドのスレッドでHTTP配信する
+    
+    Streamlitのサーバーを経由せずに、ブラウザが動画を直接Rangeリクエストで取得できるようにする。
+    """
+    
+    def __init__(self, root_dir, host="127.0.0.1", port=0, public_url=None):
+        self.root_dir = os.path.realpath(root_dir)
+        self.server = ThreadingHTTPServer((host, port), make_file_handler(self.root_dir))
+        self.server.daemon_threads = True
+        # リバースプロキシ経由で公開する場合は、外部から見えるURLを指定する
+        self.base_url = (public_url or f"http://{host}:{self.server.server_address[1]}").rstrip('/')
+        self._thread = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="file-server", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def url_for(self, path, download=False):
+        """ファイルのパスを配信用のURLに変換する"""
+        relative = os.path.relpath(os.path.realpath(path), self.root_dir)
+        url = f"{self.base_url}/{quote(relative.replace(os.sep, '/'))}"
+        return url + "?download=1" if download else url
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import atexit
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+from multiprocessing import shared_memory
+from file_lock import exclusive_lock, pid_alive
+
+# 共有メモリの既定の上限（バイト）
+DEFAULT_CAPACITY = int(os.getenv('TIKTOK_FRAME_STORE_CAPACITY', str(1024 * 1024 * 1024)))
+# POSIXの共有メモリを置くtmpfs（容量を超えて書き込むとSIGBUSになる）
+SHARED_MEMORY_DIR = '/dev/shm'
+
+
+def asset_key(path):
+    """ファイルのパス・サイズ・更新時刻から素材のハッシュを作成する"""
+    stat = os.stat(path)
+    payload = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def frame_key(*parts):
+    """素材のハッシュと解像度などの条件から、フレームストアのキーを作成する"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _attach(name, create=False, size=0):
+    """共有メモリを開く（ストアが寿命を管理するため、resource_trackerには登録しない）"""
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:
+        # Python 3.12以前はtrack引数がないため、登録を解除する
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def shared_memory_free_bytes():
+    """共有メモリのtmpfsの空き容量（tmpfsがない環境ではNone）"""
+    try:
+        return shutil.disk_usage(SHARED_MEMORY_DIR).free
+    except OSError:
+        return None
+
+
+def _unlink(shm):
+    """_attachで開いた共有メモリを閉じて削除する"""
+    shm.close()
+    if not hasattr(shm, '_track'):
+        # Python 3.12以前のunlinkはresource_trackerの登録も解除するため、対になる登録をしておく
+        from multiprocessing import resource_tracker
+        resource_tracker.register(shm._name, 'shared_memory')
+    shm.unlink()
+
+
+class SharedFrameStore:
+    def __init__(self, store_dir, capacity_bytes=DEFAULT_CAPACITY, namespace='tvg'):
+        """プロセス間で共有するデコード済みフレームのストア
+
+        1つのプロセスがデコードして公開した配列を、他のプロセスはコピーせずに
+        読み取り専用のNumPy配列として参照する。索引はstore_dirのJSONファイルで、
+        ファイルロックにより複数プロセスから安全に更新する。
+        """
+        self.store_dir = store_dir
+        self.capacity_bytes = capacity_bytes
+        self.namespace = namespace
+        os.makedirs(store_dir, exist_ok=True)
+        self.index_path = os.path.join(store_dir, 'index.json')
+        self.lock_path = os.path.join(store_dir, 'index.lock')
+        
+        # このプロセスで開いている共有メモリと参照数
+        self._attached = {}
+        self._local_lock = threading.Lock()
+        atexit.register(self.release_all)
+    
+    @contextmanager
+    def _locked_index(self):
+        """索引をプロセス間ロック付きで読み書きする"""
+        with self._local_lock, exclusive_lock(self.lock_path):
+            index = {}
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+            self._drop_dead_refs(index)
+            yield index
+            self._close_unused(index)
+            temp_path = self.index_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+            os.replace(temp_path, self.index_path)
+    
+    def _drop_dead_refs(self, index):
+        """終了したプロセスが持っていた参照を外す"""
+        for entry in index.values():
+            entry['refs'] = {pid: count for pid, count in entry['refs'].items() if pid_alive(int(pid))}
+    
+    def _capacity(self, used):
+        """使用できる容量（capacity_bytesを、使用中の分とtmpfsの空き容量の合計までに制限する）"""
+        free_bytes = shared_memory_free_bytes()
+        if free_bytes is None:
+            return self.capacity_bytes
+        return min(self.capacity_bytes, used + free_bytes)
+    
+    def _evict(self, index, needed_bytes):
+        """参照されていないフレームを古い順に削除して空きを作る（作れない場合はFalse）"""
+        used = sum(entry['nbytes'] for entry in index.values())
+        # 削除した分だけtmpfsの空き容量も増えるため、上限は最初に一度だけ求める
+        capacity = self._capacity(used)
+        candidates = sorted(
+            (key for key, entry in index.items() if not entry['refs']),
+            key=lambda key: index[key]['last_used']
+        )
+        for key in candidates:
+            if used + needed_bytes <= capacity:
+                break
+            entry = index.pop(key)
+            used -= entry['nbytes']
+            try:
+                _unlink(_attach(entry['shm_name']))
+            except FileNotFoundError:
+                pass
+        return used + needed_bytes <= capacity
+    
+    def _add_ref(self, index, key):
+        refs = index[key]['refs']
+        pid = str(os.getpid())
+        refs[pid] = refs.get(pid, 0) + 1
+        index[key]['last_used'] = time.time()
+    
+    def _view(self, key, entry):
+        """共有メモリを読み取り専用の配列として参照する"""
+        if key not in self._attached or self._attached[key][1] is None:
+            shm = _attach(entry['shm_name'])
+            array = np.ndarray(tuple(entry['shape']), dtype=np.dtype(entry['dtype']), buffer=shm.buf)
+            array.flags.writeable = False
+            self._attached[key] = [shm, array, 0]
+        self._attached[key][2] += 1
+        return self._attached[key][1]
+    
+    def acquire(self, key, producer):
+        """キーに対応する配列を取得する（ストアにない場合はproducerで作成して公開する）
+
+        返した配列は読み取り専用。使い終わったらreleaseを呼ぶ。上限を超えて公開できない
+        場合は、このプロセス専用の配列をそのまま返す。
+        """
+        with self._locked_index() as index:
+            if key in index:
+                self._add_ref(index, key)
+                return self._view(key, index[key])
+        
+        # デコードはロックの外で行う（同時に作成された場合は先に公開された方を使う）
+        array = np.ascontiguousarray(producer())
+        
+        with self._locked_index() as index:
+            if key in index:
+                self._add_ref(index, key)
+                return self._view(key, index[key])
+            
+            if not self._evict(index, array.nbytes):
+                array.flags.writeable = False
+                return array
+            
+            shm_name = f"{self.namespace}_{key[:24]}"
+            shm = _attach(shm_name, create=True, size=max(1, array.nbytes))
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+            shared[...] = array
+            shared.flags.writeable = False
+            self._attached[key] = [shm, shared, 0]
+            
+            index[key] = {
+                'shm_name': shm_name,
+                'shape': list(array.shape),
+                'dtype': array.dtype.str,
+                'nbytes': array.nbytes,
+                'refs': {},
+                'last_used': time.time()
+            }
+            self._add_ref(index, key)
+            return self._view(key, index[key])
+    
+    def release(self, key):
+        """acquireで取得した配列の参照を1つ外す"""
+        with self._locked_index() as index:
+            if key in index:
+                pid = str(os.getpid())
+                refs = index[key]['refs']
+                if refs.get(pid, 0) > 1:
+                    refs[pid] -= 1
+                else:
+                    refs.pop(pid, None)
+        
+        attached = self._attached.get(key)
+        if attached and attached[2] > 0:
+            attached[2] -= 1
+    
+    def _close_unused(self, index):
+        """索引から削除され、このプロセスでも使われていない共有メモリのマッピングを閉じる"""
+        for key, attached in list(self._attached.items()):
+            if key in index or attached[2] > 0:
+                continue
+            attached[1] = None
+            try:
+                attached[0].close()
+            except BufferError:
+                # 配列がまだ使われている場合は次の機会に閉じる
+                continue
+            self._attached.pop(key)
+    
+    def release_all(self):
+        """このプロセスが持つすべての参照を外す"""
+        for key, attached in list(self._attached.items()):
+            for _ in range(attached[2]):
+                self.release(key)
+    
+    @contextmanager
+    def lease(self):
+        """ブロック内で取得した配列を、終了時にまとめて解放する"""
+        keys = []
+        try:
+            yield keys
+        finally:
+            # 例外で抜けた場合も参照を残さない
+            for key in keys:
+                self.release(key)
+    
+    def stats(self):
+        """ストアの使用状況"""
+        with self._locked_index() as index:
+            used = sum(entry['nbytes'] for entry in index.values())
+            return {
+                'entries': len(index),
+                'used_bytes': used,
+                'capacity_bytes': self._capacity(used),
+                'referenced': sum(1 for entry in index.values() if entry['refs'])
+            }
@@ -0,0 +1,463 @@
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import sqlite3
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from render_config import RenderConfig
+from project_file import load_project, _check_file_name
+from encoder_profiles import ENCODER_PROFILES
+from storage_manager import StorageManager
+from file_streaming import send_file
+from media_fetcher import MediaFetcher
+from distributed_render import DistributedRenderQueue
+
+# 動画オプションの既定値（app.pyのvideo_optionsと同じ）
+DEFAULT_JOB_OPTIONS = {
+    'duration_per_scene': 5,
+    'add_title': True,
+    'add_ending': True,
+    'selected_bgm': None,
+    'encoder_profile': 'standard',
+    'output_profiles': [],
+    'images_per_scene': 1
+}
+
+JOB_OUTPUT_TTL_DAYS = 7
+
+
+class JobQueue:
+    def __init__(self, db_path):
+        """SQLiteで永続化するレンダリングジョブのキュー"""
+        self.db_path = db_path
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    client_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    outputs TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        finally:
+            conn.close()
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def _row_to_job(self, row):
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['outputs'] = json.loads(job['outputs']) if job['outputs'] else None
+        return job
+    
+    def submit(self, client_id, payload):
+        """ジョブを登録してIDを返す"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, client_id, status, payload, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, client_id, json.dumps(payload, ensure_ascii=False), now, now)
+            )
+        finally:
+            conn.close()
+        return job_id
+    
+    def count_active(self, client_id):
+        """クライアントの待機中・実行中のジョブ数"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE client_id = ? AND status IN ('queued', 'running')",
+                (client_id,)
+            ).fetchone()
+            return row[0]
+        finally:
+            conn.close()
+    
+    def claim(self, max_running_per_client):
+        """実行枠に空きがあるクライアントの最も古いジョブを取り出し、実行中にする"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND client_id NOT IN ("
+                "  SELECT client_id FROM jobs WHERE status = 'running'"
+                "  GROUP BY client_id HAVING COUNT(*) >= ?"
+                ") ORDER BY created_at LIMIT 1",
+                (max_running_per_client,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                (time.time(), row['id'])
+            )
+            conn.execute("COMMIT")
+            job = self._row_to_job(row)
+            job['status'] = 'running'
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+    
+    def update(self, job_id, **fields):
+        """ジョブの状態・進捗・結果を更新する"""
+        if 'outputs' in fields:
+            fields['outputs'] = json.dumps(fields['outputs'], ensure_ascii=False)
+        fields['updated_at'] = time.time()
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        conn = self._connect()
+        try:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", list(fields.values()) + [job_id])
+        finally:
+            conn.close()
+    
+    def get(self, job_id):
+        """ジョブを取得する（存在しない場合はNone）"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._row_to_job(row) if row else None
+        finally:
+            conn.close()
+    
+    def requeue_running(self):
+        """前回の停止時に実行中だったジョブを待機中に戻す（チェックポイントから再開される）"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'",
+                (time.time(),)
+            )
+        finally:
+            conn.close()
+
+
+class JobService:
+    def __init__(self, data_dir="jobs", workers=2, max_running_per_client=1, max_queued_per_client=10,
+                 audio_dir="audio", shared_dir=None, video_generator=None):
+        """ジョブキューとワーカープールでVideoGeneratorを動かすレンダリングサービス
+
+        shared_dirを指定すると、シーンのレンダリングをdistributed_renderのワーカーに任せる
+        （data_dirもワーカーのホストから同じパスで見える共有ストレージに置くこと）。
+        video_generatorを省略した場合は、data_dir内のキャッシュを使うVideoGeneratorを作成する。
+        """
+        self.data_dir = data_dir
+        self.audio_dir = audio_dir
+        self.output_dir = os.path.join(data_dir, "output")
+        self.media_dir = os.path.join(data_dir, "media")
+        self.project_dir = os.path.join(data_dir, "projects")
+        for path in (self.output_dir, self.media_dir, self.project_dir):
+            os.makedirs(path, exist_ok=True)
+        
+        self.workers = workers
+        self.max_running_per_client = max_running_per_client
+        self.max_queued_per_client = max_queued_per_client
+        
+        self.queue = JobQueue(os.path.join(data_dir, "jobs.db"))
+        
+        # 完了したジョブの動画は一定期間だけ保持し、素材やキャッシュは容量の上限まで保持する
+        self.storage = StorageManager(
+            os.path.join(data_dir, "storage_refs.json"),
+            policies={
+                self.output_dir: {'max_bytes': 20 * 1024 ** 3, 'max_age_days': JOB_OUTPUT_TTL_DAYS},
+                self.media_dir: {'max_bytes': 5 * 1024 ** 3, 'max_age_days': 7},
+                self.project_dir: {'max_bytes': 5 * 1024 ** 3, 'max_age_days': 7},
+                os.path.join(data_dir, "segments"): {'max_bytes': 1024 ** 3, 'max_age_days': 30},
+                os.path.join(data_dir, "checkpoints"): {'max_bytes': 10 * 1024 ** 3, 'max_age_days': 2},
+            }
+        )
+        if video_generator is None:
+            from video_generator import VideoGenerator
+            from segment_library import SegmentLibrary
+            video_generator = VideoGenerator(
+                output_dir=self.output_dir,
+                segment_library=SegmentLibrary(os.path.join(data_dir, "segments")),
+                checkpoint_dir=os.path.join(data_dir, "checkpoints"),
+                task_queue=DistributedRenderQueue(shared_dir) if shared_dir else None
+            )
+        self.video_generator = video_generator
+        self._media_search = None
+        # 全てのジョブで共有し、同じ提供元への同時接続数を制限する
+        self.media_fetcher = MediaFetcher()
+        self._stop_event = threading.Event()
+        self._threads = []
+    
+    @property
+    def media_search(self):
+        # 台本からのジョブで初めて必要になるため、遅延して初期化する
+        if self._media_search is None:
+            from media_search import MediaSearch
+            self._media_search = MediaSearch()
+        return self._media_search
+    
+    def start(self):
+        """ワーカーを起動する"""
+        self.queue.requeue_running()
+        self.storage.start_background()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"render-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def stop(self, timeout=None):
+        """新しいジョブの取り出しを止め、ワーカーの終了を待つ"""
+        self._stop_event.set()
+        self.storage.stop_background()
+        for thread in self._threads:
+            thread.join(timeout)
+    
+    def validate_options(self, options):
+        """動画オプションを検証する（不正な値はジョブの実行前にValueErrorとして返す）"""
+        if not isinstance(options, dict):
+            raise ValueError("optionsはオブジェクトで指定してください")
+        # BGMはaudio_dir内のファイル名のみ（ディレクトリの指定は不可）
+        if options.get('selected_bgm'):
+            _check_file_name(options['selected_bgm'])
+        if 'encoder_profile' in options and options['encoder_profile'] not in ENCODER_PROFILES:
+            raise ValueError(f"不明なエンコーダープロファイル: {options['encoder_profile']}")
+        output_profiles = options.get('output_profiles') or []
+        if not isinstance(output_profiles, list):
+            raise ValueError("output_profilesはプロファイル名のリストで指定してください")
+        for profile in output_profiles:
+            if not isinstance(profile, str):
+                raise ValueError("output_profilesはプロファイル名のリストで指定してください")
+            self.video_generator.resolve_output_profile(profile)
+    
+    def submit(self, client_id, payload):
+        """ジョブを登録する（クライアントの上限を超えた場合はNone）"""
+        if not isinstance(payload, dict) or ('script' not in payload and 'project' not in payload):
+            raise ValueError("scriptまたはprojectを指定してください")
+        self.validate_options(payload.get('options', {}))
+        if self.queue.count_active(client_id) >= self.max_queued_per_client:
+            return None
+        return self.queue.submit(client_id, payload)
+    
+    def _worker_loop(self):
+        while not self._stop_event.is_set():
+            job = self.queue.claim(self.max_running_per_client)
+            if job is None:
+                self._stop_event.wait(1.0)
+                continue
+            self.run_job(job)
+    
+    def run_job(self, job):
+        """ジョブを実行し、結果をキューに記録する"""
+        try:
+            outputs = self._render(job)
+            self.queue.update(job['id'], status='done', progress=1.0, outputs=outputs)
+            # 素材への参照を外し、完成した動画だけを保持期間のあいだ参照する
+            self.storage.set_references(
+                f"job:{job['id']}", outputs.values(), ttl_seconds=JOB_OUTPUT_TTL_DAYS * 86400
+            )
+        except Exception as e:
+            print(f"ジョブ実行エラー ({job['id']}): {e}")
+            self.queue.update(job['id'], status='failed', error=str(e))
+            self.storage.remove_owner(f"job:{job['id']}")
+    
+    def _render(self, job):
+        payload = job['payload']
+        options = dict(DEFAULT_JOB_OPTIONS, **payload.get('options', {}))
+        
+        if 'project' in payload:
+            # プロジェクトファイル（Base64）からはネットワークを使わずに再生成する
+            project_path = os.path.join(self.project_dir, f"{job['id']}.tvp")
+            with open(project_path, 'wb') as f:
+                f.write(base64.b64decode(payload['project']))
+            self.storage.set_references(f"job:{job['id']}", [project_path])
+            project = load_project(project_path, self.media_dir, audio_dir=self.audio_dir)
+            keywords = project['keywords']
+            selected_media = project['selected_media']
+            # プロジェクトの設定を使い、リクエストで指定されたオプションを優先する
+            options = dict(DEFAULT_JOB_OPTIONS)
+            options.update(project['video_options'])
+            options.update(payload.get('options', {}))
+            self.validate_options(options)
+        else:
+            from script_analysis import analyze_script
+            from media_ranking import auto_select_media, download_selections
+            _, keywords = analyze_script(payload['script'])
+            selections = auto_select_media(
+                keywords,
+                lambda keyword: self.media_search.search_images(keyword, per_page=6),
+                per_scene=options['images_per_scene'],
+                target_width=self.video_generator.width,
+                target_height=self.video_generator.height
+            )
+            selected_media = download_selections(selections, self.media_fetcher.download, self.media_dir)
+        
+        # 実行中のジョブの素材を削除しないように登録する
+        self.storage.add_references(
+            f"job:{job['id']}",
+            [item['local_path'] for items in selected_media.values() for item in items]
+        )
+        
+        bgm_path = None
+        if options.get('selected_bgm'):
+            bgm_path = os.path.join(self.audio_dir, options['selected_bgm'])
+        
+        config = RenderConfig(
+            scene_duration=options['duration_per_scene'],
+            add_title=options['add_title'],
+            add_ending=options['add_ending'],
+            bgm_path=bgm_path,
+            output_filename=f"{job['id']}.mp4",
+            output_profiles=tuple(options.get('output_profiles') or ()),
+            encoder_profile=options['encoder_profile']
+        )
+        result = self.video_generator.generate_video(
+            keywords,
+            selected_media,
+            config=config,
+            progress_callback=lambda progress: self.queue.update(job['id'], progress=progress)
+        )
+        if isinstance(result, dict):
+            return result
+        return {'default': result}
+
+
+def make_handler(service):
+    """サービスを参照するリクエストハンドラーを作成する"""
+    
+    class JobRequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, data):
+            body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def _client_id(self):
+            return self.headers.get('X-Client-Id') or self.client_address[0]
+        
+        def _job_status(self, job):
+            status = {
+                'id': job['id'],
+                'status': job['status'],
+                'progress': job['progress'],
+                'error': job['error'],
+                'created_at': job['created_at'],
+                'updated_at': job['updated_at']
+            }
+            if job['status'] == 'done' and job['outputs']:
+                status['videos'] = {
+                    name: f"/jobs/{job['id']}/video?profile={name}" for name in job['outputs']
+                }
+            return status
+        
+        def do_POST(self):
+            if urlparse(self.path).path != '/jobs':
+                self._send_json(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', '0'))
+                payload = json.loads(self.rfile.read(length).decode('utf-8'))
+                job_id = service.submit(self._client_id(), payload)
+            except (ValueError, KeyError) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            if job_id is None:
+                self._send_json(429, {'error': 'too many active jobs for this client'})
+                return
+            self._send_json(202, {'id': job_id, 'status': 'queued', 'url': f"/jobs/{job_id}"})
+        
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [part for part in url.path.split('/') if part]
+            
+            if parts == ['health']:
+                self._send_json(200, {'status': 'ok'})
+                return
+            if len(parts) < 2 or parts[0] != 'jobs':
+                self._send_json(404, {'error': 'not found'})
+                return
+            
+            job = service.queue.get(parts[1])
+            if job is None:
+                self._send_json(404, {'error': 'job not found'})
+                return
+            
+            if len(parts) == 2:
+                self._send_json(200, self._job_status(job))
+            elif len(parts) == 3 and parts[2] == 'video':
+                self._send_video(job, parse_qs(url.query).get('profile', ['default'])[0])
+            else:
+                self._send_json(404, {'error': 'not found'})
+        
+        def _send_video(self, job, profile):
+            if job['status'] != 'done':
+                self._send_json(409, {'error': f"job is {job['status']}"})
+                return
+            path = (job['outputs'] or {}).get(profile)
+            if not path or not os.path.exists(path):
+                self._send_json(404, {'error': 'video not found'})
+                return
+            
+            # ファイル全体を読み込まず、Rangeリクエストに対応してチャンクごとに送信する
+            send_file(self, path, content_type='video/mp4')
+        
+        def log_message(self, format, *args):
+            print(f"[job_server] {self.address_string()} {format % args}")
+    
+    return JobRequestHandler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="動画生成ジョブのHTTPサーバー")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs"))
+    parser.add_argument('--audio-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio"))
+    parser.add_argument('--workers', type=int, default=2, help="同時に実行するジョブ数")
+    parser.add_argument('--max-running-per-client', type=int, default=1,
+                        help="クライアントごとに同時に実行するジョブ数の上限")
+    parser.add_argument('--max-queued-per-client', type=int, default=10,
+                        help="クライアントごとの待機中・実行中のジョブ数の上限")
+    parser.add_argument('--shared-dir', help="分散レンダリングの共有ディレクトリ（distributed_render.pyのワーカーと共通）")
+    args = parser.parse_args(argv)
+    
+    service = JobService(
+        data_dir=args.data_dir,
+        workers=args.workers,
+        max_running_per_client=args.max_running_per_client,
+        max_queued_per_client=args.max_queued_per_client,
+        audio_dir=args.audio_dir,
+        shared_dir=args.shared_dir
+    )
+    service.start()
+    
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"ジョブサーバーを起動しました: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop(timeout=5)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+import os
+import time
+import threading
+import requests
+from collections import deque
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+# 失敗時に再試行するHTTPステータス（それ以外の4xxは再試行しない）
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class MediaFetcher:
+    def __init__(self, max_workers=8, per_host=3, retries=3, backoff=1.0, timeout=30, chunk_size=64 * 1024):
+        """選択されたメディアをバックグラウンドで並列にダウンロードするクラス
+        
+        同じホストへの同時接続数はper_hostまでに制限し、超えた分はホストごとの待ち行列で
+        待たせる（待っている間もスレッドプールのワーカーは他のホストのダウンロードに使う）。
+        ダウンロード中のファイルは同じディレクトリの「.」で始まる一時ファイルに書き込み、
+        完了後に置き換える（途中のファイルが素材として使われたり、ストレージ管理に削除されたりしない）。
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.per_host = per_host
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="media-fetch")
+        self._lock = threading.Lock()
+        self._active = {}
+        self._waiting = {}
+        self._tasks = {}
+        self._closed = False
+    
+    def _update(self, save_path, **fields):
+        with self._lock:
+            task = self._tasks.get(save_path)
+            if task is not None:
+                task.update(fields)
+    
+    def submit(self, url, save_path):
+        """ダウンロードを予約する（同じ保存先への予約は重複させない）"""
+        with self._lock:
+            task = self._tasks.get(save_path)
+            if task is not None and task['status'] != 'failed':
+                task['forget'] = False
+                return save_path
+            self._tasks[save_path] = {
+                'url': url,
+                'status': 'pending',
+                'bytes': 0,
+                'total': None,
+                'error': None,
+                'forget': False
+            }
+        self._enqueue(url, save_path)
+        return save_path
+    
+    def _enqueue(self, url, save_path, attempt=0):
+        """ホストの同時接続数に空きがあればプールに渡し、なければホストの待ち行列に入れる"""
+        host = urlparse(url).netloc
+        with self._lock:
+            if self._closed:
+                return
+            if self._active.get(host, 0) >= self.per_host:
+                self._waiting.setdefault(host, deque()).append((url, save_path, attempt))
+                return
+            self._active[host] = self._active.get(host, 0) + 1
+        self._pool.submit(self._run, url, save_path, attempt)
+    
+    def _release_host(self, host):
+        """ホストの接続を1つ空け、待ち行列の次のダウンロードを開始する"""
+        with self._lock:
+            waiting = self._waiting.get(host)
+            if waiting and not self._closed:
+                # 接続数はそのまま次のダウンロードに引き継ぐ
+                next_task = waiting.popleft()
+                if not waiting:
+                    del self._waiting[host]
+            else:
+                next_task = None
+                self._active[host] -= 1
+                if not self._active[host]:
+                    del self._active[host]
+        if next_task is not None:
+            self._pool.submit(self._run, *next_task)
+    
+    def _finish(self, save_path, **fields):
+        """ダウンロードの結果を記録する（記録の削除を予約されていた場合は削除する）"""
+        with self._lock:
+            task = self._tasks.get(save_path)
+            if task is None:
+                return
+            if task['forget']:
+                del self._tasks[save_path]
+            else:
+                task.update(fields)
+    
+    def _run(self, url, save_path, attempt):
+        retry_delay = None
+        try:
+            self._fetch(url, save_path)
+            self._finish(save_path, status='done')
+        except Exception as e:
+            status = None
+            if isinstance(e, requests.RequestException) and e.response is not None:
+                status = e.response.status_code
+            retryable = isinstance(e, requests.RequestException) and (status is None or status in RETRY_STATUS)
+            if retryable and attempt < self.retries:
+                self._update(save_path, status='pending', error=str(e))
+                retry_delay = self.backoff * 2 ** attempt
+            else:
+                print(f"ダウンロードエラー: {e}")
+                self._finish(save_path, status='failed', error=str(e))
+        finally:
+            self._release_host(urlparse(url).netloc)
+        
+        # 待ち時間の間はワーカーもホストの接続も使わないよう、タイマーで予約し直す
+        if retry_delay is not None:
+            timer = threading.Timer(retry_delay, self._enqueue, (url, save_path, attempt + 1))
+            timer.daemon = True
+            timer.start()
+    
+    def _fetch(self, url, save_path):
+        """1回分のダウンロードを行う（失敗時は一時ファイルを削除して例外を送出する）"""
+        directory, filename = os.path.split(save_path)
+        temp_path = os.path.join(directory, f".{filename}.part")
+        
+        try:
+            self._update(save_path, status='running', bytes=0)
+            with requests.get(url, stream=True, timeout=self.timeout) as response:
+                if response.status_code in RETRY_STATUS:
+                    raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+                response.raise_for_status()
+                
+                total = response.headers.get('Content-Length')
+                self._update(save_path, total=int(total) if total and total.isdigit() else None)
+                
+                # メモリに溜めずにチャンクごとに書き込む
+                received = 0
+                with open(temp_path, 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        file.write(chunk)
+                        received += len(chunk)
+                        self._update(save_path, bytes=received)
+            os.replace(temp_path, save_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    
+    def download(self, url, save_path):
+        """ダウンロードの完了を待ち、成功したかどうかを返す（MediaSearch.download_mediaと同じ形式）"""
+        self.submit(url, save_path)
+        success = self.wait([save_path])[save_path] == 'done'
+        self.forget([save_path])
+        return success
+    
+    def status(self, save_path):
+        with self._lock:
+            task = self._tasks.get(save_path)
+            return dict(task) if task else None
+    
+    def progress(self, save_paths):
+        """指定したダウンロード全体の進捗をまとめて返す"""
+        with self._lock:
+            tasks = [self._tasks[path] for path in save_paths if path in self._tasks]
+        finished = [task for task in tasks if task['status'] in ('done', 'failed')]
+        active = [task for task in tasks if task['status'] != 'failed']
+        known_totals = [task['total'] for task in active if task['total']]
+        return {
+            'count': len(tasks),
+            'finished': len(finished),
+            'failed': len(tasks) - len(active),
+            'bytes': sum(task['bytes'] for task in active),
+            # サイズが分からないダウンロードがある間は合計も不明とする
+            'total_bytes': sum(known_totals) if len(known_totals) == len(active) else None
+        }
+    
+    def wait(self, save_paths, timeout=None, poll_interval=0.2):
+        """ダウンロードが全て終わるまで待ち、保存先ごとの状態を返す"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            statuses = {path: (self.status(path) or {}).get('status') for path in save_paths}
+            if all(status in ('done', 'failed', None) for status in statuses.values()):
+                return statuses
+            if deadline is not None and time.time() >= deadline:
+                return statuses
+            time.sleep(poll_interval)
+    
+    def forget(self, save_paths):
+        """ダウンロードの記録を削除する（実行中・待機中のものは終了時に削除する）"""
+        with self._lock:
+            for path in save_paths:
+                task = self._tasks.get(path)
+                if task is None:
+                    continue
+                if task['status'] in ('done', 'failed'):
+                    del self._tasks[path]
+                else:
+                    task['forget'] = True
+    
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            self._waiting.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)
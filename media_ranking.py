@@ -0,0 +1,167 @@
+import os
+import uuid
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+# スコアの重み
+RANKING_WEIGHTS = {
+    'orientation': 3.0,
+    'resolution': 2.0,
+    'keywords': 2.5,
+    'adjacent_penalty': 3.0,
+    'used_penalty': 1.5,
+}
+
+# ダウンロードした画像として扱う拡張子（それ以外・不明な場合は既定の拡張子で保存する）
+DOWNLOAD_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def media_key(item):
+    """提供元とIDからメディアを識別するキー"""
+    return (item['source'], str(item['id']))
+
+
+def orientation_score(item, target_width, target_height):
+    """縦横比が目標（9:16）にどれだけ近いか（1.0が一致）"""
+    if not item.get('width') or not item.get('height'):
+        return 0.0
+    aspect = item['width'] / item['height']
+    target_aspect = target_width / target_height
+    return min(aspect, target_aspect) / max(aspect, target_aspect)
+
+
+def resolution_score(item, target_width, target_height):
+    """ダウンロードする画像で、拡大せずに画面を埋められるか（1.0で拡大不要）"""
+    width, height = item.get('large_size') or (item.get('width'), item.get('height'))
+    if not width or not height:
+        return 0.0
+    scale = max(target_width / width, target_height / height)
+    return min(1.0, 1.0 / scale)
+
+
+def keyword_score(item, keywords):
+    """キーワードとタグ（Pixabayのtags）の一致率"""
+    if not keywords or not item.get('tags'):
+        return 0.0
+    tags = [tag.strip().lower() for tag in item['tags'].split(',') if tag.strip()]
+    matched = 0
+    for keyword in keywords:
+        keyword = keyword.lower()
+        if any(keyword == tag or keyword in tag.split() for tag in tags):
+            matched += 1
+    return matched / len(keywords)
+
+
+def score_media(item, keywords, target_width, target_height, adjacent_keys=(), used_keys=()):
+    """シーンに対するメディアのスコアを計算する"""
+    score = (
+        RANKING_WEIGHTS['orientation'] * orientation_score(item, target_width, target_height)
+        + RANKING_WEIGHTS['resolution'] * resolution_score(item, target_width, target_height)
+        + RANKING_WEIGHTS['keywords'] * keyword_score(item, keywords)
+    )
+    
+    # 隣のシーンと同じ画像や、以前に使った画像は避ける
+    key = media_key(item)
+    if key in adjacent_keys:
+        score -= RANKING_WEIGHTS['adjacent_penalty']
+    if key in used_keys:
+        score -= RANKING_WEIGHTS['used_penalty']
+    return score
+
+
+def rank_media(results, keywords, target_width=1080, target_height=1920, adjacent_keys=(), used_keys=()):
+    """検索結果をスコアの高い順に並べる（同じメディアの重複は除く）"""
+    unique = {}
+    for item in results:
+        unique.setdefault(media_key(item), item)
+    return sorted(
+        unique.values(),
+        key=lambda item: score_media(item, keywords, target_width, target_height, adjacent_keys, used_keys),
+        reverse=True
+    )
+
+
+def auto_select_media(scenes, search_fn, per_scene=1, max_keywords=2, target_width=1080,
+                      target_height=1920, used_keys=(), existing=None):
+    """各シーンの検索結果をランク付けし、上位のメディアを自動選択する
+
+    scenesはシーンIDをキーとした{'text', 'keywords'}の辞書、search_fnはキーワードを受け取り
+    検索結果のリストを返す関数。existingに選択済みのシーンは変更しない。
+    """
+    existing = existing or {}
+    used_keys = set(used_keys)
+    
+    # 検索はシーン・キーワードごとに並列に実行する
+    queries = {
+        scene_id: scene_data['keywords'][:max_keywords]
+        for scene_id, scene_data in scenes.items()
+        if not existing.get(scene_id)
+    }
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = {
+            (scene_id, keyword): pool.submit(search_fn, keyword)
+            for scene_id, keywords in queries.items()
+            for keyword in keywords
+        }
+        search_results = {key: future.result() for key, future in futures.items()}
+    
+    # 隣接シーンとの重複を避けるため、シーン順にランク付けする
+    selections = {}
+    previous_keys = set()
+    for scene_id, scene_data in scenes.items():
+        if existing.get(scene_id):
+            selections[scene_id] = existing[scene_id]
+            previous_keys = {media_key(item) for item in existing[scene_id]}
+            continue
+        
+        candidates = []
+        for keyword in queries.get(scene_id, []):
+            candidates.extend(search_results.get((scene_id, keyword), []))
+        
+        ranked = rank_media(
+            candidates, scene_data['keywords'], target_width, target_height,
+            adjacent_keys=previous_keys, used_keys=used_keys
+        )
+        chosen = ranked[:per_scene]
+        selections[scene_id] = chosen
+        previous_keys = {media_key(item) for item in chosen}
+        used_keys.update(previous_keys)
+    
+    return selections
+
+
+def image_download(item, default_ext='.jpg'):
+    """画像のダウンロード元URLと保存時の拡張子を返す
+
+    拡張子はクエリ文字列を除いたURLのパスから取得する（Pexelsの「.jpeg?auto=...」など）。
+    """
+    url = item.get('large_url') or item['medium_url']
+    ext = os.path.splitext(urlparse(url).path)[-1].lower()
+    return url, ext if ext in DOWNLOAD_IMAGE_EXTENSIONS else default_ext
+
+
+def download_selections(selections, download_fn, media_dir, max_workers=8):
+    """自動選択したメディアを並列にダウンロードし、local_pathを設定する
+
+    download_fnは(url, save_path)を受け取り成功時にTrueを返す関数。
+    ダウンロードに失敗したメディアは選択から除く。
+    """
+    pending = []
+    for scene_id, items in selections.items():
+        for item in items:
+            if item.get('local_path'):
+                continue
+            url, file_ext = image_download(item)
+            pending.append((item, url, os.path.join(media_dir, f"{uuid.uuid4()}{file_ext}")))
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(lambda args: download_fn(args[1], args[2]), pending))
+    
+    for (item, _, save_path), success in zip(pending, results):
+        if success:
+            item['local_path'] = save_path
+    
+    return {
+        scene_id: [item for item in items if item.get('local_path')]
+        for scene_id, items in selections.items()
+    }
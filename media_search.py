@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 import requests
 from pixabay import Image as PixabayImage
@@ -8,6 +9,23 @@ from python_unsplash import Unsplash
 # 環境変数の読み込み
 load_dotenv()
 
+# 動画検索APIのエンドポイント
+PIXABAY_VIDEO_API_URL = 'https://pixabay.com/api/videos/'
+PEXELS_VIDEO_API_URL = 'https://api.pexels.com/videos/search'
+
+# 画像のダウンロードに使うlarge_urlの最大サイズ（提供元ごとの縮小後の上限）
+PIXABAY_LARGE_SIZE = (1280, 1280)
+PEXELS_LARGE_SIZE = (1880, 1300)
+UNSPLASH_REGULAR_WIDTH = 1080
+
+
+def fit_size(width, height, max_width, max_height):
+    """縦横比を保ったまま上限に収めたサイズ（拡大はしない）"""
+    if not width or not height:
+        return None, None
+    scale = min(1.0, max_width / width, max_height / height)
+    return int(width * scale), int(height * scale)
+
 class MediaSearch:
     def __init__(self):
         # APIキーの取得（実際の使用時は.envファイルから読み込む）
@@ -70,6 +88,7 @@ class MediaSearch:
                         'source_url': hit['pageURL'],
                         'width': hit['webformatWidth'],
                         'height': hit['webformatHeight'],
+                        'large_size': fit_size(hit.get('imageWidth'), hit.get('imageHeight'), *PIXABAY_LARGE_SIZE),
                         'tags': hit['tags']
                     })
             return results
@@ -92,11 +111,12 @@ class MediaSearch:
                     'id': photo.id,
                     'preview_url': photo.src['tiny'],
                     'medium_url': photo.src['medium'],
-                    'large_url': photo.src['large'],
+                    'large_url': photo.src['large2x'],
                     'source': 'Pexels',
                     'source_url': photo.url,
                     'width': photo.width,
                     'height': photo.height,
+                    'large_size': fit_size(photo.width, photo.height, *PEXELS_LARGE_SIZE),
                     'photographer': photo.photographer
                 })
             return results
@@ -124,6 +144,7 @@ class MediaSearch:
                         'source_url': photo.links.html,
                         'width': photo.width,
                         'height': photo.height,
+                        'large_size': fit_size(photo.width, photo.height, UNSPLASH_REGULAR_WIDTH, photo.height),
                         'photographer': photo.user.name
                     })
             return results
@@ -131,28 +152,195 @@ class MediaSearch:
             print(f"Unsplash検索エラー: {e}")
             return []
     
+    def image_providers(self):
+        """画像検索の提供元と検索関数の一覧"""
+        return [
+            ('Pixabay', self.search_pixabay_images),
+            ('Pexels', self.search_pexels_images),
+            ('Unsplash', self.search_unsplash_images),
+        ]
+    
+    def iter_search_images(self, keyword, per_page=5, skip=()):
+        """すべてのAPIへ同時に検索し、応答が届いた順に(提供元, 検索結果)を返す（skipの提供元は除く）"""
+        providers = [(source, search) for source, search in self.image_providers() if source not in skip]
+        if not providers:
+            return
+        with ThreadPoolExecutor(max_workers=len(providers)) as pool:
+            futures = {
+                pool.submit(search, keyword, per_page): source
+                for source, search in providers
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+    
     def search_images(self, keyword, per_page=5):
         """すべてのAPIから画像を検索する"""
+        results_by_source = dict(self.iter_search_images(keyword, per_page))
+        
+        # 提供元の順（Pixabay、Pexels、Unsplash）に並べる
         results = []
+        for source, _ in self.image_providers():
+            results.extend(results_by_source.get(source, []))
         
-        # Pixabayから検索
-        pixabay_results = self.search_pixabay_images(keyword, per_page)
-        results.extend(pixabay_results)
+        return results
+    
+    def search_pixabay_videos(self, keyword, per_page=3):
+        """Pixabayから動画を検索する"""
+        if not self.pixabay_api_key:
+            return []
         
-        # Pexelsから検索
-        pexels_results = self.search_pexels_images(keyword, per_page)
-        results.extend(pexels_results)
+        try:
+            response = requests.get(
+                PIXABAY_VIDEO_API_URL,
+                params={
+                    'key': self.pixabay_api_key,
+                    'q': keyword,
+                    'lang': 'ja',
+                    'video_type': 'film',
+                    'per_page': max(3, per_page)  # Pixabayの最小値は3
+                },
+                timeout=10
+            )
+            response.raise_for_status()
+            data = response.json()
+            
+            results = []
+            for hit in data.get('hits', [])[:per_page]:
+                renditions = []
+                for rendition in hit['videos'].values():
+                    if not rendition.get('url'):
+                        continue
+                    renditions.append({
+                        'url': rendition['url'],
+                        'width': rendition['width'],
+                        'height': rendition['height'],
+                        'fps': None,
+                        'size': rendition.get('size')
+                    })
+                if not renditions:
+                    continue
+                largest = max(renditions, key=lambda r: r['width'] * r['height'])
+                default = self.choose_rendition({'renditions': renditions, 'duration': hit['duration']})
+                results.append({
+                    'id': hit['id'],
+                    'preview_url': hit['videos'].get('tiny', {}).get('thumbnail') or largest['url'],
+                    'medium_url': default['url'],
+                    'large_url': largest['url'],
+                    'source': 'Pixabay',
+                    'source_url': hit['pageURL'],
+                    'width': largest['width'],
+                    'height': largest['height'],
+                    'tags': hit['tags'],
+                    'media_type': 'video',
+                    'duration': hit['duration'],
+                    'renditions': renditions
+                })
+            return results
+        except Exception as e:
+            print(f"Pixabay動画検索エラー: {e}")
+            return []
+    
+    def search_pexels_videos(self, keyword, per_page=3):
+        """Pexelsから動画を検索する"""
+        if not self.pexels_api_key:
+            return []
         
-        # Unsplashから検索
-        unsplash_results = self.search_unsplash_images(keyword, per_page)
-        results.extend(unsplash_results)
+        try:
+            response = requests.get(
+                PEXELS_VIDEO_API_URL,
+                params={'query': keyword, 'per_page': per_page, 'orientation': 'portrait'},
+                headers={'Authorization': self.pexels_api_key},
+                timeout=10
+            )
+            response.raise_for_status()
+            data = response.json()
+            
+            results = []
+            for video in data.get('videos', []):
+                renditions = []
+                for video_file in video.get('video_files', []):
+                    if video_file.get('file_type') != 'video/mp4' or not video_file.get('width'):
+                        continue
+                    renditions.append({
+                        'url': video_file['link'],
+                        'width': video_file['width'],
+                        'height': video_file['height'],
+                        'fps': video_file.get('fps'),
+                        'size': video_file.get('size')
+                    })
+                if not renditions:
+                    continue
+                largest = max(renditions, key=lambda r: r['width'] * r['height'])
+                default = self.choose_rendition({'renditions': renditions, 'duration': video['duration']})
+                results.append({
+                    'id': video['id'],
+                    'preview_url': video['image'],
+                    'medium_url': default['url'],
+                    'large_url': largest['url'],
+                    'source': 'Pexels',
+                    'source_url': video['url'],
+                    'width': video['width'],
+                    'height': video['height'],
+                    'photographer': video['user']['name'],
+                    'media_type': 'video',
+                    'duration': video['duration'],
+                    'renditions': renditions
+                })
+            return results
+        except Exception as e:
+            print(f"Pexels動画検索エラー: {e}")
+            return []
+    
+    def video_providers(self):
+        """動画検索の提供元と検索関数の一覧（Unsplashは動画を提供していない）"""
+        return [
+            ('Pixabay', self.search_pixabay_videos),
+            ('Pexels', self.search_pexels_videos),
+        ]
+    
+    def iter_search_videos(self, keyword, per_page=3, skip=()):
+        """すべてのAPIへ同時に動画を検索し、応答が届いた順に(提供元, 検索結果)を返す（skipの提供元は除く）"""
+        providers = [(source, search) for source, search in self.video_providers() if source not in skip]
+        if not providers:
+            return
+        with ThreadPoolExecutor(max_workers=len(providers)) as pool:
+            futures = {
+                pool.submit(search, keyword, per_page): source
+                for source, search in providers
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+    
+    def search_videos(self, keyword, per_page=3):
+        """すべてのAPIから動画を検索する"""
+        results_by_source = dict(self.iter_search_videos(keyword, per_page))
+        
+        results = []
+        for source, _ in self.video_providers():
+            results.extend(results_by_source.get(source, []))
         
         return results
     
-    def search_videos(self, keyword, per_page=3):
-        """動画を検索する（現在はPixabayのみ）"""
-        # 実装予定
-        return []
+    def choose_rendition(self, item, target_width=1080, target_height=1920, duration=None):
+        """目標の画面を拡大せずに埋められる最小のレンディションを選ぶ
+
+        該当するものがない場合は最も大きいレンディションを選ぶ。ファイルサイズが
+        不明な場合は、解像度・フレームレート・必要な長さからデータ量を見積もる。
+        """
+        duration = duration or item.get('duration') or 1
+        
+        def estimated_size(rendition):
+            if rendition.get('size'):
+                return rendition['size']
+            return rendition['width'] * rendition['height'] * (rendition.get('fps') or 30) * duration
+        
+        covering = [
+            r for r in item['renditions']
+            if max(target_width / r['width'], target_height / r['height']) <= 1.0
+        ]
+        if covering:
+            return min(covering, key=estimated_size)
+        return max(item['renditions'], key=lambda r: r['width'] * r['height'])
     
     def download_media(self, url, save_path):
         """メディアをダウンロードする"""
@@ -0,0 +1,173 @@
+import io
+import os
+import re
+import json
+import hashlib
+import zipfile
+from encoder_profiles import ENCODER_PROFILES
+
+# プロジェクトファイルの形式バージョン
+PROJECT_FORMAT_VERSION = 1
+PROJECT_EXTENSION = '.tvp'
+PROJECT_MANIFEST = 'project.json'
+
+# 格納するメディアの名前（media/<SHA-256><拡張子>）
+BLOB_PATTERN = re.compile(r'^media/([0-9a-f]{64})(\.[0-9a-z]{1,8})?$')
+
+
+def file_sha256(path):
+    """ファイル内容のSHA-256ハッシュを計算する"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _blob_name(sha256, path):
+    ext = os.path.splitext(path)[-1].lower()
+    return f"media/{sha256}{ext}"
+
+
+def save_project(target, script, scenes, keywords, selected_media, video_options, audio_dir=None):
+    """プロジェクトを1つのファイルに保存する
+
+    targetはファイルパスまたは書き込み可能なファイルオブジェクト。メディアは内容の
+    ハッシュで重複を除いて格納し、メディアの参照はハッシュで記録する。
+    """
+    blobs = {}
+    media = {}
+    for scene_id, items in selected_media.items():
+        media[scene_id] = []
+        for item in items:
+            sha256 = file_sha256(item['local_path'])
+            blob = _blob_name(sha256, item['local_path'])
+            blobs[blob] = item['local_path']
+            entry = {key: value for key, value in item.items() if key != 'local_path'}
+            entry.update({'sha256': sha256, 'blob': blob})
+            media[scene_id].append(entry)
+    
+    # BGMも同梱して、別のホストでも同じ動画を再生成できるようにする
+    bgm = None
+    if video_options.get('selected_bgm') and audio_dir:
+        bgm_path = os.path.join(audio_dir, video_options['selected_bgm'])
+        if os.path.exists(bgm_path):
+            sha256 = file_sha256(bgm_path)
+            blob = _blob_name(sha256, bgm_path)
+            blobs[blob] = bgm_path
+            bgm = {'name': video_options['selected_bgm'], 'sha256': sha256, 'blob': blob}
+    
+    manifest = {
+        'version': PROJECT_FORMAT_VERSION,
+        'script': script,
+        'scenes': scenes,
+        'keywords': keywords,
+        'selected_media': media,
+        'video_options': video_options,
+        'bgm': bgm
+    }
+    
+    with zipfile.ZipFile(target, 'w') as archive:
+        archive.writestr(
+            PROJECT_MANIFEST,
+            json.dumps(manifest, ensure_ascii=False, separators=(',', ':')),
+            compress_type=zipfile.ZIP_DEFLATED
+        )
+        # 画像・動画は圧縮済みのため無圧縮で格納する
+        for blob, path in sorted(blobs.items()):
+            archive.write(path, blob, compress_type=zipfile.ZIP_STORED)
+    return target
+
+
+def project_to_bytes(script, scenes, keywords, selected_media, video_options, audio_dir=None):
+    """プロジェクトをバイト列として作成する（ダウンロード用）"""
+    buffer = io.BytesIO()
+    save_project(buffer, script, scenes, keywords, selected_media, video_options, audio_dir=audio_dir)
+    return buffer.getvalue()
+
+
+def _check_blob(entry):
+    """メディアの参照がmedia/<SHA-256><拡張子>の形式で、ハッシュと一致するか検証する"""
+    match = BLOB_PATTERN.match(str(entry.get('blob', '')))
+    if not match or match.group(1) != entry.get('sha256'):
+        raise ValueError(f"不正なメディアの参照です: {entry.get('blob')}")
+    return entry['blob']
+
+
+def _check_file_name(name):
+    """ディレクトリを含まないファイル名か検証する"""
+    if not isinstance(name, str) or not name or name in ('.', '..') \
+            or os.path.basename(name) != name or '/' in name or '\\' in name:
+        raise ValueError(f"不正なファイル名です: {name}")
+    return name
+
+
+def _extract_blob(archive, blob, sha256, save_path):
+    """ハッシュが一致するファイルがなければ展開する（内容がハッシュと一致しない場合はValueError）"""
+    if os.path.exists(save_path) and file_sha256(save_path) == sha256:
+        return save_path
+    temp_path = save_path + '.tmp'
+    digest = hashlib.sha256()
+    try:
+        with archive.open(blob) as src, open(temp_path, 'wb') as dst:
+            for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                digest.update(chunk)
+                dst.write(chunk)
+        # 改ざん・破損した内容でハッシュ名のファイルを置き換えない
+        if digest.hexdigest() != sha256:
+            raise ValueError(f"メディアの内容がハッシュと一致しません: {blob}")
+        os.replace(temp_path, save_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return save_path
+
+
+def load_project(source, media_dir, audio_dir=None):
+    """プロジェクトファイルを読み込み、メディアをハッシュ名でmedia_dirに展開する
+
+    sourceはファイルパスまたは読み込み可能なファイルオブジェクト。ネットワークには
+    アクセスしないため、読み込んだプロジェクトはそのまま再生成できる。
+    """
+    with zipfile.ZipFile(source, 'r') as archive:
+        manifest = json.loads(archive.read(PROJECT_MANIFEST).decode('utf-8'))
+        if manifest.get('version') != PROJECT_FORMAT_VERSION:
+            raise ValueError(f"対応していないプロジェクト形式です: {manifest.get('version')}")
+        
+        os.makedirs(media_dir, exist_ok=True)
+        selected_media = {}
+        for scene_id, items in manifest['selected_media'].items():
+            selected_media[scene_id] = []
+            for entry in items:
+                item = dict(entry)
+                blob = _check_blob(entry)
+                save_path = os.path.join(media_dir, os.path.basename(blob))
+                item['local_path'] = _extract_blob(archive, blob, entry['sha256'], save_path)
+                selected_media[scene_id].append(item)
+        
+        video_options = dict(manifest['video_options'])
+        encoder_profile = video_options.get('encoder_profile', 'standard')
+        if encoder_profile not in ENCODER_PROFILES:
+            raise ValueError(f"不明なエンコーダープロファイルです: {encoder_profile}")
+        bgm = manifest.get('bgm')
+        if bgm and audio_dir:
+            # プロジェクトファイルは外部から受け取るため、audio_dirの外には書き込まない
+            blob = _check_blob(bgm)
+            name = _check_file_name(bgm.get('name'))
+            os.makedirs(audio_dir, exist_ok=True)
+            bgm_path = os.path.join(audio_dir, name)
+            # 同名の別ファイルがある場合はハッシュ名で展開する
+            if os.path.exists(bgm_path) and file_sha256(bgm_path) != bgm['sha256']:
+                bgm_path = os.path.join(audio_dir, os.path.basename(blob))
+            _extract_blob(archive, blob, bgm['sha256'], bgm_path)
+            video_options['selected_bgm'] = os.path.basename(bgm_path)
+        else:
+            video_options['selected_bgm'] = None
+    
+    return {
+        'script': manifest['script'],
+        'scenes': manifest['scenes'],
+        'keywords': manifest['keywords'],
+        'selected_media': selected_media,
+        'video_options': video_options
+    }
@@ -0,0 +1,162 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from dataclasses import asdict
+from file_lock import pid_alive
+
+MANIFEST_VERSION = 1
+
+# このプロセス内で所有しているチェックポイント（同じプロセスの別スレッドとの衝突を防ぐ）
+_owned_lock = threading.Lock()
+_owned_dirs = set()
+
+
+def compute_job_key(plan, config, render_signature):
+    """レンダリング計画の内容から、再実行時にも同じになるジョブキーを作成する"""
+    entries = []
+    for entry in plan['entries']:
+        entry = {key: value for key, value in entry.items() if key not in ('clip', 'cached')}
+        # メディアファイルが差し替えられた場合は別のジョブとして扱う
+        stats = []
+        for path in entry.get('media_paths', []):
+            stat = os.stat(path) if os.path.exists(path) else None
+            stats.append([path, stat.st_size if stat else None, stat.st_mtime if stat else None])
+        entry['media_stats'] = stats
+        entries.append(entry)
+    
+    # 出力ファイル名は実行ごとに変わるためキーに含めない
+    config_data = asdict(config)
+    config_data.pop('output_filename', None)
+    
+    payload = json.dumps(
+        {
+            'entries': entries,
+            'profiles': plan['profiles'],
+            'config': config_data,
+            'render': render_signature
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RenderCheckpoint:
+    def __init__(self, checkpoint_root, job_key):
+        """シーン単位のセグメントとマニフェストを保存するチェックポイント"""
+        self.job_key = job_key
+        self.checkpoint_dir = os.path.join(checkpoint_root, job_key)
+        self.manifest_path = os.path.join(self.checkpoint_dir, 'manifest.json')
+        # ロックファイルはcleanupでディレクトリごと削除されないよう、ディレクトリの外に置く
+        self.lock_path = self.checkpoint_dir + '.lock'
+        self.owned = False
+        self.manifest = None
+    
+    def acquire(self):
+        """チェックポイントの所有権を排他的に取得する
+        
+        同じジョブキーのレンダリングが別のスレッド・プロセスで実行中の場合はFalseを返す。
+        所有者のプロセスが強制終了して残ったロックファイルは引き継ぐ。
+        """
+        with _owned_lock:
+            if self.checkpoint_dir in _owned_dirs:
+                return False
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            while True:
+                try:
+                    fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    try:
+                        with open(self.lock_path, 'r') as f:
+                            pid = int(f.read().strip() or 0)
+                    except FileNotFoundError:
+                        continue
+                    except ValueError:
+                        # 書き込み途中のロックファイルは所有者が生きているものとして扱う
+                        return False
+                    if pid != os.getpid() and pid_alive(pid):
+                        return False
+                    os.remove(self.lock_path)
+                    continue
+                with os.fdopen(fd, 'w') as f:
+                    f.write(str(os.getpid()))
+                break
+            _owned_dirs.add(self.checkpoint_dir)
+        
+        self.owned = True
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self.manifest = self.load_manifest()
+        return True
+    
+    def release(self):
+        """チェックポイントの所有権を手放す（セグメントは再開用に残す）"""
+        if not self.owned:
+            return
+        with _owned_lock:
+            _owned_dirs.discard(self.checkpoint_dir)
+            try:
+                os.remove(self.lock_path)
+            except FileNotFoundError:
+                pass
+        self.owned = False
+    
+    def load_manifest(self):
+        """マニフェストを読み込む（壊れている場合は最初からやり直す）"""
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') == MANIFEST_VERSION and manifest.get('job_key') == self.job_key:
+                    return manifest
+            except Exception as e:
+                print(f"マニフェスト読み込みエラー: {e}")
+        return {'version': MANIFEST_VERSION, 'job_key': self.job_key, 'segments': {}}
+    
+    def save_manifest(self):
+        """マニフェストをアトミックに保存する"""
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.manifest_path)
+    
+    def segment_path(self, index, profile):
+        """セグメントの保存先パス"""
+        return os.path.join(self.checkpoint_dir, f"{index:03d}_{profile['name']}.mp4")
+    
+    def partial_path(self, index, profile):
+        """書き込み中のセグメントのパス（完了後にリネームする）"""
+        return os.path.join(self.checkpoint_dir, f".{index:03d}_{profile['name']}.partial.mp4")
+    
+    def completed_segments(self, index, profiles):
+        """完了済みのセグメントのパスを取得する（未完了の場合はNone）"""
+        segment = self.manifest['segments'].get(str(index))
+        if not segment:
+            return None
+        paths = [self.segment_path(index, profile) for profile in profiles]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        return paths
+    
+    def commit(self, index, kind, profiles, partial_paths):
+        """書き込みが完了したセグメントを確定し、マニフェストに記録する"""
+        paths = []
+        for profile, partial_path in zip(profiles, partial_paths):
+            path = self.segment_path(index, profile)
+            os.replace(partial_path, path)
+            paths.append(path)
+        self.manifest['segments'][str(index)] = {
+            'kind': kind,
+            'profiles': [profile['name'] for profile in profiles]
+        }
+        self.save_manifest()
+        return paths
+    
+    def cleanup(self):
+        """最終出力の完成後にチェックポイントを削除する（所有している場合のみ）"""
+        if not self.owned:
+            return
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        self.release()
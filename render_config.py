@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from file_lock import pid_alive
+
+# スクラッチ領域の候補（tmpfsを優先）
+SCRATCH_ROOT_CANDIDATES = ['/dev/shm']
+SCRATCH_PREFIX = 'tiktok_render_'
+# tmpfsを使うのに必要な最小の空き容量（Dockerの既定の/dev/shmは64MB）
+MIN_SCRATCH_FREE_BYTES = 256 * 1024 ** 2
+# 1フレーム・出力1メガピクセルあたりのスクラッチ使用量の見積もり（セグメントと連結後の出力、余裕を含む）
+SCRATCH_BYTES_PER_MP_FRAME = 40 * 1024
+
+
+@dataclass(frozen=True)
+class RenderConfig:
+    """1回のレンダリングジョブの設定（ジョブ間で共有しても安全なように不変）"""
+    scene_duration: int = 5
+    add_title: bool = True
+    add_ending: bool = True
+    bgm_path: str = None
+    output_filename: str = "tiktok_video.mp4"
+    output_profiles: tuple = ()
+    encoder_profile: str = 'standard'
+    
+    @classmethod
+    def from_options(cls, video_options, output_filename, bgm_path=None):
+        """アプリの動画オプションから設定を作成する"""
+        return cls(
+            scene_duration=video_options['duration_per_scene'],
+            add_title=video_options['add_title'],
+            add_ending=video_options['add_ending'],
+            bgm_path=bgm_path,
+            output_filename=output_filename,
+            encoder_profile=video_options.get('encoder_profile', 'standard')
+        )
+
+
+def profile_crop(width, height, target_width, target_height, bottom_margin=0):
+    """マスター解像度から出力プロファイルの縦横比に切り出す範囲(x, y, 幅, 高さ)を返す
+    
+    横方向は中央を切り出す。縦方向も中央を基本とするが、下端からbottom_marginより上の
+    範囲（画面下部のキャプション）が切れる場合は、その範囲が収まるまで下側に寄せる。
+    """
+    # 縦横比を合わせるためにクロップ（偶数サイズに揃える）
+    crop_w = min(width, int(height * target_width / target_height)) // 2 * 2
+    crop_h = min(height, int(width * target_height / target_width)) // 2 * 2
+    x = (width - crop_w) // 2
+    y = max((height - crop_h) // 2, height - crop_h - bottom_margin)
+    return x, min(max(0, y), height - crop_h), crop_w, crop_h
+
+
+def estimate_scratch_bytes(entries, profiles):
+    """タイムライン要素を全プロファイルで書き出すのに必要なスクラッチ領域の見積もり（バイト）"""
+    frames = sum(entry.get('frames', 0) for entry in entries)
+    output_mp = sum(profile['width'] * profile['height'] for profile in profiles) / 1e6
+    return int(frames * output_mp * SCRATCH_BYTES_PER_MP_FRAME)
+
+
+def get_scratch_root(required_bytes=0):
+    """スクラッチ領域のルートディレクトリを取得する
+
+    tmpfsの候補は、空き容量がrequired_bytes（最小でMIN_SCRATCH_FREE_BYTES）以上ある場合のみ使い、
+    足りない場合は一時ディレクトリを使う（tmpfsが一杯になると書き出しに失敗するため）。
+    """
+    env_root = os.getenv('TIKTOK_SCRATCH_DIR')
+    if env_root:
+        os.makedirs(env_root, exist_ok=True)
+        return env_root
+    
+    required_bytes = max(required_bytes, MIN_SCRATCH_FREE_BYTES)
+    for candidate in SCRATCH_ROOT_CANDIDATES:
+        if not (os.path.isdir(candidate) and os.access(candidate, os.W_OK)):
+            continue
+        try:
+            free_bytes = shutil.disk_usage(candidate).free
+        except OSError:
+            continue
+        if free_bytes >= required_bytes:
+            return candidate
+    return tempfile.gettempdir()
+
+
+def cleanup_stale_workspaces(scratch_root=None):
+    """強制終了したプロセスが残したスクラッチディレクトリを削除する"""
+    scratch_root = scratch_root or get_scratch_root()
+    removed = []
+    for name in os.listdir(scratch_root):
+        if not name.startswith(SCRATCH_PREFIX):
+            continue
+        try:
+            pid = int(name[len(SCRATCH_PREFIX):].split('_', 1)[0])
+        except ValueError:
+            continue
+        if pid != os.getpid() and not pid_alive(pid):
+            shutil.rmtree(os.path.join(scratch_root, name), ignore_errors=True)
+            removed.append(name)
+    return removed
+
+
+@contextmanager
+def scratch_workspace(required_bytes=0):
+    """ジョブ専用のスクラッチディレクトリを作成し、終了時（例外時も含む）に削除する
+
+    required_bytesはジョブが書き出すファイルの見積もり（estimate_scratch_bytes）。
+    """
+    # 空き容量を確認する前に、強制終了したプロセスが残したディレクトリを削除する
+    if not os.getenv('TIKTOK_SCRATCH_DIR'):
+        for candidate in SCRATCH_ROOT_CANDIDATES:
+            if os.path.isdir(candidate) and os.access(candidate, os.W_OK):
+                cleanup_stale_workspaces(candidate)
+    scratch_root = get_scratch_root(required_bytes)
+    cleanup_stale_workspaces(scratch_root)
+    workspace = tempfile.mkdtemp(prefix=f"{SCRATCH_PREFIX}{os.getpid()}_", dir=scratch_root)
+    try:
+        yield workspace
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
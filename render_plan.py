@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import threading
+from PIL import Image
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+# レンダリング計画の形式バージョン
+PLAN_VERSION = 1
+
+# 実行記録の保存先
+COST_HISTORY_FILE = os.getenv(
+    'TIKTOK_RENDER_COST_HISTORY',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'render_cost_history.json')
+)
+MAX_COST_HISTORY = 200
+
+# 処理ごとのCPUコスト係数（1メガピクセルあたりのCPU秒）
+DEFAULT_CPU_COEFFICIENTS = {
+    'image_decode': 0.02,   # 画像1枚の読み込み・リサイズ（ソース解像度）
+    'video_decode': 0.004,  # 動画1フレームのデコード（ソース解像度）
+    'compose': 0.03,        # 1フレームの合成・キャプション・フェード（マスター解像度）
+    'static_frame': 0.003,  # 合成済みの静止画フレームの再利用・フェード（マスター解像度）
+    'encode': 0.01,         # 1フレームのエンコード（出力解像度、プリセット補正後）
+}
+
+# メモリコスト係数（MB）
+DEFAULT_MEMORY_COEFFICIENTS = {
+    'base': 200,            # Pythonプロセスとライブラリ
+    'source_per_mp': 3.2,   # デコード済みソース1メガピクセルあたり（RGB）
+    'frame_per_mp': 28,     # 合成中のマスターフレーム1メガピクセルあたり（作業用バッファ・合成済みフレームを含む）
+    'encoder_per_mp': 1.5,  # エンコーダーの先読み1フレーム・1メガピクセルあたり
+}
+
+# プリセットごとのエンコード負荷（mediumを1とする）と先読みフレーム数
+PRESET_COST = {
+    'ultrafast': (0.25, 0),
+    'superfast': (0.35, 0),
+    'veryfast': (0.5, 10),
+    'faster': (0.7, 20),
+    'fast': (0.85, 30),
+    'medium': (1.0, 40),
+    'slow': (1.6, 50),
+    'slower': (2.5, 60),
+    'veryslow': (4.0, 60),
+}
+
+_history_lock = threading.Lock()
+
+
+def probe_media(path):
+    """メディアの種類・解像度・長さを取得する（ヘッダーのみを読み込む）"""
+    if path.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')):
+        with Image.open(path) as img:
+            width, height = img.size
+        return {'type': 'image', 'width': width, 'height': height, 'fps': None, 'duration': None}
+    
+    infos = ffmpeg_parse_infos(path)
+    width, height = infos['video_size']
+    return {
+        'type': 'video',
+        'width': width,
+        'height': height,
+        'fps': infos.get('video_fps'),
+        'duration': infos.get('duration')
+    }
+
+
+def _rss_mb(pid):
+    """/procから取得したプロセスの常駐メモリ（MB）"""
+    with open(f'/proc/{pid}/statm', 'r') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def _child_pids(pid):
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children', 'r') as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def current_memory_mb():
+    """このプロセスと子プロセス（ffmpeg）の現在の常駐メモリの合計（MB、/procがない環境ではNone）"""
+    pid = os.getpid()
+    try:
+        total = _rss_mb(pid)
+    except (OSError, ValueError, AttributeError):
+        return None
+    for child in _child_pids(pid):
+        try:
+            total += _rss_mb(child)
+        except (OSError, ValueError):
+            # 計測中に終了した子プロセス
+            continue
+    return total
+
+
+class MemorySampler:
+    def __init__(self, interval=0.2):
+        """ジョブの実行中に常駐メモリを一定間隔で計測し、その間のピークを記録する
+        
+        ru_maxrssはプロセス開始からのピークのため、過去の大きなジョブの値が残る。
+        ジョブごとのピークはここで計測した値を使う。
+        """
+        self.interval = interval
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def _sample(self):
+        current = current_memory_mb()
+        if current is not None:
+            self.peak_mb = max(self.peak_mb or 0.0, current)
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+    
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+        self._thread.start()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return False
+
+
+def plan_operations(plan):
+    """計画から処理ごとの作業量（メガピクセル単位）を集計する"""
+    fps = plan['fps']
+    master_mp = plan['width'] * plan['height'] / 1e6
+    preset_factor = PRESET_COST.get(plan['encoder']['preset'], (1.0, 40))[0]
+    
+    operations = {name: 0.0 for name in DEFAULT_CPU_COEFFICIENTS}
+    for entry in plan['entries']:
+        # ライブラリにあるスライドは再エンコードしない
+        if entry.get('cached'):
+            continue
+        static_frames = min(entry.get('static_frames', 0), entry['frames'])
+        operations['compose'] += (entry['frames'] - static_frames) * master_mp
+        operations['static_frame'] += static_frames * master_mp
+        for media in entry.get('media', []):
+            source_mp = media['width'] * media['height'] / 1e6
+            if media['type'] == 'image':
+                operations['image_decode'] += source_mp
+            else:
+                operations['video_decode'] += media['clip_duration'] * fps * source_mp
+        for profile in plan['profiles']:
+            profile_mp = profile['width'] * profile['height'] / 1e6
+            operations['encode'] += entry['frames'] * profile_mp * preset_factor
+    return operations
+
+
+class RenderCostModel:
+    def __init__(self, history_path=COST_HISTORY_FILE):
+        """過去の実行記録で較正するレンダリングコストの推定モデル"""
+        self.history_path = history_path
+        self.cpu_coefficients = dict(DEFAULT_CPU_COEFFICIENTS)
+        self.memory_scale = 1.0
+        self.calibrate()
+    
+    def load_history(self):
+        if not os.path.exists(self.history_path):
+            return []
+        try:
+            with open(self.history_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"実行記録の読み込みエラー: {e}")
+            return []
+    
+    def calibrate(self):
+        """実行記録から係数を較正する
+
+        まず既定の係数全体を実測との比率で補正し、実測のある処理の種類より多くの記録が
+        あれば、それらの処理の係数を最小二乗法で求め直す（実測のない処理は比率で補正した値を使う）。
+        """
+        history = self.load_history()
+        if not history:
+            return
+        
+        ratios = []
+        for record in history:
+            predicted = self._cpu_seconds(record['operations'], DEFAULT_CPU_COEFFICIENTS)
+            if predicted > 0:
+                ratios.append(record['cpu_seconds'] / predicted)
+        if ratios:
+            scale = sum(ratios) / len(ratios)
+            self.cpu_coefficients = {name: value * scale for name, value in DEFAULT_CPU_COEFFICIENTS.items()}
+        
+        # 一度も発生していない処理（動画を使わない場合のvideo_decodeなど）は最小二乗法に含めない
+        names = [
+            name for name in DEFAULT_CPU_COEFFICIENTS
+            if any(record['operations'].get(name, 0.0) > 0 for record in history)
+        ]
+        if names and len(history) > len(names):
+            import numpy as np
+            matrix = np.array([[record['operations'].get(name, 0.0) for name in names] for record in history])
+            actual = np.array([record['cpu_seconds'] for record in history])
+            solution, _, rank, _ = np.linalg.lstsq(matrix, actual, rcond=None)
+            if rank == len(names):
+                for name, value in zip(names, solution):
+                    # 負や0になった係数は比率で補正した値のまま使う
+                    if value > 0:
+                        self.cpu_coefficients[name] = float(value)
+        
+        # ジョブごとに計測したメモリの記録のみを使う（プロセス全体のピークを記録した古い形式は除く）
+        memory_ratios = [
+            record['peak_memory_mb'] / record['predicted_memory_mb']
+            for record in history
+            if record.get('memory_sampled') and record.get('peak_memory_mb') and record.get('predicted_memory_mb')
+        ]
+        if memory_ratios:
+            self.memory_scale = max(memory_ratios[-20:])
+    
+    def _cpu_seconds(self, operations, coefficients):
+        return sum(coefficients[name] * units for name, units in operations.items())
+    
+    def _raw_memory_mb(self, plan):
+        coefficients = DEFAULT_MEMORY_COEFFICIENTS
+        master_mp = plan['width'] * plan['height'] / 1e6
+        lookahead = PRESET_COST.get(plan['encoder']['preset'], (1.0, 40))[1]
+        
+        # 同時にメモリ上にあるのは1シーン分のソースと、全プロファイルのエンコーダー
+        peak_sources = 0.0
+        for entry in plan['entries']:
+            sources = sum(m['width'] * m['height'] / 1e6 for m in entry.get('media', []))
+            peak_sources = max(peak_sources, sources)
+        encoders = sum(
+            p['width'] * p['height'] / 1e6 * (lookahead + 1) for p in plan['profiles']
+        )
+        return (
+            coefficients['base']
+            + coefficients['source_per_mp'] * peak_sources
+            + coefficients['frame_per_mp'] * master_mp
+            + coefficients['encoder_per_mp'] * encoders
+        )
+    
+    def estimate(self, plan, threads=1):
+        """フレーム数・CPU秒・所要時間・ピークメモリを推定する"""
+        operations = plan_operations(plan)
+        cpu_seconds = self._cpu_seconds(operations, self.cpu_coefficients)
+        
+        # 合成は1スレッド、エンコードはスレッド数で並列化される
+        encode_seconds = self.cpu_coefficients['encode'] * operations['encode']
+        wall_seconds = (cpu_seconds - encode_seconds) + encode_seconds / max(1, threads)
+        
+        raw_memory = self._raw_memory_mb(plan)
+        return {
+            'frames': plan['frames'],
+            'duration': plan['duration'],
+            'cpu_seconds': cpu_seconds,
+            'wall_seconds': wall_seconds,
+            'peak_memory_mb': raw_memory * self.memory_scale,
+            'raw_memory_mb': raw_memory,
+            'operations': operations
+        }
+    
+    def record(self, plan, cpu_seconds, wall_seconds, peak_memory_mb=None):
+        """実際の実行結果を記録し、係数を較正し直す"""
+        estimate = self.estimate(plan)
+        record = {
+            'recorded_at': int(time.time()),
+            'operations': estimate['operations'],
+            'cpu_seconds': cpu_seconds,
+            'wall_seconds': wall_seconds,
+            'predicted_memory_mb': estimate['raw_memory_mb'],
+            'peak_memory_mb': peak_memory_mb,
+            'memory_sampled': peak_memory_mb is not None
+        }
+        with _history_lock:
+            history = self.load_history()
+            history.append(record)
+            history = history[-MAX_COST_HISTORY:]
+            temp_path = self.history_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(history, f, ensure_ascii=False)
+            os.replace(temp_path, self.history_path)
+        self.calibrate()
+        return record
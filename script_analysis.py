@@ -0,0 +1,69 @@
+import re
+import nltk
+from nltk.tokenize import word_tokenize
+from nltk.corpus import stopwords
+
+# NLTKのデータをダウンロード
+try:
+    nltk.data.find('tokenizers/punkt')
+except LookupError:
+    nltk.download('punkt')
+
+try:
+    nltk.data.find('corpora/stopwords')
+except LookupError:
+    nltk.download('stopwords')
+
+# キーワード抽出関数
+def extract_keywords(text, num_keywords=5):
+    # テキストをトークン化
+    tokens = word_tokenize(text.lower())
+    
+    # ストップワードを取得（日本語と英語）
+    stop_words = set(stopwords.words('english'))
+    try:
+        stop_words.update(stopwords.words('japanese'))
+    except:
+        pass  # 日本語のストップワードがない場合は無視
+    
+    # 記号や数字を除去
+    tokens = [token for token in tokens if token.isalpha()]
+    
+    # ストップワードを除去
+    tokens = [token for token in tokens if token not in stop_words]
+    
+    # 単語の頻度をカウント
+    word_freq = {}
+    for token in tokens:
+        if token in word_freq:
+            word_freq[token] += 1
+        else:
+            word_freq[token] = 1
+    
+    # 頻度順にソート
+    sorted_words = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)
+    
+    # 上位のキーワードを返す
+    return [word for word, freq in sorted_words[:num_keywords]]
+
+# シーン分割関数
+def split_into_scenes(script):
+    # シーンの区切りを検出（空行や特定のマーカーで区切られていると仮定）
+    scenes = re.split(r'\n\s*\n', script)
+    # 空のシーンを除去
+    scenes = [scene.strip() for scene in scenes if scene.strip()]
+    return scenes
+
+# 台本解析関数
+def analyze_script(script):
+    scenes = split_into_scenes(script)
+    scene_keywords = {}
+    
+    for i, scene in enumerate(scenes):
+        keywords = extract_keywords(scene)
+        scene_keywords[f"シーン{i+1}"] = {
+            "text": scene,
+            "keywords": keywords
+        }
+    
+    return scenes, scene_keywords
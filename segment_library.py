@@ -0,0 +1,63 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+
+
+class SegmentLibrary:
+    def __init__(self, library_dir="segments"):
+        """エンコード済みのタイトル・エンディングセグメントのライブラリ"""
+        self.library_dir = library_dir
+        os.makedirs(library_dir, exist_ok=True)
+        
+        # 同じセグメントを同時に生成しないためのキーごとのロック
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+    
+    def segment_key(self, text, style, encode_signature):
+        """テキスト・スタイル・エンコードパラメータからセグメントのキーを作成する"""
+        payload = json.dumps(
+            {'text': text, 'style': style, 'encode': encode_signature},
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _lock_for(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+    
+    def segment_path(self, generator, text, style, profile, encoder):
+        """セグメントの保存先パス"""
+        full_style = dict(style, font=generator.font, font_size=generator.font_size)
+        key = self.segment_key(text, full_style, generator.encode_signature(profile, encoder))
+        return os.path.join(self.library_dir, f"{key}.mp4")
+    
+    def has_segment(self, generator, text, style, profile, encoder):
+        """セグメントがライブラリに登録済みかどうか"""
+        return os.path.exists(self.segment_path(generator, text, style, profile, encoder))
+    
+    def get_segment(self, generator, text, style, profile, encoder):
+        """セグメントのパスを取得する（ライブラリにない場合はエンコードして登録する）"""
+        segment_path = self.segment_path(generator, text, style, profile, encoder)
+        key = os.path.splitext(os.path.basename(segment_path))[0]
+        
+        if os.path.exists(segment_path):
+            return segment_path
+        
+        with self._lock_for(key):
+            if os.path.exists(segment_path):
+                return segment_path
+            
+            # 本編と同じエンコーダー設定で書き出してから、アトミックに配置する
+            clip = generator.create_slide_clip(text, style)
+            temp_path = os.path.join(self.library_dir, f".{key}.{uuid.uuid4().hex}.mp4")
+            try:
+                generator.write_frames(clip, [profile], [temp_path], encoder)
+                os.replace(temp_path, segment_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        
+        return segment_path
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+from file_lock import exclusive_lock
+
+
+class StorageManager:
+    def __init__(self, state_path, policies=None, grace_seconds=600):
+        """MEDIA_DIR・OUTPUT_DIR・キャッシュなどのディレクトリの容量と保存期間を管理する
+
+        policiesはディレクトリのパスをキーとした{'max_bytes', 'max_age_days'}の辞書。
+        プロジェクトやジョブなどから参照されているファイルは削除しない。
+        作成からgrace_seconds秒以内のファイルは、参照がなくても削除しない（ダウンロード中など）。
+        """
+        self.state_path = state_path
+        self.lock_path = state_path + '.lock'
+        self.policies = {os.path.abspath(path): policy for path, policy in (policies or {}).items()}
+        self.grace_seconds = grace_seconds
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._local_lock = threading.Lock()
+    
+    @contextmanager
+    def _locked_state(self):
+        """参照の登録情報をプロセス間ロック付きで読み書きする"""
+        with self._local_lock, exclusive_lock(self.lock_path):
+            state = {'owners': {}}
+            if os.path.exists(self.state_path):
+                try:
+                    with open(self.state_path, 'r', encoding='utf-8') as f:
+                        state = json.load(f)
+                except Exception as e:
+                    print(f"ストレージ情報の読み込みエラー: {e}")
+            self._expire_owners(state)
+            yield state
+            temp_path = self.state_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(temp_path, self.state_path)
+    
+    def _expire_owners(self, state):
+        """有効期限が切れた参照元を削除する"""
+        now = time.time()
+        state['owners'] = {
+            owner: data for owner, data in state['owners'].items()
+            if not data.get('expires_at') or data['expires_at'] > now
+        }
+    
+    def set_references(self, owner, paths, ttl_seconds=None):
+        """参照元（例: session:<id>、project:<path>、job:<id>）が使うファイルを登録し直す"""
+        with self._locked_state() as state:
+            state['owners'][owner] = {
+                'paths': sorted({os.path.abspath(path) for path in paths if path}),
+                'updated_at': time.time(),
+                'expires_at': time.time() + ttl_seconds if ttl_seconds else None
+            }
+    
+    def add_references(self, owner, paths, ttl_seconds=None):
+        """参照元が使うファイルを追加する"""
+        with self._locked_state() as state:
+            data = state['owners'].setdefault(owner, {'paths': [], 'expires_at': None})
+            data['paths'] = sorted(set(data['paths']) | {os.path.abspath(path) for path in paths if path})
+            data['updated_at'] = time.time()
+            if ttl_seconds:
+                data['expires_at'] = time.time() + ttl_seconds
+    
+    def remove_owner(self, owner):
+        """参照元の登録を削除する（ファイルは次回のGCで削除対象になる）"""
+        with self._locked_state() as state:
+            state['owners'].pop(owner, None)
+    
+    def referenced_paths(self):
+        """参照されているファイルの一覧"""
+        with self._locked_state() as state:
+            return {path for data in state['owners'].values() for path in data['paths']}
+    
+    def _scan(self, directory):
+        """ディレクトリ以下のファイルを(パス, サイズ, 最終使用時刻, 作成時刻)で列挙する"""
+        files = []
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name.startswith('.'):
+                    continue  # 書き込み中の一時ファイル
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((path, stat.st_size, max(stat.st_atime, stat.st_mtime), stat.st_mtime))
+        return files
+    
+    def collect(self, dry_run=False, max_deletions=None):
+        """保存期間と容量の上限を超えた、参照されていないファイルを古い順に削除する
+
+        max_deletionsを指定すると、1回の実行で削除するファイル数を制限する（少しずつ実行する）。
+        dry_runの場合は削除せずに、削除対象を含むレポートを返す。
+        """
+        referenced = self.referenced_paths()
+        now = time.time()
+        report = {}
+        deletions = 0
+        
+        for directory, policy in self.policies.items():
+            if not os.path.isdir(directory):
+                continue
+            files = self._scan(directory)
+            total_bytes = sum(size for _, size, _, _ in files)
+            max_age = policy.get('max_age_days')
+            max_bytes = policy.get('max_bytes')
+            
+            # 参照がなく猶予期間を過ぎたファイルを、最後に使われた順に並べる
+            candidates = sorted(
+                (f for f in files if f[0] not in referenced and now - f[3] > self.grace_seconds),
+                key=lambda f: f[2]
+            )
+            
+            deleted = []
+            remaining_bytes = total_bytes
+            for path, size, last_used, _ in candidates:
+                if max_deletions is not None and deletions >= max_deletions:
+                    break
+                if max_age and now - last_used > max_age * 86400:
+                    reason = 'age'
+                elif max_bytes and remaining_bytes > max_bytes:
+                    reason = 'quota'
+                else:
+                    continue
+                
+                if not dry_run:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                deleted.append({'path': path, 'size': size, 'reason': reason})
+                remaining_bytes -= size
+                deletions += 1
+            
+            if not dry_run:
+                self._remove_empty_dirs(directory)
+            
+            report[directory] = {
+                'files': len(files),
+                'total_bytes': total_bytes,
+                'referenced_files': sum(1 for f in files if f[0] in referenced),
+                'deleted': deleted,
+                'freed_bytes': total_bytes - remaining_bytes,
+                'over_quota': bool(max_bytes and remaining_bytes > max_bytes)
+            }
+        return report
+    
+    def _remove_empty_dirs(self, directory):
+        """ファイルの削除で空になったサブディレクトリを削除する"""
+        for root, dirs, files in os.walk(directory, topdown=False):
+            if root != directory and not dirs and not files:
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+    
+    def start_background(self, interval_seconds=300, max_deletions=200):
+        """バックグラウンドで定期的に少しずつGCを実行する"""
+        if self._thread is not None:
+            return
+        
+        def run():
+            while not self._stop_event.wait(interval_seconds):
+                try:
+                    self.collect(max_deletions=max_deletions)
+                except Exception as e:
+                    print(f"ストレージGCエラー: {e}")
+        
+        self._thread = threading.Thread(target=run, name="storage-gc", daemon=True)
+        self._thread.start()
+    
+    def stop_background(self):
+        self._stop_event.set()
+
+
+def format_report(report):
+    """レポートを表示用の文字列にする"""
+    lines = []
+    for directory, data in report.items():
+        lines.append(
+            f"{directory}: {data['files']}ファイル {data['total_bytes'] / 1024 / 1024:.1f} MB"
+            f"（参照中 {data['referenced_files']}）"
+        )
+        for item in data['deleted']:
+            lines.append(f"  削除 [{item['reason']}] {item['path']} ({item['size'] / 1024 / 1024:.2f} MB)")
+        lines.append(f"  解放 {data['freed_bytes'] / 1024 / 1024:.1f} MB"
+                     + ("（容量の上限を超えています）" if data['over_quota'] else ""))
+    return "\n".join(lines)
+
+
+def default_storage_manager(base_dir):
+    """アプリの既定のディレクトリ構成に合わせたストレージ管理を作成する"""
+    return StorageManager(
+        os.path.join(base_dir, "storage_refs.json"),
+        policies={
+            os.path.join(base_dir, "media"): {'max_bytes': 2 * 1024 ** 3, 'max_age_days': 7},
+            os.path.join(base_dir, "output"): {'max_bytes': 5 * 1024 ** 3, 'max_age_days': 14},
+            os.path.join(base_dir, "segments"): {'max_bytes': 1024 ** 3, 'max_age_days': 30},
+            os.path.join(base_dir, "checkpoints"): {'max_bytes': 5 * 1024 ** 3, 'max_age_days': 2},
+        }
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="メディア・出力・キャッシュのストレージ管理")
+    parser.add_argument('command', choices=['report', 'gc'], help="report: 削除対象の確認のみ、gc: 削除を実行")
+    parser.add_argument('--base-dir', default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--max-deletions', type=int, default=None)
+    args = parser.parse_args(argv)
+    
+    manager = default_storage_manager(args.base_dir)
+    report = manager.collect(dry_run=(args.command == 'report'), max_deletions=args.max_deletions)
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import os
+import time
+import multiprocessing
+from contextlib import contextmanager
+import pytest
+import distributed_render
+from distributed_render import DistributedRenderQueue, RenderWorker
+
+PROFILES = [{'name': 'tiktok', 'width': 1080, 'height': 1920}, {'name': 'square', 'width': 1080, 'height': 1080}]
+ENCODER = {'preset': 'fast', 'threads': 4}
+
+
+class FakeGenerator:
+    """セグメントの代わりに要素の番号を書いたファイルを出力するジェネレーター"""
+    width, height, fps = 1080, 1920, 30
+    
+    def __init__(self, crash_index=None, delay=0.05):
+        self.crash_index = crash_index
+        self.delay = delay
+    
+    @contextmanager
+    def _frame_lease(self):
+        yield
+    
+    def export_entry(self, index, entry, profiles, encoder, workspace, checkpoint=None):
+        if index == self.crash_index:
+            # レンダリング中にプロセスが強制終了した場合の代わり
+            os._exit(1)
+        time.sleep(self.delay)
+        paths = []
+        for profile in profiles:
+            path = os.path.join(workspace, f"{index}_{profile['name']}.mp4")
+            with open(path, 'w') as f:
+                f.write(f"{entry['text']}:{profile['name']}")
+            paths.append(path)
+        return paths
+
+
+class BrokenGenerator(FakeGenerator):
+    """毎回レンダリングに失敗するジェネレーター"""
+    
+    def export_entry(self, index, entry, profiles, encoder, workspace, checkpoint=None):
+        raise ValueError("壊れた素材")
+
+
+def make_plan(count):
+    return {
+        'entries': [{'kind': 'scene', 'text': f"scene{i}"} for i in range(count)],
+        'profiles': PROFILES,
+        'width': 1080,
+        'height': 1920,
+        'fps': 30
+    }
+
+
+def run_worker_process(shared_dir, crash_index=None, concurrent_jobs=None):
+    queue = DistributedRenderQueue(shared_dir)
+    worker = RenderWorker(queue, FakeGenerator(crash_index), lease_seconds=1, concurrent_jobs=concurrent_jobs)
+    worker.run(idle_interval=0.1, exit_when_idle=True)
+
+
+def read_segments(entry_segments):
+    result = []
+    for paths in entry_segments:
+        contents = []
+        for path in paths:
+            with open(path) as f:
+                contents.append(f.read())
+        result.append(contents)
+    return result
+
+
+def recording_encoder_job(calls):
+    """割り当てを求めた同時実行数を記録するencoder_jobの代わり"""
+    @contextmanager
+    def encoder_job(concurrent_jobs=None):
+        calls.append(concurrent_jobs)
+        yield 1
+    return encoder_job
+
+
+@pytest.fixture
+def scratch(tmp_path, monkeypatch):
+    monkeypatch.setenv('TIKTOK_SCRATCH_DIR', str(tmp_path / 'scratch'))
+    return tmp_path
+
+
+def test_workers_in_separate_processes_render_all_entries(scratch):
+    shared_dir = str(scratch / 'shared')
+    queue = DistributedRenderQueue(shared_dir)
+    queue.submit_job('job', make_plan(6), ENCODER)
+    
+    # 最初のプロセスは2番目の要素で強制終了し、そのタスクはリースの期限切れ後に他のワーカーが取り直す
+    crashed = multiprocessing.Process(target=run_worker_process, args=(shared_dir, 2))
+    crashed.start()
+    crashed.join(timeout=30)
+    processes = [multiprocessing.Process(target=run_worker_process, args=(shared_dir,)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    try:
+        entry_segments = queue.wait_for_job('job', poll_interval=0.1, timeout=30)
+    finally:
+        for process in processes:
+            process.join(timeout=30)
+    
+    assert read_segments(entry_segments) == [
+        [f"scene{i}:tiktok", f"scene{i}:square"] for i in range(6)
+    ]
+    assert crashed.exitcode == 1
+    assert [process.exitcode for process in processes] == [0, 0]
+    assert queue.finish_job('job') is True
+    assert not os.path.exists(queue.job_dir('job'))
+    assert queue.tasks('job') == []
+
+
+def test_segments_are_kept_until_every_coordinator_finishes(scratch):
+    queue = DistributedRenderQueue(str(scratch / 'shared'))
+    worker = RenderWorker(queue, FakeGenerator(delay=0))
+    
+    queue.submit_job('job', make_plan(2), ENCODER)
+    queue.submit_job('job', make_plan(2), ENCODER)
+    while worker.run_once():
+        pass
+    
+    first = queue.wait_for_job('job', poll_interval=0.01)
+    assert queue.finish_job('job') is False
+    second = queue.wait_for_job('job', poll_interval=0.01)
+    assert read_segments(second) == read_segments(first)
+    assert queue.finish_job('job') is True
+    
+    # 全てのコーディネーターが終了した後は、タスクがないことをエラーとして報告する
+    with pytest.raises(RuntimeError):
+        queue.wait_for_job('job', poll_interval=0.01)
+
+
+def test_wait_gives_up_when_no_worker_takes_tasks(scratch):
+    queue = DistributedRenderQueue(str(scratch / 'shared'))
+    queue.submit_job('job', make_plan(2), ENCODER)
+    
+    start = time.time()
+    with pytest.raises(TimeoutError):
+        queue.wait_for_job('job', poll_interval=0.05, idle_timeout=0.3)
+    assert time.time() - start < 5
+    
+    # 失敗として終了したジョブのタスクは、再登録したときに再利用できるよう残す
+    assert queue.finish_job('job', status='failed') is False
+    assert len(queue.tasks('job')) == 2
+
+
+def test_failed_tasks_are_reported_after_max_attempts(scratch):
+    queue = DistributedRenderQueue(str(scratch / 'shared'))
+    worker = RenderWorker(queue, BrokenGenerator())
+    
+    queue.submit_job('job', make_plan(1), ENCODER)
+    for _ in range(distributed_render.MAX_ATTEMPTS):
+        assert worker.run_once()
+    assert not worker.run_once()
+    
+    with pytest.raises(RuntimeError, match="壊れた素材"):
+        queue.wait_for_job('job', poll_interval=0.01)
+
+
+def test_worker_processes_split_the_cores(scratch, monkeypatch):
+    threads = []
+    monkeypatch.setattr(distributed_render, 'encoder_job', recording_encoder_job(threads))
+    queue = DistributedRenderQueue(str(scratch / 'shared'))
+    worker = RenderWorker(queue, FakeGenerator(delay=0), concurrent_jobs=4)
+    
+    queue.submit_job('job', make_plan(1), ENCODER)
+    assert worker.run_once()
+    assert threads == [4]
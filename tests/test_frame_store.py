@@ -0,0 +1,103 @@
+import json
+import os
+import multiprocessing
+import numpy as np
+import pytest
+import frame_store
+from frame_store import SharedFrameStore, _attach, _unlink
+
+
+def _frame():
+    return np.arange(64 * 48 * 3, dtype=np.uint8).reshape(64, 48, 3)
+
+
+def _fail():
+    raise AssertionError("公開済みのフレームを再作成しました")
+
+
+def _read_in_child(store_dir, namespace, queue):
+    """別プロセスで同じキーを取得し、デコードせずに共有メモリの内容を読めるか確認する"""
+    store = SharedFrameStore(store_dir, namespace=namespace)
+    try:
+        frame = store.acquire('frame', _fail)
+        queue.put(('ok', int(frame.sum()), frame.flags.writeable, store.stats()['referenced']))
+    except BaseException as e:
+        queue.put(('error', repr(e), None, None))
+
+
+def _hold_and_exit(store_dir, namespace):
+    """参照を解放せずに終了する（強制終了したワーカーの代わり）"""
+    store = SharedFrameStore(store_dir, namespace=namespace)
+    store.acquire('frame', _fail)
+    os._exit(0)
+
+
+@pytest.fixture
+def store(tmp_path):
+    namespace = f"tvgtest{os.getpid()}"
+    store = SharedFrameStore(str(tmp_path), namespace=namespace)
+    yield store
+    store.release_all()
+    index_path = os.path.join(str(tmp_path), 'index.json')
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            for entry in json.load(f).values():
+                try:
+                    _unlink(_attach(entry['shm_name']))
+                except FileNotFoundError:
+                    pass
+
+
+def test_frame_is_shared_across_processes(store):
+    frame = store.acquire('frame', _frame)
+    
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_read_in_child, args=(store.store_dir, store.namespace, queue))
+    process.start()
+    status, total, writeable, referenced = queue.get(timeout=30)
+    process.join(timeout=30)
+    
+    assert status == 'ok', total
+    assert total == int(frame.sum())
+    assert writeable is False
+    assert referenced == 1
+
+
+def test_refs_of_dead_process_are_dropped(store):
+    store.acquire('frame', _frame)
+    store.release('frame')
+    
+    process = multiprocessing.Process(target=_hold_and_exit, args=(store.store_dir, store.namespace))
+    process.start()
+    process.join(timeout=30)
+    
+    assert process.exitcode == 0
+    assert store.stats()['referenced'] == 0
+
+
+def test_lease_releases_on_error(store):
+    with pytest.raises(RuntimeError):
+        with store.lease() as keys:
+            store.acquire('frame', _frame)
+            keys.append('frame')
+            raise RuntimeError("レンダリングエラー")
+    
+    assert store.stats()['referenced'] == 0
+
+
+def test_capacity_is_limited_to_free_shared_memory(store, monkeypatch):
+    frame = store.acquire('frame', _frame)
+    store.release('frame')
+    
+    # tmpfsの空きが次のフレームに足りない場合は、参照されていないフレームを削除して空ける
+    monkeypatch.setattr(frame_store, 'shared_memory_free_bytes', lambda: frame.nbytes // 2)
+    assert store.stats()['capacity_bytes'] == frame.nbytes + frame.nbytes // 2
+    other = store.acquire('other', lambda: _frame() + 1)
+    assert store.stats()['entries'] == 1
+    store.release('other')
+    
+    # 空けても足りない場合は共有せず、このプロセス専用の配列を返す
+    monkeypatch.setattr(frame_store, 'shared_memory_free_bytes', lambda: 0)
+    large = store.acquire('large', lambda: np.zeros(other.nbytes * 2, dtype=np.uint8))
+    assert large.nbytes == other.nbytes * 2
+    assert store.stats()['entries'] == 0
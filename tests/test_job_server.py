@@ -0,0 +1,172 @@
+import os
+import json
+import base64
+import threading
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer
+import pytest
+from job_server import JobService, make_handler
+from project_file import project_to_bytes
+
+PROFILES = {'tiktok': {'name': 'tiktok', 'width': 1080, 'height': 1920}}
+
+
+class FakeGenerator:
+    """動画の代わりにキーワードを書いたファイルを出力するジェネレーター"""
+    width, height = 1080, 1920
+    
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.configs = []
+    
+    def resolve_output_profile(self, profile):
+        if profile not in PROFILES:
+            raise ValueError(f"不明な出力プロファイル: {profile}")
+        return PROFILES[profile]
+    
+    def generate_video(self, keywords, selected_media, config=None, progress_callback=None):
+        self.configs.append(config)
+        if progress_callback:
+            progress_callback(0.5)
+        path = os.path.join(self.output_dir, config.output_filename)
+        with open(path, 'wb') as f:
+            f.write(','.join(keywords).encode('utf-8') + bytes(range(256)))
+        return path
+
+
+@pytest.fixture
+def service(tmp_path):
+    data_dir = str(tmp_path / "jobs")
+    generator = FakeGenerator(os.path.join(data_dir, "output"))
+    return JobService(data_dir=data_dir, workers=1, max_running_per_client=1, max_queued_per_client=2,
+                      audio_dir=str(tmp_path / "audio"), video_generator=generator)
+
+
+@pytest.fixture
+def server(service):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(service))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def project_payload(tmp_path, options=None):
+    media_path = tmp_path / "scene.jpg"
+    media_path.write_bytes(b"jpeg")
+    data = project_to_bytes(
+        "台本", [{'id': 1, 'text': "シーン"}], ["猫"],
+        {'1': [{'local_path': str(media_path), 'type': 'image'}]},
+        {'duration_per_scene': 3, 'add_title': False, 'add_ending': False, 'selected_bgm': None}
+    )
+    payload = {'project': base64.b64encode(data).decode('ascii')}
+    if options is not None:
+        payload['options'] = options
+    return payload
+
+
+def request(url, payload=None, client_id='client-a', headers=None):
+    """レスポンスのステータス・ヘッダー・本文を返す"""
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers=dict(headers or {}, **{'X-Client-Id': client_id}))
+    try:
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_post_accepts_job(server, service, tmp_path):
+    status, _, body = request(f"{server}/jobs", project_payload(tmp_path))
+    assert status == 202
+    job = json.loads(body)
+    assert job['status'] == 'queued'
+    assert service.queue.get(job['id'])['client_id'] == 'client-a'
+
+
+def test_post_rejects_clients_over_queued_limit(server, tmp_path):
+    for _ in range(2):
+        assert request(f"{server}/jobs", project_payload(tmp_path))[0] == 202
+    assert request(f"{server}/jobs", project_payload(tmp_path))[0] == 429
+    # 他のクライアントは制限を受けない
+    assert request(f"{server}/jobs", project_payload(tmp_path), client_id='client-b')[0] == 202
+
+
+@pytest.mark.parametrize('options', [
+    {'selected_bgm': '../../etc/passwd'},
+    {'encoder_profile': 'unknown'},
+    {'output_profiles': ['unknown']},
+    {'output_profiles': 'tiktok'},
+])
+def test_post_rejects_invalid_options(server, service, tmp_path, options):
+    status, _, body = request(f"{server}/jobs", project_payload(tmp_path, options))
+    assert status == 400
+    assert 'error' in json.loads(body)
+    assert service.queue.count_active('client-a') == 0
+
+
+def test_claim_honours_max_running_per_client(service):
+    first = service.submit('client-a', {'project': ''})
+    service.submit('client-a', {'project': ''})
+    other = service.submit('client-b', {'project': ''})
+    
+    assert service.queue.claim(1)['id'] == first
+    # client-aは実行枠が埋まっているため、後から登録したclient-bのジョブを取り出す
+    assert service.queue.claim(1)['id'] == other
+    assert service.queue.claim(1) is None
+    assert service.queue.claim(2)['client_id'] == 'client-a'
+
+
+def test_get_reports_progress_and_result(server, service, tmp_path):
+    job_id = service.submit('client-a', project_payload(tmp_path, {'output_profiles': ['tiktok']}))
+    
+    status, _, body = request(f"{server}/jobs/{job_id}")
+    assert status == 200
+    assert json.loads(body)['status'] == 'queued'
+    
+    service.queue.update(job_id, status='running', progress=0.25)
+    status, _, body = request(f"{server}/jobs/{job_id}")
+    assert (json.loads(body)['status'], json.loads(body)['progress']) == ('running', 0.25)
+    # 完了前の動画は取得できない
+    assert request(f"{server}/jobs/{job_id}/video")[0] == 409
+    
+    service.run_job(service.queue.get(job_id))
+    status, _, body = request(f"{server}/jobs/{job_id}")
+    job = json.loads(body)
+    assert (job['status'], job['progress']) == ('done', 1.0)
+    assert job['videos'] == {'default': f"/jobs/{job_id}/video?profile=default"}
+    assert service.video_generator.configs[0].output_profiles == ('tiktok',)
+    
+    assert request(f"{server}/jobs/unknown")[0] == 404
+
+
+def test_requeue_running(service):
+    job_id = service.submit('client-a', {'project': ''})
+    service.queue.claim(1)
+    assert service.queue.get(job_id)['status'] == 'running'
+    
+    # 再起動時に実行中だったジョブは待機中に戻り、再び取り出せる
+    service.queue.requeue_running()
+    assert service.queue.get(job_id)['status'] == 'queued'
+    assert service.queue.claim(1)['id'] == job_id
+
+
+def test_video_supports_range_requests(server, service, tmp_path):
+    job_id = service.submit('client-a', project_payload(tmp_path))
+    service.run_job(service.queue.get(job_id))
+    path = service.queue.get(job_id)['outputs']['default']
+    with open(path, 'rb') as f:
+        content = f.read()
+    
+    status, headers, body = request(f"{server}/jobs/{job_id}/video?profile=default")
+    assert status == 200
+    assert body == content
+    
+    status, headers, body = request(f"{server}/jobs/{job_id}/video", headers={'Range': 'bytes=10-19'})
+    assert status == 206
+    assert headers['Content-Range'] == f"bytes 10-19/{len(content)}"
+    assert body == content[10:20]
+    
+    assert request(f"{server}/jobs/{job_id}/video?profile=square")[0] == 404
@@ -0,0 +1,77 @@
+import os
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from media_fetcher import MediaFetcher
+
+
+def _start_server(delay=0.0, fail_first=0):
+    """指定した秒数待ってから応答するテスト用のHTTPサーバー（最初のfail_first回は503を返す）"""
+    state = {'requests': 0}
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state['requests'] += 1
+            if state['requests'] <= fail_first:
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            time.sleep(delay)
+            body = self.path.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", state
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = MediaFetcher(max_workers=2, per_host=1, retries=2, backoff=0.05)
+    yield fetcher
+    fetcher.shutdown()
+
+
+def test_waiting_for_a_busy_host_does_not_block_other_hosts(fetcher, tmp_path):
+    slow, slow_url, _ = _start_server(delay=1.0)
+    fast, fast_url, _ = _start_server()
+    try:
+        slow_paths = [str(tmp_path / f"slow{i}.jpg") for i in range(4)]
+        for i, path in enumerate(slow_paths):
+            fetcher.submit(f"{slow_url}/{i}", path)
+        fast_path = fetcher.submit(f"{fast_url}/fast", str(tmp_path / "fast.jpg"))
+        
+        # 遅いホストの待ち行列がワーカーを占有していなければ、すぐに完了する
+        assert fetcher.wait([fast_path], timeout=0.8)[fast_path] == 'done'
+        assert [fetcher.status(path)['status'] for path in slow_paths].count('running') == 1
+        
+        statuses = fetcher.wait(slow_paths, timeout=10)
+        assert set(statuses.values()) == {'done'}
+        with open(slow_paths[3], 'rb') as f:
+            assert f.read() == b'/3'
+    finally:
+        slow.shutdown()
+        fast.shutdown()
+
+
+def test_retries_and_forgets_finished_downloads(fetcher, tmp_path):
+    server, url, state = _start_server(fail_first=2)
+    try:
+        path = fetcher.submit(f"{url}/retry", str(tmp_path / "retry.jpg"))
+        # 実行中に削除を予約した記録は、完了時に削除される
+        fetcher.forget([path])
+        assert fetcher.wait([path], timeout=10)[path] is None
+        assert state['requests'] == 3
+        assert os.path.exists(path)
+        assert not os.path.exists(str(tmp_path / ".retry.jpg.part"))
+    finally:
+        server.shutdown()
@@ -0,0 +1,68 @@
+import io
+import zipfile
+import pytest
+from project_file import PROJECT_MANIFEST, project_to_bytes, load_project
+
+OPTIONS = {'duration_per_scene': 3, 'add_title': True, 'add_ending': True, 'selected_bgm': None,
+           'encoder_profile': 'standard'}
+
+
+def make_project(tmp_path, video_options=OPTIONS):
+    media_path = tmp_path / "scene.jpg"
+    media_path.write_bytes(b"jpeg")
+    return project_to_bytes(
+        "台本", [{'id': 1, 'text': "シーン"}], ["猫"],
+        {'1': [{'local_path': str(media_path), 'type': 'image'}]},
+        video_options
+    )
+
+
+def replace_blob(data, content):
+    """メディアの内容だけを差し替えたプロジェクトを作成する（ハッシュはそのまま）"""
+    source = zipfile.ZipFile(io.BytesIO(data))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name in source.namelist():
+            archive.writestr(name, source.read(name) if name == PROJECT_MANIFEST else content)
+    return buffer.getvalue()
+
+
+def test_load_project_extracts_media(tmp_path):
+    project = load_project(io.BytesIO(make_project(tmp_path)), str(tmp_path / "media"))
+    path = project['selected_media']['1'][0]['local_path']
+    with open(path, 'rb') as f:
+        assert f.read() == b"jpeg"
+    assert project['video_options']['encoder_profile'] == 'standard'
+
+
+def test_tampered_media_is_rejected(tmp_path):
+    data = replace_blob(make_project(tmp_path), b"tampered")
+    media_dir = tmp_path / "media"
+    with pytest.raises(ValueError):
+        load_project(io.BytesIO(data), str(media_dir))
+    # ハッシュ名のファイルも一時ファイルも残さない
+    assert list(media_dir.iterdir()) == []
+
+
+def test_existing_media_is_not_replaced_by_tampered_content(tmp_path):
+    data = make_project(tmp_path)
+    media_dir = tmp_path / "media"
+    path = load_project(io.BytesIO(data), str(media_dir))['selected_media']['1'][0]['local_path']
+    with open(path, 'wb') as f:
+        f.write(b"corrupted")
+    
+    with pytest.raises(ValueError):
+        load_project(io.BytesIO(replace_blob(data, b"tampered")), str(media_dir))
+    with open(path, 'rb') as f:
+        assert f.read() == b"corrupted"
+    
+    # 正しいプロジェクトを読み込むと破損したファイルを置き換える
+    load_project(io.BytesIO(data), str(media_dir))
+    with open(path, 'rb') as f:
+        assert f.read() == b"jpeg"
+
+
+def test_unknown_encoder_profile_is_rejected(tmp_path):
+    data = make_project(tmp_path, dict(OPTIONS, encoder_profile='unknown'))
+    with pytest.raises(ValueError):
+        load_project(io.BytesIO(data), str(tmp_path / "media"))
@@ -0,0 +1,98 @@
+import os
+import tempfile
+from collections import namedtuple
+import pytest
+import render_config
+from render_config import profile_crop, estimate_scratch_bytes, get_scratch_root, scratch_workspace
+
+MASTER = (1080, 1920)
+# video_generator.CAPTION_STYLEの余白（キャプションのボックスの下端は画面の下端からこの高さ）
+CAPTION_MARGIN = 100
+# 3行のキャプション（フォントサイズ70）とボックスの余白を合わせた高さ
+CAPTION_BOX_HEIGHT = 300
+
+
+def caption_inside(crop):
+    x, y, w, h = crop
+    box_bottom = MASTER[1] - CAPTION_MARGIN
+    box_top = box_bottom - CAPTION_BOX_HEIGHT
+    return y <= box_top and box_bottom <= y + h
+
+
+def test_square_crop_keeps_caption():
+    crop = profile_crop(*MASTER, 1080, 1080, bottom_margin=CAPTION_MARGIN // 2)
+    assert crop == (0, 790, 1080, 1080)
+    assert caption_inside(crop)
+
+
+def test_same_aspect_profile_is_not_cropped():
+    crop = profile_crop(*MASTER, 720, 1280, bottom_margin=CAPTION_MARGIN // 2)
+    assert crop == (0, 0, 1080, 1920)
+    assert caption_inside(crop)
+
+
+def test_crop_is_clamped_to_master():
+    # キャプションが中央の範囲に収まる場合は中央を切り出す
+    assert profile_crop(*MASTER, 1080, 1080, bottom_margin=5000) == (0, 420, 1080, 1080)
+    # 下端を超える範囲は切り出さない
+    assert profile_crop(*MASTER, 1080, 1080, bottom_margin=-50) == (0, 840, 1080, 1080)
+    # 横長のプロファイルは画面下部のキャプションの周辺を切り出す
+    assert profile_crop(*MASTER, 1920, 1080, bottom_margin=CAPTION_MARGIN // 2) == (0, 1264, 1080, 606)
+
+
+def test_profile_filter_uses_caption_margin():
+    video_generator = pytest.importorskip('video_generator')
+    generator = object.__new__(video_generator.VideoGenerator)
+    generator.width, generator.height = MASTER
+    
+    profiles = video_generator.OUTPUT_PROFILES
+    assert generator.profile_filter(profiles['square']) == "crop=1080:1080:0:790,scale=1080:1080"
+    assert generator.profile_filter(profiles['shorts_720p']) == "crop=1080:1920:0:0,scale=720:1280"
+    assert generator.profile_filter(profiles['tiktok']) is None
+
+
+@pytest.fixture
+def tmpfs(tmp_path, monkeypatch):
+    """空き容量を指定できるスクラッチ領域の候補"""
+    candidate = tmp_path / 'shm'
+    candidate.mkdir()
+    monkeypatch.delenv('TIKTOK_SCRATCH_DIR', raising=False)
+    monkeypatch.setattr(render_config, 'SCRATCH_ROOT_CANDIDATES', [str(candidate)])
+    usage = namedtuple('usage', 'total used free')
+    
+    def set_free(free_bytes):
+        monkeypatch.setattr(render_config.shutil, 'disk_usage', lambda path: usage(free_bytes, 0, free_bytes))
+    return str(candidate), set_free
+
+
+def test_estimate_scratch_bytes_scales_with_frames_and_profiles():
+    entries = [{'frames': 90}, {'frames': 60}]
+    one = estimate_scratch_bytes(entries, [{'width': 1080, 'height': 1920}])
+    two = estimate_scratch_bytes(entries, [{'width': 1080, 'height': 1920}, {'width': 1080, 'height': 1920}])
+    assert one == int(150 * 1080 * 1920 / 1e6 * render_config.SCRATCH_BYTES_PER_MP_FRAME)
+    assert two == 2 * one
+
+
+def test_scratch_root_uses_tmpfs_with_enough_space(tmpfs):
+    candidate, set_free = tmpfs
+    set_free(1024 ** 3)
+    assert get_scratch_root() == candidate
+    assert get_scratch_root(required_bytes=512 * 1024 ** 2) == candidate
+
+
+def test_scratch_root_falls_back_when_tmpfs_is_small(tmpfs):
+    candidate, set_free = tmpfs
+    # Dockerの既定の/dev/shm（64MB）
+    set_free(64 * 1024 ** 2)
+    assert get_scratch_root() == tempfile.gettempdir()
+    # ジョブの見積もりが空き容量を超える場合も使わない
+    set_free(1024 ** 3)
+    assert get_scratch_root(required_bytes=2 * 1024 ** 3) == tempfile.gettempdir()
+
+
+def test_scratch_workspace_is_created_in_selected_root(tmpfs):
+    candidate, set_free = tmpfs
+    set_free(1024 ** 3)
+    with scratch_workspace(required_bytes=1024) as workspace:
+        assert os.path.dirname(workspace) == candidate
+    assert not os.path.exists(workspace)
@@ -0,0 +1,134 @@
+import os
+import time
+import storage_manager
+from storage_manager import StorageManager
+
+
+def make_file(path, size=100, age_seconds=0):
+    """指定した時間だけ前に作成・使用したファイルを作成する"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    timestamp = time.time() - age_seconds
+    os.utime(path, (timestamp, timestamp))
+    return str(path)
+
+
+def make_manager(tmp_path, grace_seconds=60, **policy):
+    media_dir = str(tmp_path / "media")
+    os.makedirs(media_dir, exist_ok=True)
+    manager = StorageManager(str(tmp_path / "refs.json"), policies={media_dir: policy}, grace_seconds=grace_seconds)
+    return manager, media_dir
+
+
+def deleted_names(report, directory):
+    return [os.path.basename(item['path']) for item in report[directory]['deleted']]
+
+
+def test_quota_deletes_least_recently_used_first(tmp_path):
+    manager, media_dir = make_manager(tmp_path, max_bytes=150)
+    make_file(os.path.join(media_dir, "new.jpg"), age_seconds=1000)
+    make_file(os.path.join(media_dir, "old.jpg"), age_seconds=3000)
+    make_file(os.path.join(media_dir, "mid.jpg"), age_seconds=2000)
+    
+    report = manager.collect()
+    assert deleted_names(report, media_dir) == ["old.jpg", "mid.jpg"]
+    assert [item['reason'] for item in report[media_dir]['deleted']] == ['quota', 'quota']
+    assert report[media_dir]['freed_bytes'] == 200
+    assert not report[media_dir]['over_quota']
+    assert os.listdir(media_dir) == ["new.jpg"]
+
+
+def test_age_expires_files_under_quota(tmp_path):
+    manager, media_dir = make_manager(tmp_path, max_bytes=10 ** 6, max_age_days=1)
+    make_file(os.path.join(media_dir, "expired.jpg"), age_seconds=2 * 86400)
+    make_file(os.path.join(media_dir, "recent.jpg"), age_seconds=3600)
+    
+    report = manager.collect()
+    assert [(os.path.basename(item['path']), item['reason']) for item in report[media_dir]['deleted']] \
+        == [("expired.jpg", 'age')]
+    assert os.listdir(media_dir) == ["recent.jpg"]
+
+
+def test_age_and_quota_share_the_order(tmp_path):
+    manager, media_dir = make_manager(tmp_path, max_bytes=100, max_age_days=1)
+    make_file(os.path.join(media_dir, "expired.jpg"), age_seconds=2 * 86400)
+    make_file(os.path.join(media_dir, "old.jpg"), age_seconds=7200)
+    make_file(os.path.join(media_dir, "new.jpg"), age_seconds=3600)
+    
+    # 期限切れのファイルを削除した分も容量に反映され、残りは容量の上限で古い順に削除する
+    report = manager.collect()
+    assert [(os.path.basename(item['path']), item['reason']) for item in report[media_dir]['deleted']] \
+        == [("expired.jpg", 'age'), ("old.jpg", 'quota')]
+
+
+def test_referenced_files_are_kept(tmp_path):
+    manager, media_dir = make_manager(tmp_path, max_bytes=50, max_age_days=1)
+    referenced = make_file(os.path.join(media_dir, "project.jpg"), age_seconds=3 * 86400)
+    make_file(os.path.join(media_dir, "old.jpg"), age_seconds=7200)
+    make_file(os.path.join(media_dir, "new.jpg"), age_seconds=3600)
+    manager.set_references("project:demo.tvp", [referenced])
+    
+    report = manager.collect()
+    assert deleted_names(report, media_dir) == ["old.jpg", "new.jpg"]
+    assert report[media_dir]['referenced_files'] == 1
+    # 参照中のファイルだけで容量を超えている
+    assert report[media_dir]['over_quota']
+    assert os.listdir(media_dir) == ["project.jpg"]
+    
+    # 参照元を削除すると次回のGCで削除対象になる
+    manager.remove_owner("project:demo.tvp")
+    assert deleted_names(manager.collect(), media_dir) == ["project.jpg"]
+
+
+def test_references_expire_after_ttl(tmp_path, monkeypatch):
+    manager, media_dir = make_manager(tmp_path, max_bytes=10)
+    path = make_file(os.path.join(media_dir, "output.mp4"), age_seconds=3600)
+    manager.set_references("job:1", [path], ttl_seconds=600)
+    assert manager.collect()[media_dir]['deleted'] == []
+    
+    class LaterTime:
+        """保存期間が過ぎた後の時刻を返す"""
+        @staticmethod
+        def time():
+            return time.time() + 601
+    
+    monkeypatch.setattr(storage_manager, 'time', LaterTime)
+    assert deleted_names(manager.collect(), media_dir) == ["output.mp4"]
+    assert manager.referenced_paths() == set()
+
+
+def test_grace_period_protects_new_files(tmp_path):
+    manager, media_dir = make_manager(tmp_path, grace_seconds=600, max_bytes=10, max_age_days=0.001)
+    make_file(os.path.join(media_dir, "downloading.jpg"), age_seconds=300)
+    make_file(os.path.join(media_dir, "old.jpg"), age_seconds=900)
+    
+    report = manager.collect()
+    assert deleted_names(report, media_dir) == ["old.jpg"]
+    assert report[media_dir]['over_quota']
+    assert os.listdir(media_dir) == ["downloading.jpg"]
+
+
+def test_dry_run_reports_without_deleting(tmp_path):
+    manager, media_dir = make_manager(tmp_path, max_bytes=100)
+    make_file(os.path.join(media_dir, "a", "old.jpg"), age_seconds=2000)
+    make_file(os.path.join(media_dir, "new.jpg"), age_seconds=1000)
+    
+    report = manager.collect(dry_run=True)
+    assert deleted_names(report, media_dir) == ["old.jpg"]
+    assert report[media_dir]['freed_bytes'] == 100
+    assert os.path.exists(os.path.join(media_dir, "a", "old.jpg"))
+    
+    # 実際に削除すると空になったサブディレクトリも削除する
+    manager.collect()
+    assert os.listdir(media_dir) == ["new.jpg"]
+
+
+def test_max_deletions_limits_each_run(tmp_path):
+    manager, media_dir = make_manager(tmp_path, max_bytes=100)
+    for i in range(4):
+        make_file(os.path.join(media_dir, f"{i}.jpg"), age_seconds=5000 - i * 1000)
+    
+    assert deleted_names(manager.collect(max_deletions=2), media_dir) == ["0.jpg", "1.jpg"]
+    assert deleted_names(manager.collect(max_deletions=2), media_dir) == ["2.jpg"]
+    assert sorted(os.listdir(media_dir)) == ["3.jpg"]
@@ -1,18 +1,83 @@
 import os
 import time
+import shutil
+import threading
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # Windowsにはresourceモジュールがない
+    resource = None
+import numpy as np
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 from moviepy.editor import (
-    TextClip, ImageClip, VideoFileClip, 
+    TextClip, ImageClip, VideoFileClip, VideoClip,
     CompositeVideoClip, concatenate_videoclips,
-    ColorClip, AudioFileClip
+    ColorClip, AudioFileClip, CompositeAudioClip
 )
-from moviepy.video.fx.resize import resize
 from moviepy.video.fx.fadein import fadein
 from moviepy.video.fx.fadeout import fadeout
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+from ffmpeg_tools import concat_segments
+from file_streaming import ensure_faststart
+from render_config import RenderConfig, estimate_scratch_bytes, profile_crop, scratch_workspace
+from render_checkpoint import RenderCheckpoint, compute_job_key
+from encoder_profiles import (
+    get_encoder_profile, encoder_ffmpeg_params, encoder_job, allocate_threads, active_job_count
+)
+from render_plan import PLAN_VERSION, RenderCostModel, MemorySampler, probe_media
+from frame_store import asset_key, frame_key
+from compositor import FADE_DURATION, FrameCompositor, CaptionLayer, SceneLayout
+
+# 出力プロファイル（同じタイムラインから書き出す解像度のバリエーション）
+OUTPUT_PROFILES = {
+    'tiktok': {'name': 'tiktok', 'width': 1080, 'height': 1920},
+    'reels': {'name': 'reels', 'width': 1080, 'height': 1920},
+    'shorts_720p': {'name': 'shorts_720p', 'width': 720, 'height': 1280},
+    'square': {'name': 'square', 'width': 1080, 'height': 1080},
+}
+
+# タイトル・エンディングスライドのスタイル
+SLIDE_STYLE = {
+    'duration': 3,
+    'position': 'center',
+    'color': 'white',
+    'bg_color': (0, 0, 0)
+}
+ENDING_TEXT = "ご視聴ありがとうございました！"
+
+# シーンのキャプション（画面下部、半透明の黒いボックス）
+CAPTION_STYLE = {
+    'padding': 20,
+    'margin': 100,
+    'box_color': (0, 0, 0),
+    'box_alpha': 128
+}
+ZOOM_FACTOR = 1.05  # 5%ズーム
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
 
 class VideoGenerator:
-    def __init__(self, output_dir="output"):
-        """動画生成クラスの初期化"""
+    def __init__(self, output_dir="output", segment_library=None, checkpoint_dir=None, cost_model=None,
+                 frame_store=None, task_queue=None):
+        """動画生成クラスの初期化
+
+        checkpoint_dirを指定すると、シーン単位のセグメントを保存しながら書き出し、
+        同じジョブを再実行した場合は未完了のシーンから再開する。
+        frame_store（SharedFrameStore）を指定すると、デコード済みの画像とキャプションを
+        他のレンダリングプロセスと共有メモリで共有する。
+        task_queue（DistributedRenderQueue）を指定すると、シーンごとのタスクを共有キューに登録し、
+        任意のホストのワーカーが書き出したセグメントを連結する（メディアは共有ストレージに置くこと）。
+        """
         self.output_dir = output_dir
+        self.segment_library = segment_library
+        self.checkpoint_dir = checkpoint_dir
+        self.cost_model = cost_model or RenderCostModel()
+        self.frame_store = frame_store
+        self.task_queue = task_queue
+        self._local = threading.local()
         os.makedirs(output_dir, exist_ok=True)
         
         # TikTok向けの縦型動画設定
@@ -26,19 +91,17 @@ class VideoGenerator:
         self.scene_duration = 5
         self.add_title = True
         self.add_ending = True
+        self.encoder_profile = 'standard'
         
     def create_text_clip(self, text, duration=3, position='center', color='white', bg_color=None):
         """テキストクリップを作成する"""
         # テキストクリップの作成
-        txt_clip = TextClip(
-            text, 
-            fontsize=self.font_size, 
-            font=self.font, 
-            color=color,
-            align='center',
-            method='caption',
-            size=(self.width - 100, None)  # 幅に余白を持たせる
-        )
+        if self.frame_store is not None:
+            # 描画済みのキャプションを他のプロセスと共有する（RGBAの1枚の配列）
+            key = frame_key('caption', text, self.font, self.font_size, color, self.width - 100)
+            txt_clip = ImageClip(self._shared_frame(key, lambda: self._render_caption(text, color)))
+        else:
+            txt_clip = self._text_clip(text, color)
         
         # 背景色がある場合は背景を追加
         if bg_color:
@@ -66,133 +129,265 @@ class VideoGenerator:
         
         return txt_clip
     
-    def create_image_clip(self, image_path, duration=3, zoom=False):
-        """画像クリップを作成する"""
-        img_clip = ImageClip(image_path)
-        
-        # TikTok形式に合わせてリサイズ
-        # 縦横比を維持しながら、高さまたは幅をTikTok形式に合わせる
-        if img_clip.w / img_clip.h > self.width / self.height:  # 画像が横長の場合
-            new_height = self.height
-            new_width = int(img_clip.w * new_height / img_clip.h)
-            img_clip = img_clip.resize(height=new_height)
-            # 中央部分をクロップ
-            x_offset = (new_width - self.width) // 2
-            img_clip = img_clip.crop(x1=x_offset, y1=0, x2=x_offset + self.width, y2=self.height)
-        else:  # 画像が縦長または正方形の場合
-            new_width = self.width
-            new_height = int(img_clip.h * new_width / img_clip.w)
-            img_clip = img_clip.resize(width=new_width)
-            # 中央部分をクロップ
-            y_offset = (new_height - self.height) // 2 if new_height > self.height else 0
-            img_clip = img_clip.crop(x1=0, y1=y_offset, x2=self.width, y2=y_offset + self.height) if new_height > self.height else img_clip
-        
-        # ズーム効果
-        if zoom:
-            zoom_factor = 1.05  # 5%ズーム
-            zoomed_clip = img_clip.resize(zoom_factor)
-            # 中央部分をクロップ
-            x_offset = (zoomed_clip.w - img_clip.w) // 2
-            y_offset = (zoomed_clip.h - img_clip.h) // 2
-            zoomed_clip = zoomed_clip.crop(x1=x_offset, y1=y_offset, x2=x_offset + img_clip.w, y2=y_offset + img_clip.h)
-            
-            # 最初のクリップと最後のクリップを作成
-            start_clip = img_clip.set_duration(duration / 2)
-            end_clip = zoomed_clip.set_duration(duration / 2)
-            
-            # クリップを連結
-            img_clip = concatenate_videoclips([start_clip, end_clip])
-        
-        # 持続時間設定
-        img_clip = img_clip.set_duration(duration)
+    def _text_clip(self, text, color):
+        return TextClip(
+            text, 
+            fontsize=self.font_size, 
+            font=self.font, 
+            color=color,
+            align='center',
+            method='caption',
+            size=(self.width - 100, None)  # 幅に余白を持たせる
+        )
+    
+    def _render_caption(self, text, color):
+        """キャプションを描画し、マスクをアルファチャンネルとしたRGBA配列を返す"""
+        txt_clip = self._text_clip(text, color)
+        rgb = txt_clip.get_frame(0).astype('uint8')
+        alpha = (txt_clip.mask.get_frame(0) * 255).astype('uint8')
+        return np.dstack([rgb, alpha])
+    
+    def _decode_image(self, image_path):
+        """画像を読み込み、縦横比を保ったまま画面サイズにリサイズ・クロップする"""
+        with Image.open(image_path) as img:
+            img = img.convert('RGB')
+            if img.width / img.height > self.width / self.height:  # 画像が横長の場合
+                new_width = int(img.width * self.height / img.height)
+                img = img.resize((new_width, self.height), Image.LANCZOS)
+                x_offset = (new_width - self.width) // 2
+                img = img.crop((x_offset, 0, x_offset + self.width, self.height))
+            else:  # 画像が縦長または正方形の場合
+                new_height = int(img.height * self.width / img.width)
+                img = img.resize((self.width, new_height), Image.LANCZOS)
+                if new_height > self.height:
+                    y_offset = (new_height - self.height) // 2
+                    img = img.crop((0, y_offset, self.width, y_offset + self.height))
+            return np.asarray(img)
+    
+    def _zoom_frame(self, frame, zoom_factor):
+        """フレームを拡大し、中央部分を元のサイズでクロップする"""
+        height, width = frame.shape[:2]
+        img = Image.fromarray(frame)
+        zoomed = img.resize((int(width * zoom_factor), int(height * zoom_factor)), Image.LANCZOS)
+        x_offset = (zoomed.width - width) // 2
+        y_offset = (zoomed.height - height) // 2
+        return np.asarray(zoomed.crop((x_offset, y_offset, x_offset + width, y_offset + height)))
+    
+    def _shared_frame(self, key, producer):
+        """フレームストアから配列を取得し、実行中のジョブの終了時に解放するよう記録する"""
+        frame = self.frame_store.acquire(key, producer)
+        frame_keys = getattr(self._local, 'frame_keys', None)
+        if frame_keys is not None:
+            frame_keys.append(key)
+        return frame
+    
+    @contextmanager
+    def _frame_lease(self):
+        """ジョブ中に取得した共有フレームを、ジョブの終了時にまとめて解放する"""
+        if self.frame_store is None:
+            yield
+            return
+        with self.frame_store.lease() as frame_keys:
+            self._local.frame_keys = frame_keys
+            try:
+                yield
+            finally:
+                self._local.frame_keys = None
+    
+    def _image_frame(self, image_path, zoom_factor=None):
+        """画面サイズにリサイズ・クロップした画像（ズームする場合は拡大後に中央をクロップ）"""
+        if self.frame_store is None:
+            frame = self._decode_image(image_path)
+            return self._zoom_frame(frame, zoom_factor) if zoom_factor else frame
         
-        # フェードイン・アウト効果
-        img_clip = img_clip.fx(fadein, 0.5).fx(fadeout, 0.5)
+        # デコード・リサイズ済みのフレームを他のプロセスと共有する
+        source_key = asset_key(image_path)
+        base_key = frame_key('image', source_key, self.width, self.height)
+        frame = self._shared_frame(base_key, lambda: self._decode_image(image_path))
+        if not zoom_factor:
+            return frame
+        zoom_key = frame_key('image_zoom', source_key, self.width, self.height, zoom_factor)
+        return self._shared_frame(zoom_key, lambda: self._zoom_frame(frame, zoom_factor))
+    
+    def create_video_clip(self, video_path, duration):
+        """動画クリップを指定の長さ（短い場合はループ）でTikTok形式に合わせて作成する"""
+        source = VideoFileClip(video_path)
+        video_clip = source
+        # 動画の長さがdurationより短い場合はループ
+        if video_clip.duration < duration:
+            n_loops = int(duration / video_clip.duration) + 1
+            video_clip = concatenate_videoclips([video_clip] * n_loops)
+        # 指定の長さにカット
+        clip = video_clip.subclip(0, duration)
+        # TikTok形式にリサイズ
+        clip = clip.resize(height=self.height)
+        # 中央部分をクロップ
+        x_offset = (clip.w - self.width) // 2 if clip.w > self.width else 0
+        clip = clip.crop(x1=x_offset, y1=0, x2=x_offset + self.width, y2=self.height) if clip.w > self.width else clip
+        # 読み込み元（ffmpegのプロセス）を後で閉じられるよう保持する
+        clip.source = source
+        return clip
+    
+    def _compositor(self):
+        """レンダリングするスレッドごとのフレーム合成器（バッファを使い回す）"""
+        compositor = getattr(self._local, 'compositor', None)
+        if compositor is None:
+            compositor = FrameCompositor(self.width, self.height)
+            self._local.compositor = compositor
+        return compositor
+    
+    def create_caption_layer(self, text, color='white'):
+        """画面下部に表示する、半透明の背景ボックス付きキャプションのレイヤーを作成する"""
+        if self.frame_store is not None:
+            key = frame_key('caption', text, self.font, self.font_size, color, self.width - 100)
+            rgba = self._shared_frame(key, lambda: self._render_caption(text, color))
+        else:
+            rgba = self._render_caption(text, color)
         
-        return img_clip
+        # 画面に収まらない長さのキャプションは下側を切り詰める
+        padding = CAPTION_STYLE['padding']
+        rgba = rgba[:self.height - CAPTION_STYLE['margin'] - padding * 2]
+        box_h = rgba.shape[0] + padding * 2
+        box_w = rgba.shape[1] + padding * 2
+        return CaptionLayer(
+            rgba,
+            (self.width - box_w) // 2,
+            self.height - box_h - CAPTION_STYLE['margin'],
+            padding=padding,
+            box_color=CAPTION_STYLE['box_color'],
+            box_alpha=CAPTION_STYLE['box_alpha']
+        )
     
     def create_scene_clip(self, scene_text, media_paths, scene_duration=5):
-        """シーンクリップを作成する"""
-        clips = []
+        """シーンクリップを作成する
+
+        背景メディアの切り替え・フェード・キャプションの合成はFrameCompositorが
+        事前に確保したバッファ上の整数演算で行い、moviepyのエフェクトは使わない。
+        静止画の区間は一度だけ合成し、フェード中も合成済みのフレームに係数を掛けるだけにする。
+        """
+        layers = []
+        audio_clips = []
+        sources = []
         
         # 各メディアの持続時間を計算
         media_duration = scene_duration / len(media_paths) if media_paths else scene_duration
         
-        # メディアクリップを作成
+        # 背景のレイヤーを作成（開始時刻, 長さ, 背景の取得関数, フェードの有無, 静止画かどうか）
+        start = 0
         for i, media_path in enumerate(media_paths):
-            if media_path.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')):
-                # 画像の場合
-                clip = self.create_image_clip(
-                    media_path, 
-                    duration=media_duration,
-                    zoom=(i % 2 == 0)  # 交互にズーム効果を適用
-                )
-            elif media_path.lower().endswith(('.mp4', '.mov', '.avi')):
+            if media_path.lower().endswith(IMAGE_EXTENSIONS):
+                # 画像の場合（交互にズーム効果を適用し、後半は拡大した画像を表示）
+                frame = self._image_frame(media_path)
+                if i % 2 == 0:
+                    zoomed = self._image_frame(media_path, zoom_factor=ZOOM_FACTOR)
+                    half = media_duration / 2
+                    get_background = lambda t, a=frame, b=zoomed, half=half: a if t < half else b
+                else:
+                    get_background = lambda t, a=frame: a
+                layers.append((start, media_duration, get_background, True, True))
+            elif media_path.lower().endswith(VIDEO_EXTENSIONS):
                 # 動画の場合
-                video_clip = VideoFileClip(media_path)
-                # 動画の長さがmedia_durationより短い場合はループ
-                if video_clip.duration < media_duration:
-                    n_loops = int(media_duration / video_clip.duration) + 1
-                    video_clip = concatenate_videoclips([video_clip] * n_loops)
-                # 指定の長さにカット
-                clip = video_clip.subclip(0, media_duration)
-                # TikTok形式にリサイズ
-                clip = clip.resize(height=self.height)
-                # 中央部分をクロップ
-                x_offset = (clip.w - self.width) // 2 if clip.w > self.width else 0
-                clip = clip.crop(x1=x_offset, y1=0, x2=x_offset + self.width, y2=self.height) if clip.w > self.width else clip
+                clip = self.create_video_clip(media_path, media_duration)
+                sources.append(clip.source)
+                layers.append((start, media_duration, clip.get_frame, False, False))
+                if clip.audio is not None:
+                    audio_clips.append(clip.audio.set_start(start))
             else:
                 # サポートされていないメディア形式
                 continue
-            
-            clips.append(clip)
+            start += media_duration
         
         # メディアがない場合は黒背景を作成
-        if not clips:
-            bg_clip = ColorClip(size=(self.width, self.height), color=(0, 0, 0))
-            bg_clip = bg_clip.set_duration(scene_duration)
-            clips.append(bg_clip)
-        
-        # テキストクリップを作成
-        text_clip = self.create_text_clip(
-            scene_text,
-            duration=scene_duration,
-            position='bottom',
-            color='white',
-            bg_color=(0, 0, 0, 128)  # 半透明の黒背景
-        )
+        if not layers:
+            black = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+            layers.append((0, scene_duration, lambda t: black, False, True))
         
-        # 最終的なシーンクリップを作成
-        if len(clips) > 1:
-            # 複数のメディアがある場合は連結
-            base_clip = concatenate_videoclips(clips)
-        else:
-            # 1つのメディアの場合はそのまま使用
-            base_clip = clips[0]
-        
-        # テキストをオーバーレイ
-        scene_clip = CompositeVideoClip([base_clip, text_clip])
+        # キャプションを重ねたフレームを合成するクリップ
+        layout = SceneLayout(self._compositor(), layers, self.create_caption_layer(scene_text), scene_duration)
+        scene_clip = VideoClip(layout.make_frame, duration=scene_duration)
+        if audio_clips:
+            scene_clip = scene_clip.set_audio(CompositeAudioClip(audio_clips).set_duration(scene_duration))
+        # 書き出し後に閉じる動画の読み込み元
+        scene_clip.sources = sources
         
         return scene_clip
     
-    def generate_video(self, scenes, media_dict, output_filename="tiktok_video.mp4", bgm_path=None):
-        """動画を生成する"""
-        scene_clips = []
+    def create_scene_audio(self, media_paths, scene_duration=5):
+        """シーンの音声のみを作成する（動画メディアがない場合はNone）
+
+        create_scene_clipと同じ時刻に動画メディアの音声を配置する。画像の読み込みや
+        キャプションの描画は行わないため、音声だけが必要な場合はこちらを使う。
+        """
+        audio_clips = []
+        media_duration = scene_duration / len(media_paths) if media_paths else scene_duration
+        start = 0
+        for media_path in media_paths:
+            if media_path.lower().endswith(VIDEO_EXTENSIONS):
+                clip = self.create_video_clip(media_path, media_duration)
+                if clip.audio is not None:
+                    audio_clips.append(clip.audio.set_start(start))
+            elif not media_path.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            start += media_duration
+        if not audio_clips:
+            return None
+        return CompositeAudioClip(audio_clips).set_duration(scene_duration)
+    
+    def text_slide_entry(self, kind, text):
+        """タイトル・エンディングなどのテキストスライドのタイムライン要素を作成する"""
+        return {
+            'kind': kind,
+            'text': text,
+            'style': dict(SLIDE_STYLE),
+            'duration': SLIDE_STYLE['duration']
+        }
+    
+    def create_slide_clip(self, text, style):
+        """テキストスライドを動画全体のサイズで作成する"""
+        txt_clip = self.create_text_clip(text, **style)
+        return CompositeVideoClip([txt_clip], size=(self.width, self.height))
+    
+    def entry_clip(self, entry):
+        """タイムライン要素のクリップを取得する（必要になった時点で作成）"""
+        if entry['clip'] is None:
+            if entry['kind'] == 'scene':
+                entry['clip'] = self.create_scene_clip(entry['text'], entry['media_paths'], entry['duration'])
+            else:
+                entry['clip'] = self.create_slide_clip(entry['text'], entry['style'])
+        return entry['clip']
+    
+    def release_entry_clip(self, entry):
+        """書き出し済みの要素のクリップを破棄し、動画の読み込み元を閉じる"""
+        clip = entry['clip']
+        entry['clip'] = None
+        for source in getattr(clip, 'sources', []):
+            try:
+                source.close()
+            except Exception as e:
+                print(f"動画クリップのクローズエラー: {e}")
+    
+    def plan_render(self, scenes, media_dict, config=None):
+        """シーンとメディアから、レンダリングの内容を明示したタイムライン（計画）を作成する
+
+        計画には各要素の長さ・開始時刻・フレーム数・エフェクト・メディアの種類と
+        解像度が含まれ、generate_videoはこの計画どおりにレンダリングする。
+        """
+        if config is None:
+            config = self.default_config()
+        encoder = get_encoder_profile(config.encoder_profile)
+        if config.output_profiles:
+            profiles = [self.resolve_output_profile(p) for p in config.output_profiles]
+        else:
+            profiles = [{'name': 'default', 'width': self.width, 'height': self.height}]
         
-        # タイトルクリップを作成（最初のシーンのテキストを使用）
-        if self.add_title and scenes:
+        entries = []
+        
+        # タイトルスライド（最初のシーンのテキストを使用）
+        if config.add_title and scenes:
             first_scene_id = list(scenes.keys())[0]
-            title_text = scenes[first_scene_id]['text']
-            title_clip = self.create_text_clip(
-                title_text,
-                duration=3,
-                position='center',
-                color='white',
-                bg_color=(0, 0, 0)
-            )
-            scene_clips.append(title_clip)
-        
-        # 各シーンのクリップを作成
+            entries.append(self.text_slide_entry('title', scenes[first_scene_id]['text']))
+        
+        # 各シーン
         for scene_id, scene_data in scenes.items():
             scene_text = scene_data['text']
             
@@ -203,27 +398,124 @@ class VideoGenerator:
             
             # シーンの長さを決定（文字数に応じて調整）
             text_length = len(scene_text)
-            scene_duration = max(3, min(8, self.scene_duration))  # 最小3秒、最大8秒
+            scene_duration = max(3, min(8, config.scene_duration))  # 最小3秒、最大8秒
             
-            # シーンクリップを作成
-            scene_clip = self.create_scene_clip(scene_text, media_paths, scene_duration)
-            scene_clips.append(scene_clip)
-        
-        # エンディングクリップを作成
-        if self.add_ending:
-            ending_clip = self.create_text_clip(
-                "ご視聴ありがとうございました！",
-                duration=3,
-                position='center',
-                color='white',
-                bg_color=(0, 0, 0)
-            )
-            scene_clips.append(ending_clip)
-        
-        # 全てのクリップを連結
-        final_clip = concatenate_videoclips(scene_clips)
-        
-        # BGMを追加
+            # 各メディアの種類・解像度と、create_scene_clipが適用するエフェクト
+            media = []
+            media_duration = scene_duration / len(media_paths) if media_paths else scene_duration
+            for i, media_path in enumerate(media_paths):
+                if not media_path.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+                    continue
+                info = probe_media(media_path)
+                info.update({
+                    'path': media_path,
+                    'clip_duration': media_duration,
+                    'zoom': info['type'] == 'image' and i % 2 == 0,
+                    'effects': ['fadein', 'fadeout'] if info['type'] == 'image' else []
+                })
+                media.append(info)
+            
+            entries.append({
+                'kind': 'scene',
+                'scene_id': scene_id,
+                'text': scene_text,
+                'media_paths': media_paths,
+                'media': media,
+                'duration': scene_duration,
+                'effects': ['caption', 'fadein', 'fadeout'],
+                'static_frames': self.count_static_frames(media, scene_duration)
+            })
+        
+        # エンディングスライド
+        if config.add_ending:
+            entries.append(self.text_slide_entry('ending', ENDING_TEXT))
+        
+        # 開始時刻・フレーム数と、ライブラリに登録済みのスライドを記録
+        start = 0
+        for entry in entries:
+            entry['start'] = start
+            entry['frames'] = int(round(entry['duration'] * self.fps))
+            if entry['kind'] != 'scene':
+                entry['effects'] = ['fadein', 'fadeout']
+                entry['cached'] = self.segment_library is not None and all(
+                    self.segment_library.has_segment(self, entry['text'], entry['style'], profile, encoder)
+                    for profile in profiles
+                )
+            start += entry['duration']
+        
+        return {
+            'version': PLAN_VERSION,
+            'width': self.width,
+            'height': self.height,
+            'fps': self.fps,
+            'encoder': encoder,
+            'profiles': profiles,
+            'entries': entries,
+            'duration': start,
+            'frames': sum(entry['frames'] for entry in entries)
+        }
+    
+    def count_static_frames(self, media, scene_duration):
+        """合成済みのフレームを使い回せる（背景が静止画でフェードがキャプションと揃う）フレーム数"""
+        static_seconds = 0
+        start = 0
+        for info in media:
+            end = start + info['clip_duration']
+            if info['type'] == 'image':
+                # シーンの途中の切り替えでは背景だけがフェードするため、その区間は毎フレーム合成する
+                length = info['clip_duration']
+                if start > 0:
+                    length -= FADE_DURATION
+                if end < scene_duration:
+                    length -= FADE_DURATION
+                static_seconds += max(0, length)
+            start = end
+        if not media:
+            # 黒背景はフェードしないため、キャプションのフェード中以外を使い回す
+            static_seconds = max(0, scene_duration - FADE_DURATION * 2)
+        return int(round(static_seconds * self.fps))
+    
+    def estimate_render(self, plan, threads=None):
+        """計画からレンダリングの所要時間とメモリを推定する"""
+        if threads is None:
+            threads = allocate_threads(active_job_count() + 1)
+        return self.cost_model.estimate(plan, threads=threads)
+    
+    def build_timeline(self, plan):
+        """計画から、全プロファイルで共有するタイムラインを作成する
+
+        クリップは書き出す時点で作成する（再開時は完了済みのシーンを読み込まない）。
+        """
+        return [dict(entry, clip=None) for entry in plan['entries']]
+    
+    def entry_has_audio(self, entry):
+        """タイムライン要素が音声を持つ（動画メディアを含む）かどうか"""
+        return entry['kind'] == 'scene' and any(
+            path.lower().endswith(VIDEO_EXTENSIONS) for path in entry['media_paths']
+        )
+    
+    def timeline_audio_clip(self, timeline, bgm_path, segmented=False):
+        """タイムライン全体の音声用クリップを作成する
+
+        セグメント単位で書き出す場合、映像は使わないため全ての要素を代替クリップにし、
+        動画メディアを含む要素にはその音声だけを設定する。
+        """
+        clips = []
+        for entry in timeline:
+            if segmented:
+                placeholder = ColorClip(size=(self.width, self.height), color=(0, 0, 0))
+                placeholder = placeholder.set_duration(entry['duration'])
+                if self.entry_has_audio(entry):
+                    audio = self.create_scene_audio(entry['media_paths'], entry['duration'])
+                    if audio is not None:
+                        placeholder = placeholder.set_audio(audio)
+                clips.append(placeholder)
+            else:
+                clips.append(self.entry_clip(entry))
+        return self.add_bgm(concatenate_videoclips(clips), bgm_path)
+    
+    def add_bgm(self, final_clip, bgm_path):
+        """BGMを追加する"""
         if bgm_path and os.path.exists(bgm_path):
             try:
                 audio_clip = AudioFileClip(bgm_path)
@@ -238,19 +530,335 @@ class VideoGenerator:
                 final_clip = final_clip.set_audio(audio_clip)
             except Exception as e:
                 print(f"BGM追加エラー: {e}")
+        return final_clip
+    
+    def resolve_output_profile(self, profile):
+        """プロファイル名または辞書から出力プロファイルを取得する"""
+        if isinstance(profile, str):
+            if profile not in OUTPUT_PROFILES:
+                raise ValueError(f"不明な出力プロファイル: {profile}")
+            return OUTPUT_PROFILES[profile]
+        return profile
+    
+    def profile_filter(self, profile):
+        """マスター解像度からプロファイル解像度へのクロップ＋スケールのフィルタを作成する"""
+        target_w, target_h = profile['width'], profile['height']
+        if (target_w, target_h) == (self.width, self.height):
+            return None
+        
+        # 縦横比を合わせてクロップする（画面下部のキャプションの下端から余白の半分までは残す）
+        x, y, crop_w, crop_h = profile_crop(
+            self.width, self.height, target_w, target_h, bottom_margin=CAPTION_STYLE['margin'] // 2
+        )
+        return f"crop={crop_w}:{crop_h}:{x}:{y},scale={target_w}:{target_h}"
+    
+    def encode_signature(self, profile, encoder):
+        """セグメントをストリームコピーで連結するために一致させるエンコードパラメータ"""
+        return {
+            'codec': encoder['codec'],
+            'preset': encoder['preset'],
+            'crf': encoder['crf'],
+            'tune': encoder['tune'],
+            'gop': encoder['gop'],
+            'pix_fmt': encoder['pix_fmt'],
+            'fps': self.fps,
+            'source_size': [self.width, self.height],
+            'filter': self.profile_filter(profile),
+            'size': [profile['width'], profile['height']]
+        }
+    
+    def write_frames(self, clip, profiles, output_paths, encoder, audiofile=None):
+        """1回のフレーム生成から複数プロファイルを同時にエンコードする"""
+        # マスター解像度に満たないクリップは中央に配置する
+        if tuple(clip.size) != (self.width, self.height):
+            clip = CompositeVideoClip([clip.set_position('center')], size=(self.width, self.height))
+        
+        writers = []
+        try:
+            for profile, output_path in zip(profiles, output_paths):
+                vf = self.profile_filter(profile)
+                ffmpeg_params = encoder_ffmpeg_params(encoder)
+                if vf:
+                    ffmpeg_params += ['-vf', vf]
+                writers.append(FFMPEG_VideoWriter(
+                    output_path,
+                    (self.width, self.height),
+                    self.fps,
+                    codec=encoder['codec'],
+                    preset=encoder['preset'],
+                    audiofile=audiofile,
+                    threads=max(1, encoder['threads'] // len(profiles)),
+                    ffmpeg_params=ffmpeg_params
+                ))
+            
+            # 各フレームは一度だけ合成し、全エンコーダーへ並列に書き込む
+            with ThreadPoolExecutor(max_workers=len(writers)) as pool:
+                for frame in clip.iter_frames(fps=self.fps, dtype='uint8'):
+                    list(pool.map(lambda writer: writer.write_frame(frame), writers))
+        finally:
+            for writer in writers:
+                writer.close()
+        
+        return output_paths
+    
+    def write_audio(self, audio_clip, audiofile):
+        """ミックス済みの音声を一度だけ書き出す"""
+        audio_clip.write_audiofile(audiofile, fps=44100, codec='aac')
+        return audiofile
+    
+    def export_segments(self, timeline, profiles, output_paths, encoder, workspace,
+                        checkpoint=None, audiofile=None, progress_callback=None):
+        """タイムラインを要素ごとのセグメントに書き出し、ストリームコピーで連結する
+
+        テキストスライドはライブラリのエンコード済みセグメントを使用する。
+        チェックポイントがある場合は完了済みのセグメントを再利用し、
+        未完了の要素から書き出しを再開する。
+        """
+        segments = [[] for _ in profiles]
+        for index, entry in enumerate(timeline):
+            paths = self.export_entry(index, entry, profiles, encoder, workspace, checkpoint)
+            for profile_segments, path in zip(segments, paths):
+                profile_segments.append(path)
+            if progress_callback:
+                progress_callback((index + 1) / len(timeline))
         
-        # 出力ファイルパスを設定
-        output_path = os.path.join(self.output_dir, output_filename)
-        
-        # 動画を書き出し
-        final_clip.write_videofile(
-            output_path,
-            fps=self.fps,
-            codec='libx264',
-            audio_codec='aac',
-            temp_audiofile='temp-audio.m4a',
-            remove_temp=True,
-            threads=4
+        with ThreadPoolExecutor(max_workers=len(profiles)) as pool:
+            list(pool.map(
+                lambda args: concat_segments(
+                    args[0], args[1], audiofile=audiofile, work_dir=workspace,
+                    faststart=encoder['faststart']
+                ),
+                zip(segments, output_paths)
+            ))
+        
+        return output_paths
+    
+    def render_distributed(self, job_key, plan, encoder, output_paths, workspace, audiofile=None,
+                           progress_callback=None):
+        """計画の要素ごとのタスクを共有キューに登録し、全て完了したらセグメントを連結する
+
+        ジョブのIDにはチェックポイントと同じジョブキーを使うため、同じジョブを再実行した
+        場合は完了済みのタスクを再利用する。ワーカーが停止したタスクはリースの期限切れ後に
+        他のワーカーが取り直す。
+        """
+        self.task_queue.submit_job(job_key, plan, encoder)
+        status = 'failed'
+        try:
+            entry_segments = self.task_queue.wait_for_job(job_key, progress_callback=progress_callback)
+            
+            # 要素ごと・プロファイル順のパスを、プロファイルごとのセグメントの並びに組み替える
+            segments = [list(paths) for paths in zip(*entry_segments)]
+            with ThreadPoolExecutor(max_workers=len(output_paths)) as pool:
+                list(pool.map(
+                    lambda args: concat_segments(
+                        args[0], args[1], audiofile=audiofile, work_dir=workspace,
+                        faststart=encoder['faststart']
+                    ),
+                    zip(segments, output_paths)
+                ))
+            status = 'done'
+        finally:
+            # 同じジョブを待っている他のコーディネーターがいなければセグメントを削除する
+            self.task_queue.finish_job(job_key, status=status)
+        return output_paths
+    
+    def _mark_rendered(self, index):
+        """実行中のジョブでこの要素を実際にレンダリングしたことを記録する（推定モデルの較正用）"""
+        rendered = getattr(self._local, 'rendered', None)
+        if rendered is not None:
+            rendered.add(index)
+    
+    def export_entry(self, index, entry, profiles, encoder, workspace, checkpoint=None):
+        """タイムラインの1要素をプロファイルごとのセグメントとして書き出し、パスを返す"""
+        # テキストスライドはライブラリから取得
+        if entry['kind'] != 'scene' and self.segment_library is not None:
+            library = self.segment_library
+            if not all(os.path.exists(library.segment_path(self, entry['text'], entry['style'], profile, encoder))
+                       for profile in profiles):
+                self._mark_rendered(index)
+            return [
+                library.get_segment(self, entry['text'], entry['style'], profile, encoder)
+                for profile in profiles
+            ]
+        
+        # 前回の実行で完了しているセグメントは再利用する
+        if checkpoint is not None:
+            completed = checkpoint.completed_segments(index, profiles)
+            if completed:
+                return completed
+            paths = [checkpoint.partial_path(index, profile) for profile in profiles]
+        else:
+            paths = [os.path.join(workspace, f"{index:03d}_{profile['name']}.mp4") for profile in profiles]
+        
+        self._mark_rendered(index)
+        try:
+            self.write_frames(self.entry_clip(entry), profiles, paths, encoder)
+        finally:
+            # 書き出した要素のクリップは再利用しないため、すぐに解放する
+            self.release_entry_clip(entry)
+        if checkpoint is not None:
+            paths = checkpoint.commit(index, entry['kind'], profiles, paths)
+        return paths
+    
+    def render_signature(self, encoder):
+        """チェックポイントの再利用可否を判定するためのレンダリング設定"""
+        return {
+            'encoder': {key: value for key, value in encoder.items() if key != 'threads'},
+            'size': [self.width, self.height],
+            'fps': self.fps,
+            'font': self.font,
+            'font_size': self.font_size,
+            'caption': CAPTION_STYLE
+        }
+    
+    def default_config(self, output_filename="tiktok_video.mp4", bgm_path=None, output_profiles=None):
+        """インスタンスの既定値からレンダリング設定を作成する"""
+        return RenderConfig(
+            scene_duration=self.scene_duration,
+            add_title=self.add_title,
+            add_ending=self.add_ending,
+            bgm_path=bgm_path,
+            output_filename=output_filename,
+            output_profiles=tuple(output_profiles or ()),
+            encoder_profile=self.encoder_profile
         )
+    
+    def generate_video(self, scenes, media_dict, output_filename="tiktok_video.mp4", bgm_path=None,
+                       output_profiles=None, config=None, plan=None, progress_callback=None):
+        """動画を生成する
+
+        configを指定した場合はその設定でレンダリングし、他の引数は無視する。
+        planを指定した場合はplan_renderで作成済みの計画をそのまま実行する。
+        progress_callbackには進捗（0.0〜1.0）がタイムラインの要素ごとに渡される。
+        出力プロファイルを指定した場合は、共通のタイムラインから各プロファイルの
+        動画を書き出し、プロファイル名をキーとした出力パスの辞書を返す。
+        """
+        if config is None:
+            config = self.default_config(output_filename, bgm_path, output_profiles)
+        if plan is None:
+            plan = self.plan_render(scenes, media_dict, config)
+        
+        # 書き出すファイルの量が収まるスクラッチ領域を使う
+        scratch_bytes = estimate_scratch_bytes(plan['entries'], plan['profiles'])
+        # 同時実行中のジョブ数に応じてエンコードスレッド数を割り当てる
+        with encoder_job() as threads, scratch_workspace(scratch_bytes) as workspace, self._frame_lease():
+            encoder = dict(plan['encoder'], threads=threads)
+            start_time = time.time()
+            start_cpu = self._cpu_time()
+            
+            # メモリはこのジョブの実行中のみ計測する
+            self._local.rendered = set()
+            try:
+                with MemorySampler() as memory:
+                    result = self._render(plan, config, encoder, workspace, progress_callback)
+                rendered = self._local.rendered
+            finally:
+                self._local.rendered = None
+            
+            # 他のジョブと同時に実行しておらず、このホストでレンダリングした場合のみ推定モデルの較正に使う
+            # （チェックポイントやライブラリから再利用した要素は、実際の処理量に含めない）
+            if rendered and active_job_count() == 1 and self.task_queue is None:
+                rendered_plan = dict(plan, entries=[
+                    dict(entry, cached=False)
+                    for index, entry in enumerate(plan['entries']) if index in rendered
+                ])
+                self.cost_model.record(
+                    rendered_plan,
+                    cpu_seconds=self._cpu_time() - start_cpu,
+                    wall_seconds=time.time() - start_time,
+                    peak_memory_mb=memory.peak_mb
+                )
+            return result
+    
+    def _cpu_time(self):
+        """このプロセスと終了済みの子プロセス（ffmpeg）のCPU時間の合計"""
+        if resource is None:
+            # resourceモジュールがない環境（Windows）では子プロセスの分は含めない
+            return time.process_time()
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return (self_usage.ru_utime + self_usage.ru_stime
+                + children_usage.ru_utime + children_usage.ru_stime)
+    
+    def _render(self, plan, config, encoder, workspace, progress_callback=None):
+        """スクラッチディレクトリ内でレンダリングし、完成したファイルを出力先へ移動する"""
+        timeline = self.build_timeline(plan)
+        segmented = bool(config.output_profiles) or self.segment_library is not None \
+            or self.checkpoint_dir is not None or self.task_queue is not None
+        
+        # 全てのクリップを連結し、BGMを追加
+        final_clip = self.timeline_audio_clip(timeline, config.bgm_path, segmented=segmented)
+        
+        stem, ext = os.path.splitext(config.output_filename)
+        profiles = plan['profiles']
+        if config.output_profiles:
+            output_names = [f"{stem}_{profile['name']}{ext}" for profile in profiles]
+        else:
+            output_names = [config.output_filename]
+        work_paths = [os.path.join(workspace, name) for name in output_names]
+        
+        job_key = compute_job_key(plan, config, self.render_signature(encoder))
+        checkpoint = None
+        if self.checkpoint_dir is not None and self.task_queue is None:
+            checkpoint = RenderCheckpoint(self.checkpoint_dir, job_key)
+            if not checkpoint.acquire():
+                # 同じ内容のジョブが実行中の場合は、そのチェックポイントに触れずにレンダリングする
+                print(f"同じジョブを別のレンダリングが実行中のため、チェックポイントを使いません: {job_key}")
+                checkpoint = None
+        
+        try:
+            if segmented:
+                # 音声は一度だけミックスして各出力にストリームコピーする
+                audiofile = None
+                if final_clip.audio is not None:
+                    audiofile = self.write_audio(final_clip.audio, os.path.join(workspace, 'audio.m4a'))
+                
+                if self.task_queue is not None:
+                    # シーン単位のタスクをワーカーに任せ、共有ストレージのセグメントを連結する
+                    self.render_distributed(job_key, plan, encoder, work_paths, workspace,
+                                            audiofile=audiofile, progress_callback=progress_callback)
+                else:
+                    # シーン単位のセグメントを書き出して連結する
+                    self.export_segments(
+                        timeline, profiles, work_paths, encoder, workspace,
+                        checkpoint=checkpoint, audiofile=audiofile, progress_callback=progress_callback
+                    )
+            else:
+                # 動画を書き出し（全ての要素をレンダリングする）
+                for index in range(len(timeline)):
+                    self._mark_rendered(index)
+                final_clip.write_videofile(
+                    work_paths[0],
+                    fps=self.fps,
+                    codec=encoder['codec'],
+                    preset=encoder['preset'],
+                    audio_codec='aac',
+                    temp_audiofile=os.path.join(workspace, 'temp-audio.m4a'),
+                    remove_temp=True,
+                    threads=encoder['threads'],
+                    ffmpeg_params=encoder_ffmpeg_params(encoder)
+                )
+            
+            # 完成したファイルのみを出力先に移動する
+            output_paths = []
+            for name, work_path in zip(output_names, work_paths):
+                # プレビューをダウンロード完了前に開始できるよう、moov atomを先頭に置く
+                if encoder['faststart']:
+                    ensure_faststart(work_path)
+                output_path = os.path.join(self.output_dir, name)
+                shutil.move(work_path, output_path)
+                output_paths.append(output_path)
+            
+            if checkpoint is not None:
+                checkpoint.cleanup()
+        finally:
+            # 失敗した場合もロックだけを解放し、セグメントは再開用に残す
+            if checkpoint is not None:
+                checkpoint.release()
+        
+        if progress_callback:
+            progress_callback(1.0)
         
-        return output_path
+        if config.output_profiles:
+            return {profile['name']: path for profile, path in zip(profiles, output_paths)}
+        return output_paths[0]